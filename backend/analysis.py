@@ -0,0 +1,348 @@
+# analysis.py
+# Static passes over the submitted code: which locals the tracers watch, and which list
+# literal is the submitted array.
+
+import ast
+import operator
+
+# Names that never make sense as "variable" events
+IGNORED_NAMES = frozenset({"self", "new_target"})
+
+FUNCTION_NODES = (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda)
+
+class ScopeVisitor(ast.NodeVisitor):
+    """
+    Collects the names a single function assigns and reads. Nested functions are separate
+    scopes and are not entered; comprehensions are folded into the enclosing function.
+    """
+    def __init__(self):
+        super().__init__()
+        self.stored = set()
+        self.loaded = set()
+        self.declared = set()
+
+    def scan(self, node):
+        args = node.args
+        params = args.posonlyargs + args.args + args.kwonlyargs
+        params += [a for a in (args.vararg, args.kwarg) if a is not None]
+        self.stored.update(p.arg for p in params)
+        body = node.body if isinstance(node.body, list) else [node.body]
+        for stmt in body:
+            self.visit(stmt)
+        return self
+
+    def visit_Name(self, node):
+        if isinstance(node.ctx, ast.Load):
+            self.loaded.add(node.id)
+        else:
+            self.stored.add(node.id)
+
+    def visit_Global(self, node):
+        self.declared.update(node.names)
+
+    def visit_ExceptHandler(self, node):
+        if node.name:
+            self.stored.add(node.name)
+        self.generic_visit(node)
+
+    def visit_FunctionDef(self, node):
+        # The nested function's name is bound here; its body is its own scope
+        self.stored.add(node.name)
+        for expr in node.decorator_list + node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Lambda(self, node):
+        for expr in node.args.defaults + node.args.kw_defaults:
+            if expr is not None:
+                self.visit(expr)
+
+    def visit_ClassDef(self, node):
+        self.stored.add(node.name)
+
+def param_names(node):
+    args = node.args
+    return [a.arg for a in args.posonlyargs + args.args]
+
+def array_aliases(tree, arr_name):
+    """
+    Names the tracked array can be bound to: arr_name itself, plain `alias = arr` copies of
+    the reference, and parameters of module functions that are called with an alias.
+    """
+    functions = {node.name: node for node in ast.walk(tree)
+                 if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))}
+    aliases = {arr_name}
+    changed = True
+    while changed:
+        changed = False
+        for node in ast.walk(tree):
+            found = set()
+            if isinstance(node, ast.Assign) and isinstance(node.value, ast.Name):
+                if node.value.id in aliases:
+                    found.update(t.id for t in node.targets if isinstance(t, ast.Name))
+            elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+                    and node.func.id in functions):
+                callee = functions[node.func.id]
+                params = param_names(callee)
+                for i, arg in enumerate(node.args[:len(params)]):
+                    if isinstance(arg, ast.Name) and arg.id in aliases:
+                        found.add(params[i])
+                for keyword in node.keywords:
+                    if (keyword.arg and isinstance(keyword.value, ast.Name)
+                            and keyword.value.id in aliases):
+                        found.add(keyword.arg)
+            if not found <= aliases:
+                aliases |= found
+                changed = True
+    return aliases
+
+def watched_names(tree, arr_name):
+    """
+    Returns the frozenset of local names worth reporting: those both assigned and read in a
+    function that touches the tracked array (every function when there is no tracked array).
+    """
+    aliases = array_aliases(tree, arr_name) if arr_name is not None else None
+    watched = set()
+    for node in ast.walk(tree):
+        if not isinstance(node, FUNCTION_NODES):
+            continue
+        scope = ScopeVisitor().scan(node)
+        if aliases is not None and not (aliases & (scope.stored | scope.loaded)):
+            continue
+        watched |= (scope.stored & scope.loaded) - scope.declared
+    return frozenset(watched - IGNORED_NAMES)
+
+
+# Builtins that reach a list's methods without going through its type's overrides
+BYPASS_BUILTINS = frozenset({"super", "getattr", "__import__"})
+
+def bypasses_tracking(tree):
+    """
+    Whether the code could mutate a list without calling TrackedList's methods: it imports a
+    module (heapq and bisect write to lists from C), calls a list method unbound
+    (list.append(arr, x)), or reaches one through super(), getattr() or a dunder attribute.
+    """
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            return True
+        if isinstance(node, ast.Name) and node.id in BYPASS_BUILTINS:
+            return True
+        if isinstance(node, ast.Attribute):
+            if isinstance(node.value, ast.Name) and node.value.id == "list":
+                return True
+            if node.attr.startswith("__") and node.attr.endswith("__"):
+                return True
+    return False
+
+
+# Most list, tuple and string elements folding an initial array's expression may build in
+# all, and largest integer (in bits), so `[0] * 10**9` is rejected instead of allocated
+FOLD_MAX_ELEMENTS = 100_000
+FOLD_MAX_INT_BITS = 4096
+
+FOLD_OPERATORS = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.FloorDiv: operator.floordiv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+}
+
+# Builtins whose call returns a list, so an unfoldable binding to one can be the array
+LIST_BUILDERS = frozenset({"list", "sorted"})
+
+class NotConstant(Exception):
+    """Raised by fold_constant for an expression it can't (or won't) evaluate."""
+
+def initial_array(tree):
+    """
+    Returns (initial_arr, arr_name): the submitted array and the name it is bound to, from
+    the first `name = <expr>` assignment whose value folds to a list (see fold_constant).
+    Module-level statements come first; without a folding one, the first module-level
+    binding that can build a list at runtime (see _may_build_list) is still returned, with
+    initial_arr None, as that list is adopted then (see watcher.TrackingDict). Function bodies are only searched when the module binds nothing;
+    (None, None) if nothing is found there either.
+    """
+    node, value = array_binding(tree)
+    if node is None:
+        return None, None
+    target = node.targets[0] if isinstance(node, ast.Assign) else node.target
+    return value, target.id
+
+def array_binding(tree):
+    """
+    Returns (node, initial_arr) for the assignment initial_array takes the submitted array
+    from, initial_arr being None for an unfoldable value; (None, None) if there is none.
+    """
+    module_level, functions = _split_scopes(tree)
+    node, value = _first_binding(module_level, any_expression=True)
+    if node is not None:
+        return node, value
+    nested = [node for function in functions for node in ast.walk(function)]
+    return _first_binding(nested, any_expression=False)
+
+def _split_scopes(tree):
+    """
+    Returns (module_level, functions): the nodes outside any function or class body,
+    breadth-first, and the outermost function and class nodes, in the same order.
+    """
+    module_level, functions = [], []
+    queue = [tree]
+    for node in queue:
+        for child in ast.iter_child_nodes(node):
+            if isinstance(child, FUNCTION_NODES + (ast.ClassDef,)):
+                functions.append(child)
+            else:
+                module_level.append(child)
+                queue.append(child)
+    return module_level, functions
+
+def _first_binding(nodes, any_expression):
+    """
+    array_binding over nodes: the first `name = <expr>` whose value folds to a list, else
+    the first unfoldable list display or comprehension, else (with any_expression) the first
+    unfoldable value that can still build a list (see _may_build_list).
+    """
+    fallback = other = None
+    for node in nodes:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1:
+            target = node.targets[0]
+        elif isinstance(node, ast.AnnAssign) and node.value is not None:
+            target = node.target
+        else:
+            continue
+        if not isinstance(target, ast.Name):
+            continue
+        try:
+            value = fold_constant(node.value)
+        except NotConstant:
+            if isinstance(node.value, (ast.List, ast.ListComp)):
+                fallback = fallback or node
+            elif any_expression and _may_build_list(node.value):
+                other = other or node
+            continue
+        if type(value) is list:
+            return node, value
+    return fallback or other, None
+
+def _may_build_list(node):
+    """
+    Whether an unfoldable value can be a list: a display or comprehension, a list() or
+    sorted() call, a method or module function call (`values.copy()`, `random.sample(...)`),
+    or arithmetic or slicing on one of these.
+    """
+    if isinstance(node, (ast.List, ast.ListComp)):
+        return True
+    if isinstance(node, ast.Call):
+        return (isinstance(node.func, ast.Attribute)
+                or isinstance(node.func, ast.Name) and node.func.id in LIST_BUILDERS)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, (ast.Add, ast.Mult)):
+        return _may_build_list(node.left) or _may_build_list(node.right)
+    if isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice):
+        return _may_build_list(node.value)
+    return False
+
+def fold_constant(node, budget=None):
+    """
+    Evaluates a constant expression: literals, displays, unary and binary arithmetic, slices,
+    and list(), range() and sorted() calls (sorted with reverse=). Raises NotConstant for
+    anything else, once the lists, tuples and strings it builds add up to more than
+    FOLD_MAX_ELEMENTS elements, and for integers over FOLD_MAX_INT_BITS, checked before each
+    is built. budget is the running total's remainder, shared by the recursive calls.
+    """
+    if budget is None:
+        budget = [FOLD_MAX_ELEMENTS]
+    if isinstance(node, ast.Constant):
+        if isinstance(node.value, (int, float, str, type(None))):
+            return node.value
+    elif isinstance(node, (ast.List, ast.Tuple)):
+        _spend(budget, len(node.elts), node)
+        values = [fold_constant(element, budget) for element in node.elts]
+        return values if isinstance(node, ast.List) else tuple(values)
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        operand = fold_constant(node.operand, budget)
+        if isinstance(operand, (int, float)):
+            return -operand if isinstance(node.op, ast.USub) else +operand
+    elif isinstance(node, ast.BinOp) and type(node.op) in FOLD_OPERATORS:
+        left, right = fold_constant(node.left, budget), fold_constant(node.right, budget)
+        _spend(budget, _check_bin_op(node, left, right), node)
+        try:
+            return FOLD_OPERATORS[type(node.op)](left, right)
+        except (ArithmeticError, TypeError, ValueError):
+            raise NotConstant(node) from None
+    elif isinstance(node, ast.Subscript) and isinstance(node.slice, ast.Slice):
+        value = fold_constant(node.value, budget)
+        bounds = [fold_constant(part, budget) if part is not None else None
+                  for part in (node.slice.lower, node.slice.upper, node.slice.step)]
+        if isinstance(value, (list, tuple, str, range)):
+            try:
+                if not isinstance(value, range):
+                    _spend(budget, len(range(len(value))[slice(*bounds)]), node)
+                return value[slice(*bounds)]
+            except (TypeError, ValueError):
+                pass
+    elif (isinstance(node, ast.Call) and isinstance(node.func, ast.Name)
+            and node.func.id in ("list", "range", "sorted")):
+        args = [fold_constant(arg, budget) for arg in node.args]
+        keywords = {keyword.arg: fold_constant(keyword.value, budget) for keyword in node.keywords}
+        try:
+            if node.func.id == "range" and not keywords:
+                value = range(*args)
+                if len(value) > FOLD_MAX_ELEMENTS:
+                    raise NotConstant(node)
+                return value
+            if len(args) == 1 and isinstance(args[0], (list, tuple, str, range)):
+                if node.func.id == "list" and not keywords:
+                    _spend(budget, len(args[0]), node)
+                    return list(args[0])
+                if node.func.id == "sorted" and set(keywords) <= {"reverse"}:
+                    _spend(budget, len(args[0]), node)
+                    return sorted(args[0], reverse=bool(keywords.get("reverse", False)))
+        except (TypeError, ValueError, OverflowError):
+            pass
+    raise NotConstant(node)
+
+def _spend(budget, elements, node):
+    """Takes elements off fold_constant's budget, raising NotConstant once it runs out."""
+    budget[0] -= elements
+    if budget[0] < 0:
+        raise NotConstant(node)
+
+def _check_bin_op(node, left, right):
+    """
+    Raises NotConstant if left <op> right would be too big to build, else returns the number
+    of elements the result is (0 for a number).
+    """
+    op = type(node.op)
+    if op is ast.Mult and isinstance(right, int) and isinstance(left, (list, tuple, str)):
+        left, right = right, left
+    if op is ast.Mult and isinstance(left, int) and isinstance(right, (list, tuple, str)):
+        if left * _weight(right) > FOLD_MAX_ELEMENTS:
+            raise NotConstant(node)
+        return max(left, 0) * len(right)
+    elif op is ast.Add and isinstance(left, (list, tuple, str)):
+        if _weight(left) + _weight(right) > FOLD_MAX_ELEMENTS:
+            raise NotConstant(node)
+        if isinstance(right, (list, tuple, str)):
+            return len(left) + len(right)
+    elif isinstance(left, int) and isinstance(right, int):
+        bits = max(left.bit_length(), right.bit_length())
+        if op is ast.Pow:
+            bits = left.bit_length() * abs(right)
+        elif op is ast.Mult:
+            bits = left.bit_length() + right.bit_length()
+        if bits > FOLD_MAX_INT_BITS:
+            raise NotConstant(node)
+    return 0
+
+def _weight(value):
+    """Number of elements in value, counting those of nested lists and tuples (len for str)."""
+    if isinstance(value, str):
+        return len(value)
+    if isinstance(value, (list, tuple)):
+        return len(value) + sum(_weight(v) for v in value if isinstance(v, (list, tuple, str)))
+    return 1
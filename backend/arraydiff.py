@@ -0,0 +1,87 @@
+# arraydiff.py
+# Edit scripts between two versions of a list: linear-time diffs for the array mutations
+# that TrackedList can't record as they happen (see watcher.ArrayDiffer), and the
+# permutations a sort or reverse applies.
+
+def edit_script(old, new):
+    """
+    Edits turning old into new when applied in order: ("replace", i, value), ("swap", i, j),
+    ("insert", i, value) and ("delete", i).
+
+    Both a positional comparison and one trimmed of the common suffix (which turns a shifted
+    tail into a single insert or delete run) are tried, and the shorter script is returned.
+    Linear in len(old) + len(new).
+    """
+    limit = min(len(old), len(new))
+    start = 0
+    while start < limit and _same(old[start], new[start]):
+        start += 1
+    end = 0
+    while end < limit - start and _same(old[-1 - end], new[-1 - end]):
+        end += 1
+    positional = _script(old, new, start, 0)
+    if end == 0:
+        return positional
+    return min(positional, _script(old, new, start, end), key=len)
+
+def _same(a, b):
+    return a is b or a == b
+
+def _script(old, new, start, end):
+    """Edits for old[start:len(old) - end] -> new[start:len(new) - end]."""
+    old_end, new_end = len(old) - end, len(new) - end
+    overlap = min(old_end, new_end)
+    edits = _replacements(old, new, start, overlap)
+    if new_end > overlap:
+        edits.extend(("insert", i, new[i]) for i in range(overlap, new_end))
+    elif old_end > overlap:
+        if end == 0:
+            # Deleting from the back keeps every index below stable
+            edits.extend(("delete", i) for i in range(old_end - 1, overlap - 1, -1))
+        else:
+            edits.extend([("delete", overlap)] * (old_end - overlap))
+    return edits
+
+def _replacements(old, new, lo, hi):
+    """Replaces for the differing positions in lo..hi, pairing neighbouring exchanges into swaps."""
+    changed = [i for i in range(lo, hi) if not _same(old[i], new[i])]
+    edits = []
+    k = 0
+    while k < len(changed):
+        i = changed[k]
+        if k + 1 < len(changed):
+            j = changed[k + 1]
+            if _same(old[i], new[j]) and _same(old[j], new[i]):
+                edits.append(("swap", i, j))
+                k += 2
+                continue
+        edits.append(("replace", i, new[i]))
+        k += 1
+    return edits
+
+def sort_permutation(values, *, key=None, reverse=False):
+    """
+    The permutation list.sort(key=key, reverse=reverse) applies to values, as the list of
+    old indices in their new order. Sorts decorated indices, so it is O(n log n), calls key
+    once per element and is exactly as stable as list.sort.
+    """
+    # Always a plain list, so keys.__getitem__ is list's own (values may be a CountingList)
+    keys = list(values) if key is None else [key(value) for value in values]
+    return sorted(range(len(keys)), key=keys.__getitem__, reverse=reverse)
+
+def permutation_swaps(permutation):
+    """
+    Yields the fewest (i, j) swaps that rearrange a list by permutation (new[k] = old[permutation[k]]):
+    one fewer than the length of each of its cycles.
+    """
+    seen = [False] * len(permutation)
+    for start, source in enumerate(permutation):
+        if seen[start] or source == start:
+            continue
+        seen[start] = True
+        k = start
+        while permutation[k] != start:
+            j = permutation[k]
+            seen[j] = True
+            yield k, j
+            k = j
@@ -0,0 +1,117 @@
+# bench_engines.py
+# Per-line tracing overhead of each engine on watcher.BUBBLE_SORT_SAMPLE.
+#
+# --memory reports the memory each engine's trace retains per event instead, and --profile
+# the sample's hits and time per line (see lineprofile.py).
+#
+#   python bench_engines.py [--size N] [--repeat R] [--memory | --profile]
+
+import argparse
+import gc
+import sys
+import time
+import tracemalloc
+
+from watcher import BUBBLE_SORT_SAMPLE, ENGINES, USER_FILENAME, run_user_code
+
+def sample_code(size):
+    """The bubble sort sample with its array replaced by a reversed range of the given size."""
+    code = list(BUBBLE_SORT_SAMPLE)
+    if size is not None:
+        idx = next(i for i, line in enumerate(code) if line.startswith("arr = ["))
+        code[idx] = f"arr = {list(range(size, 0, -1))}"
+    return code
+
+def count_user_lines(code_lines):
+    """Number of line events the tracer sees in user functions (the module body is skipped)."""
+    code = compile("\n".join(code_lines), USER_FILENAME, "exec")
+    count = 0
+
+    def tracer(frame, event, arg):
+        nonlocal count
+        if event == "line" and frame.f_code.co_filename == USER_FILENAME and frame.f_code.co_name != "<module>":
+            count += 1
+        return tracer
+
+    env = {"print": lambda *a, **k: None}
+    sys.settrace(tracer)
+    try:
+        exec(code, env)
+    finally:
+        sys.settrace(None)
+    return count
+
+def best_of(repeat, fn):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+def bytes_per_event(fn):
+    """Memory held by fn's run_user_code result (trace, line_nums and keyframes) per event."""
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.get_traced_memory()[0]
+        result = fn()
+        gc.collect()
+        retained = tracemalloc.get_traced_memory()[0] - before
+    finally:
+        tracemalloc.stop()
+    return retained / max(len(result[2]), 1), len(result[2])
+
+def print_profile(code_lines):
+    """Hits, microseconds and share of the total time of every line, under settrace."""
+    profile = run_user_code(code_lines, profile=True)[4]["profile"]
+    total = sum(profile["time_ns"][1:]) or 1
+    print(f"{'hits':>8} {'us':>10} {'%':>6}")
+    for lineno, line in enumerate(code_lines, 1):
+        hits, time_ns = profile["hits"][lineno], profile["time_ns"][lineno]
+        print(f"{hits:8} {time_ns / 1e3:10.1f} {100 * time_ns / total:5.1f}%  {line}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-line tracing overhead of each engine.")
+    parser.add_argument("--size", type=int, default=None, help="array length (default: the sample's 7)")
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--memory", action="store_true",
+                        help="report retained bytes per event (delta trace) instead of time")
+    parser.add_argument("--profile", action="store_true",
+                        help="report the sample's hits and time per line instead")
+    args = parser.parse_args()
+
+    code_lines = sample_code(args.size)
+    if args.profile:
+        print_profile(code_lines)
+        return
+    if args.memory:
+        print(f"python {sys.version.split()[0]}, delta trace (keyframe_interval=32)")
+        for engine in ENGINES:
+            try:
+                run = lambda: run_user_code(code_lines, keyframe_interval=32, engine=engine)
+                run()  # compile and warm caches outside the measurement
+                per_event, events = bytes_per_event(run)
+            except ValueError as e:
+                print(f"{engine:>12}: skipped ({e})")
+                continue
+            print(f"{engine:>12}: {per_event:7.1f} B/event over {events} events")
+        return
+
+    lines = count_user_lines(code_lines)
+    code = compile("\n".join(code_lines), USER_FILENAME, "exec")
+    baseline = best_of(args.repeat, lambda: exec(code, {"print": lambda *a, **k: None}))
+
+    print(f"python {sys.version.split()[0]}, {lines} traced line events")
+    print(f"{'untraced':>12}: {baseline * 1e3:9.3f} ms")
+    for engine in ENGINES:
+        try:
+            elapsed = best_of(args.repeat, lambda: run_user_code(code_lines, engine=engine))
+        except ValueError as e:
+            print(f"{engine:>12}: skipped ({e})")
+            continue
+        per_line = (elapsed - baseline) / max(lines, 1)
+        print(f"{engine:>12}: {elapsed * 1e3:9.3f} ms  ({per_line * 1e6:7.3f} us/line overhead)")
+
+if __name__ == "__main__":
+    main()
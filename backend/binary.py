@@ -0,0 +1,98 @@
+# binary.py
+# Compact binary trace format, opt-in on /api/submit_code: the columnar layout (see
+# columnar.py) with its integer columns varint-packed and everything else in a JSON header.
+#
+#   b"IMTR" | version byte | varint header length | header (UTF-8 JSON) | columns
+#
+# Each column in COLUMNS order is a varint count followed by that many unsigned varints.
+# "line" is stored as line + 1 (0 for null), "index" and "index2" zigzag-encoded, and
+# "state_steps" as gaps from the previous step.
+
+import json
+
+from encoding import dumps
+
+BINARY_MEDIA_TYPE = "application/vnd.imaginarray.trace"
+
+MAGIC = b"IMTR"
+VERSION = 2
+
+COLUMNS = ("shape", "line", "array", "index", "index2", "value", "name", "state_steps")
+
+# columnar.to_columns fields that go in the header rather than a packed column
+HEADER_FIELDS = ("shapes", "values", "states", "extra")
+
+def to_binary(fields, columns):
+    """Encodes the response fields (initial_arr, final_arr, ...) and a to_columns trace."""
+    header = dumps({**fields, **{name: columns[name] for name in HEADER_FIELDS}}).encode()
+    out = bytearray(MAGIC)
+    out.append(VERSION)
+    pack_varints([len(header)], out)
+    out += header
+
+    steps = columns["state_steps"]
+    packed = {
+        "line": [0 if line is None else line + 1 for line in columns["line"]],
+        "index": [zigzag(i) for i in columns["index"]],
+        "index2": [zigzag(i) for i in columns["index2"]],
+        "state_steps": [step - previous for previous, step in zip([0] + steps, steps)],
+    }
+    for name in COLUMNS:
+        numbers = packed.get(name, columns[name])
+        pack_varints([len(numbers)], out)
+        pack_varints(numbers, out)
+    return bytes(out)
+
+def zigzag(n):
+    return n * 2 if n >= 0 else -n * 2 - 1
+
+def pack_varints(numbers, out):
+    """Appends numbers to out as LEB128 varints (7 bits per byte, high bit = more to come)."""
+    if not numbers or max(numbers) < 0x80:
+        out += bytes(numbers)
+        return
+    for n in numbers:
+        while n >= 0x80:
+            out.append((n & 0x7F) | 0x80)
+            n >>= 7
+        out.append(n)
+
+def from_binary(data):
+    """Decodes to_binary's output back into (fields, columns)."""
+    if data[:4] != MAGIC or data[4] != VERSION:
+        raise ValueError(f"Not a version {VERSION} binary trace")
+    header_length, pos = unpack_varint(data, 5)
+    header = json.loads(data[pos:pos + header_length])
+    pos += header_length
+
+    columns = {name: header.pop(name) for name in HEADER_FIELDS}
+    for name in COLUMNS:
+        count, pos = unpack_varint(data, pos)
+        numbers = []
+        for _ in range(count):
+            n, pos = unpack_varint(data, pos)
+            numbers.append(n)
+        columns[name] = numbers
+    columns["line"] = [None if line == 0 else line - 1 for line in columns["line"]]
+    columns["index"] = [unzigzag(i) for i in columns["index"]]
+    columns["index2"] = [unzigzag(i) for i in columns["index2"]]
+    steps, step = [], 0
+    for gap in columns["state_steps"]:
+        step += gap
+        steps.append(step)
+    columns["state_steps"] = steps
+    return header, columns
+
+def unzigzag(n):
+    return n // 2 if n % 2 == 0 else -(n + 1) // 2
+
+def unpack_varint(data, pos):
+    """Reads one varint at data[pos]; returns (value, position after it)."""
+    n = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        n |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return n, pos
+        shift += 7
@@ -0,0 +1,147 @@
+# columnar.py
+# Struct-of-arrays wire format for traces, opt-in on /api/submit_code (see server.py).
+#
+# Instead of one object per event, every field gets its own array with one entry per event
+# (null where the event has no such field), values are interned in one shared table, and
+# an array event only keeps its "state" when replaying the deltas can't reproduce it (or
+# every KEYFRAME_INTERVAL events of an array, for seeking). line_nums is the "line" column.
+
+from encoding import SCALAR_TYPES, dumps
+from replay import MAIN_ARRAY, NON_ARRAY_EVENTS, apply_delta
+
+# Response media type, also selected with ?format=columnar
+COLUMNAR_MEDIA_TYPE = "application/vnd.imaginarray.columnar+json"
+
+# Events of one array between the "state" keyframes kept even where the deltas replay fine
+KEYFRAME_INTERVAL = 32
+
+# Event fields stored in columns, in shape order; any other field goes to "extra"
+SHAPE_FIELDS = ("array", "index", "indices", "value", "popped", "name", "op", "result", "depth",
+                "args")
+COLUMN_FIELDS = frozenset(SHAPE_FIELDS + ("type", "line", "state"))
+
+def to_columns(initial_arr, manipulations):
+    """
+    Encodes manipulations as {"shapes", "values", "shape", "line", "array", "index",
+    "index2", "value", "name", "state_steps", "states", "extra"}:
+
+    - shape holds one code per event into shapes, whose entries are [type, fields]: the
+      event's type and which of SHAPE_FIELDS it has.
+    - array, index, index2, value and name only have entries for the events whose shape
+      has the field, in event order: index2 is a swap's second index, value also takes a
+      pop's "popped", a compare's "op" and "result" and a call's "depth" and "args", and
+      value and name hold ids into values.
+    - line has an entry (possibly null) for every event.
+    - states[i] is the "state" of event state_steps[i].
+    - extra maps a step to its remaining fields (like sort's args).
+    """
+    shapes, shape_codes = [], {}
+    values, value_ids = [], {}
+
+    def intern(value):
+        key = (type(value), value) if type(value) in SCALAR_TYPES else (list, dumps(value))
+        value_id = value_ids.get(key)
+        if value_id is None:
+            value_id = value_ids[key] = len(values)
+            values.append(value)
+        return value_id
+
+    shape_column, line_column, array_column = [], [], []
+    index_column, index2_column = [], []
+    value_column, name_column = [], []
+    state_steps, states, extra = [], [], {}
+
+    # Replayed state and events since the last kept keyframe, per array id
+    arrays = {MAIN_ARRAY: list(initial_arr)}
+    since_keyframe = {}
+    for step, m in enumerate(manipulations):
+        kind = m["type"]
+        fields = tuple(field for field in SHAPE_FIELDS if field in m)
+        code = shape_codes.get((kind, fields))
+        if code is None:
+            code = shape_codes[kind, fields] = len(shapes)
+            shapes.append([kind, list(fields)])
+        shape_column.append(code)
+        line_column.append(m.get("line"))
+
+        for field in fields:
+            if field == "array":
+                array_column.append(m["array"])
+            elif field == "index":
+                index_column.append(m["index"])
+            elif field == "indices":
+                index_column.append(m["indices"][0])
+                index2_column.append(m["indices"][1])
+            elif field == "name":
+                name_column.append(intern(m["name"]))
+            else:
+                value_column.append(intern(m[field]))
+
+        if kind not in NON_ARRAY_EVENTS:
+            array = m.get("array", MAIN_ARRAY)
+            state = arrays.get(array)
+            try:
+                replayed = apply_delta(state, m) if state is not None else None
+            except (IndexError, ValueError, TypeError):
+                replayed = None
+            since = since_keyframe.get(array, KEYFRAME_INTERVAL)
+            if "state" in m:
+                # A new_array's state is the only record of its contents
+                if replayed != m["state"] or since >= KEYFRAME_INTERVAL or kind == "new_array":
+                    state_steps.append(step)
+                    states.append(m["state"])
+                    since = 0
+                arrays[array] = list(m["state"])
+            else:
+                arrays[array] = replayed
+            since_keyframe[array] = since + 1
+
+        if not COLUMN_FIELDS.issuperset(m):
+            extra[step] = {k: v for k, v in m.items() if k not in COLUMN_FIELDS}
+
+    return {
+        "shapes": shapes,
+        "values": values,
+        "shape": shape_column,
+        "line": line_column,
+        "array": array_column,
+        "index": index_column,
+        "index2": index2_column,
+        "value": value_column,
+        "name": name_column,
+        "state_steps": state_steps,
+        "states": states,
+        "extra": extra,
+    }
+
+def from_columns(columns):
+    """Decodes to_columns' output back into a manipulations list (without the dropped states)."""
+    values = columns["values"]
+    array_column = iter(columns["array"])
+    index_column, index2_column = iter(columns["index"]), iter(columns["index2"])
+    value_column, name_column = iter(columns["value"]), iter(columns["name"])
+    states = dict(zip(columns["state_steps"], columns["states"]))
+    extra = {int(step): fields for step, fields in columns["extra"].items()}
+    manipulations = []
+    for step, code in enumerate(columns["shape"]):
+        kind, fields = columns["shapes"][code]
+        m = {"type": kind}
+        line = columns["line"][step]
+        if line is not None:
+            m["line"] = line
+        for field in fields:
+            if field == "array":
+                m["array"] = next(array_column)
+            elif field == "index":
+                m["index"] = next(index_column)
+            elif field == "indices":
+                m["indices"] = [next(index_column), next(index2_column)]
+            elif field == "name":
+                m["name"] = values[next(name_column)]
+            else:
+                m[field] = values[next(value_column)]
+        if step in states:
+            m["state"] = states[step]
+        m.update(extra.get(step, ()))
+        manipulations.append(m)
+    return manipulations
@@ -0,0 +1,100 @@
+# counters.py
+# Per-run operation counts, returned as meta["counters"] by run_user_code(count_ops=True).
+#
+# Reads, comparisons and lines are counted as they happen (see watcher.CountingList and
+# instrument.CompareTransformer); writes and swaps are tallied from the finished trace, so
+# counting them costs nothing while the code runs. A run that keeps no trace
+# (run_user_code(record_events=False)) tallies them into a WriteTally instead.
+
+class OpCounters:
+    """
+    reads: index reads of a tracked array (arr[i], not iteration or `in`).
+    comparisons: single <, <=, >, >=, == or != comparisons whose operands read a tracked array.
+    lines: line events of the user's code; None for the "ast" engine, which has no line hook.
+    writes, swaps: what a WriteTally has already tallied and dropped.
+    """
+    __slots__ = ("reads", "comparisons", "lines", "writes", "swaps")
+
+    def __init__(self, count_lines=True):
+        self.reads = 0
+        self.comparisons = 0
+        self.lines = 0 if count_lines else None
+        self.writes = 0
+        self.swaps = 0
+
+    def to_dict(self, manipulations):
+        writes, swaps = tally_writes(manipulations)
+        return {
+            "reads": self.reads,
+            "writes": self.writes + writes,
+            "swaps": self.swaps + swaps,
+            "comparisons": self.comparisons,
+            "lines": self.lines,
+        }
+
+def tally_writes(manipulations):
+    """
+    Returns (writes, swaps) for a trace: writes counts the array elements its events stored
+    (a swap stores two, a sort or reverse every element it moved), swaps the "swap" events.
+    """
+    writes = swaps = 0
+    for m in manipulations:
+        event_writes, event_swaps = tally_event(m)
+        writes += event_writes
+        swaps += event_swaps
+    return writes, swaps
+
+def tally_event(m):
+    """(writes, swaps) for one event, as tally_writes counts them."""
+    kind = m["type"]
+    if kind in ("append", "insert", "replace", "pop", "remove"):
+        return 1, 0
+    if kind == "swap":
+        return 2, 1
+    if kind == "extend":
+        return len(m["value"]), 0
+    if kind in ("sort", "reverse"):
+        return sum(1 for k, i in enumerate(m["permutation"]) if k != i), 0
+    return 0, 0
+
+class WriteTally(list):
+    """
+    The manipulations list of a run that only counts. Each event is tallied into counters'
+    writes and swaps once a newer one arrives, and dropped; the newest is held back, since
+    TrackedList may still pop it to fold it into a swap. OpCounters.to_dict tallies that last one.
+    """
+    def __init__(self, counters):
+        super().__init__()
+        self.counters = counters
+
+    def append(self, event):
+        if self:
+            writes, swaps = tally_event(self.pop())
+            self.counters.writes += writes
+            self.counters.swaps += swaps
+        super().append(event)
+
+class ClockedLog(list):
+    """
+    The manipulations list of a run with clock=True (see watcher.run_user_code). ticks holds,
+    for each event, the run's operation count when it was recorded: reads and comparisons so
+    far plus the writes of the events up to and including it. The counters are the same under
+    every engine, so the ticks of different programs line up (see server.race).
+    """
+    def __init__(self, counters):
+        super().__init__()
+        self.counters = counters
+        self.writes = 0
+        self.ticks = []
+
+    def append(self, event):
+        self.writes += tally_event(event)[0]
+        counters = self.counters
+        self.ticks.append(counters.reads + counters.comparisons + self.writes)
+        super().append(event)
+
+    def pop(self, index=-1):
+        event = super().pop(index)
+        self.writes -= tally_event(event)[0]
+        self.ticks.pop(index)
+        return event
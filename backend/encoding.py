@@ -0,0 +1,48 @@
+# encoding.py
+# Turns traced values into JSON-safe data once, when they are recorded, so a trace can be
+# pickled to the server and encoded to JSON in a single pass with no scrubbing.
+
+import json
+
+from events import Event
+
+# Exact types JSON encodes as they are; every other value goes through json_safe's slow path
+SCALAR_TYPES = frozenset({str, int, float, bool, type(None)})
+
+def json_safe(value):
+    """
+    value as JSON-safe data: scalars unchanged, lists and tuples as new lists, dicts with
+    string keys, functions as "<function name>" and anything else as its str().
+    """
+    if type(value) in SCALAR_TYPES:
+        return value
+    if isinstance(value, (list, tuple)):
+        if SCALAR_TYPES.issuperset(map(type, value)):
+            return list(value)
+        return [json_safe(v) for v in value]
+    if isinstance(value, dict):
+        return {k if type(k) in SCALAR_TYPES else str(k): json_safe(v) for k, v in value.items()}
+    if isinstance(value, (str, int, float)):
+        return value
+    return json_fallback(value)
+
+def json_fallback(value):
+    """The encoder's default hook: trace events as their dicts, and how other values are shown."""
+    if isinstance(value, Event):
+        return value.to_dict()
+    if callable(value) and hasattr(value, "__name__"):
+        return f"<function {value.__name__}>"
+    return str(value)
+
+def stable_repr(value):
+    """
+    repr(value), but functions as "<function qualname>", without the memory address that
+    changes from run to run, so the same program always records the same trace.
+    """
+    if callable(value) and hasattr(value, "__qualname__"):
+        return f"<function {value.__qualname__}>"
+    return repr(value)
+
+def dumps(obj):
+    """Encodes a trace (or any response) to JSON in one pass."""
+    return json.dumps(obj, default=json_fallback, separators=(",", ":"))
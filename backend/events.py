@@ -0,0 +1,254 @@
+# events.py
+# Trace events as __slots__ records, one class per event type. Recording an event allocates
+# one small object instead of a dict (plus the kwargs dict that built it). Events read like
+# the dicts they replace (event["line"], "state" in event, event.get("type")), so replay and
+# the wire formats take either, and only become dicts at the edge: to_dict, which the JSON
+# encoders call through encoding.json_fallback.
+
+class Event:
+    """
+    Base of every event. fields names the payload keys in to_dict order; they are slots,
+    except where a subclass derives one (Swap's "indices"). optional names the slots that
+    are only keys once set, after "line".
+    """
+    __slots__ = ("line",)
+    type = None
+    fields = ()
+    optional = ()
+
+    def __init_subclass__(cls):
+        super().__init_subclass__()
+        cls._keys = frozenset(("type", "line") + cls.fields + cls.optional)
+
+    def to_dict(self):
+        d = {"type": self.type}
+        for name in self.fields:
+            d[name] = getattr(self, name)
+        d["line"] = self.line
+        for name in self.optional:
+            if hasattr(self, name):
+                d[name] = getattr(self, name)
+        return d
+
+    def keys(self):
+        keys = ("type",) + self.fields + ("line",)
+        return keys + tuple(name for name in self.optional if hasattr(self, name))
+
+    def __getitem__(self, key):
+        if key in self._keys:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                pass
+        raise KeyError(key)
+
+    def __contains__(self, key):
+        return key in self._keys and hasattr(self, key)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def get(self, key, default=None):
+        if key in self._keys:
+            return getattr(self, key, default)
+        return default
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def __eq__(self, other):
+        if isinstance(other, Event):
+            other = other.to_dict()
+        return self.to_dict() == other
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+    def __reduce__(self):
+        # Constructor arguments are line followed by the class's own slots, in order
+        args = (self.line,) + tuple(getattr(self, name, None) for name in type(self).__slots__)
+        optional = {name: getattr(self, name) for name in self.optional if hasattr(self, name)}
+        if optional:
+            return type(self), args, (None, optional)
+        return type(self), args
+
+class ArrayEvent(Event):
+    """
+    A TrackedList mutation. "array" is the id of the list it happened to (0 for the submitted
+    array) and "state" is only set on keyframes (see watcher.TrackedList).
+    """
+    __slots__ = ("array", "state")
+    optional = __slots__
+
+class NewArray(ArrayEvent):
+    """
+    Declares a list the program created, right before its first recorded mutation: its id,
+    contents ("state") and, for a table's row, the "parent" array and "index" it was read at.
+    """
+    __slots__ = ("parent", "index")
+    type = "new_array"
+    optional = ("array", "parent", "index", "state")
+
+    def __init__(self, line, parent=None, index=None):
+        self.line = line
+        if parent is not None:
+            self.parent = parent
+            self.index = index
+
+class Append(ArrayEvent):
+    __slots__ = ("value",)
+    type = "append"
+    fields = __slots__
+
+    def __init__(self, line, value):
+        self.line = line
+        self.value = value
+
+class Pop(ArrayEvent):
+    __slots__ = ("index", "popped")
+    type = "pop"
+    fields = __slots__
+
+    def __init__(self, line, index, popped):
+        self.line = line
+        self.index = index
+        self.popped = popped
+
+class Replace(ArrayEvent):
+    __slots__ = ("index", "value")
+    type = "replace"
+    fields = __slots__
+
+    def __init__(self, line, index, value):
+        self.line = line
+        self.index = index
+        self.value = value
+
+class Swap(ArrayEvent):
+    __slots__ = ("index", "index2")
+    type = "swap"
+    fields = ("indices",)
+
+    def __init__(self, line, index, index2):
+        self.line = line
+        self.index = index
+        self.index2 = index2
+
+    @property
+    def indices(self):
+        return [self.index, self.index2]
+
+class Insert(ArrayEvent):
+    __slots__ = ("index", "value")
+    type = "insert"
+    fields = __slots__
+
+    def __init__(self, line, index, value):
+        self.line = line
+        self.index = index
+        self.value = value
+
+class Remove(ArrayEvent):
+    __slots__ = ("value",)
+    type = "remove"
+    fields = __slots__
+
+    def __init__(self, line, value):
+        self.line = line
+        self.value = value
+
+class Extend(ArrayEvent):
+    __slots__ = ("value",)
+    type = "extend"
+    fields = __slots__
+
+    def __init__(self, line, value):
+        self.line = line
+        self.value = value
+
+class Reverse(ArrayEvent):
+    """permutation lists the old indices in their new order (see Sort)."""
+    __slots__ = ("permutation",)
+    type = "reverse"
+    fields = __slots__
+
+    def __init__(self, line, permutation):
+        self.line = line
+        self.permutation = permutation
+
+class Sort(ArrayEvent):
+    """
+    The array after a sort is [old[i] for i in permutation]; args and kwargs are repr'd
+    (functions by name, see encoding.stable_repr).
+    """
+    __slots__ = ("args", "kwargs", "permutation")
+    type = "sort"
+    fields = __slots__
+
+    def __init__(self, line, args, kwargs, permutation):
+        self.line = line
+        self.args = args
+        self.kwargs = kwargs
+        self.permutation = permutation
+
+class Read(ArrayEvent):
+    """An index read of a tracked array, recorded with run_user_code(record_reads=True)."""
+    __slots__ = ("index",)
+    type = "read"
+    fields = __slots__
+
+    def __init__(self, line, index):
+        self.line = line
+        self.index = index
+
+class Compare(Event):
+    """
+    A comparison whose operands read a tracked array (see instrument.CompareTransformer); the
+    "read" events right before it say which elements.
+    """
+    __slots__ = ("op", "result")
+    type = "compare"
+    fields = __slots__
+
+    def __init__(self, line, op, result):
+        self.line = line
+        self.op = op
+        self.result = result
+
+class Call(Event):
+    """
+    A call of a function the user's code defines (see watcher.CallRecorder): its name, its
+    depth (1 for a call from the module body) and its arguments by parameter name.
+    """
+    __slots__ = ("name", "depth", "args")
+    type = "call"
+    fields = __slots__
+
+    def __init__(self, line, name, depth, args):
+        self.line = line
+        self.name = name
+        self.depth = depth
+        self.args = args
+
+class Return(Event):
+    """The matching return of a Call, with the value returned; none if the call raised."""
+    __slots__ = ("name", "depth", "value")
+    type = "return"
+    fields = __slots__
+
+    def __init__(self, line, name, depth, value):
+        self.line = line
+        self.name = name
+        self.depth = depth
+        self.value = value
+
+class Variable(Event):
+    """A watched local changing value (None once it goes out of scope)."""
+    __slots__ = ("name", "value")
+    type = "variable"
+    fields = __slots__
+
+    def __init__(self, line, name, value):
+        self.line = line
+        self.name = name
+        self.value = value
@@ -0,0 +1,296 @@
+# instrument.py
+# AST-rewriting engine: instead of a callback on every traced line, the submitted code is
+# compiled with a recording call after each statement that binds a watched name.
+# Array writes and list method calls still go through TrackedList, which records them itself.
+
+import ast
+import operator
+import types
+
+from encoding import json_safe
+from events import Variable
+
+# Names the recorder, the budget tick (see limits.TraceBudget), the list wrapper (see
+# watcher.ArrayTracker.wrap), the comparison hook and operation counters (see
+# watcher.ArrayTracker.compare), a substituted input array (see substitute_input) and the
+# call recorder (see watcher.CallRecorder) are bound to in the exec environment
+RECORDER_NAME = "__imaginarray_var__"
+TICK_NAME = "__imaginarray_tick__"
+LIST_NAME = "__imaginarray_list__"
+COMPARE_NAME = "__imaginarray_compare__"
+COUNTERS_NAME = "__imaginarray_counters__"
+INPUT_NAME = "__imaginarray_input__"
+CALLS_NAME = "__imaginarray_calls__"
+
+# Calls that build a new list, wrapped like list displays
+LIST_BUILDERS = frozenset({"list", "sorted"})
+
+# Comparison operators CompareTransformer hands to COMPARE_NAME, by the symbol it passes
+COMPARE_OPERATORS = {
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+COMPARE_SYMBOLS = {ast.Lt: "<", ast.LtE: "<=", ast.Gt: ">", ast.GtE: ">=", ast.Eq: "==",
+                   ast.NotEq: "!="}
+
+class VariableRecorder:
+    """
+    Called by the instrumented code with (name, value, lineno) after a watched name is bound.
+    Functions, and values for which skip(value) is true (the submitted array, which records
+    itself), are never reported.
+    """
+    def __init__(self, manipulations, skip=None):
+        self.manipulations = manipulations
+        self.skip = skip
+        self.last_values = {}
+
+    def __call__(self, name, value, lineno):
+        if type(value) is types.FunctionType or (self.skip is not None and self.skip(value)):
+            return
+        value = json_safe(value)
+        last_values = self.last_values
+        if name in last_values:
+            old_val = last_values[name]
+            if value is old_val or value == old_val:
+                return
+        last_values[name] = value
+        self.manipulations.append(Variable(lineno, name, value))
+
+class InstrumentTransformer(ast.NodeTransformer):
+    """
+    Inserts RECORDER_NAME(name, name, lineno) calls after assignments, augmented assignments,
+    for/with targets, deletes and parameters inside function bodies, for names in watched.
+    Module-level statements are left alone, the same as the line tracers skip "<module>".
+
+    With ticks=True every loop body and function body also starts with a TICK_NAME() call,
+    so budgets are enforced even in loops that never record anything.
+    """
+    def __init__(self, watched, ticks=False):
+        super().__init__()
+        self.watched = watched
+        self.ticks = ticks
+        self.function_depth = 0
+
+    def visit_FunctionDef(self, node):
+        self.function_depth += 1
+        self.generic_visit(node)
+        self.function_depth -= 1
+
+        args = node.args
+        params = args.posonlyargs + args.args + args.kwonlyargs
+        params += [a for a in (args.vararg, args.kwarg) if a is not None]
+        records = self._records([p.arg for p in params], node.lineno)
+        if self.ticks:
+            records.insert(0, self._tick_call())
+        if records:
+            has_docstring = (node.body and isinstance(node.body[0], ast.Expr)
+                             and isinstance(node.body[0].value, ast.Constant)
+                             and isinstance(node.body[0].value.value, str))
+            at = 1 if has_docstring else 0
+            node.body[at:at] = records
+        return node
+
+    visit_AsyncFunctionDef = visit_FunctionDef
+
+    def visit_Assign(self, node):
+        return self._after(node, node.targets)
+
+    def visit_AugAssign(self, node):
+        return self._after(node, [node.target])
+
+    def visit_AnnAssign(self, node):
+        if node.value is None:
+            return node
+        return self._after(node, [node.target])
+
+    def visit_For(self, node):
+        self.generic_visit(node)
+        if self.function_depth:
+            node.body[0:0] = self._records(bound_names([node.target]), node.lineno)
+        if self.ticks:
+            node.body.insert(0, self._tick_call())
+        return node
+
+    visit_AsyncFor = visit_For
+
+    def visit_While(self, node):
+        self.generic_visit(node)
+        if self.ticks:
+            node.body.insert(0, self._tick_call())
+        return node
+
+    def visit_With(self, node):
+        self.generic_visit(node)
+        if self.function_depth:
+            targets = [item.optional_vars for item in node.items if item.optional_vars is not None]
+            node.body[0:0] = self._records(bound_names(targets), node.lineno)
+        return node
+
+    visit_AsyncWith = visit_With
+
+    def visit_Delete(self, node):
+        if not self.function_depth:
+            return node
+        deleted = [t.id for t in node.targets if isinstance(t, ast.Name) and t.id in self.watched]
+        return [node] + [self._record_call(name, ast.Constant(None), node.lineno) for name in deleted]
+
+    def _after(self, node, targets):
+        self.generic_visit(node)
+        if not self.function_depth:
+            return node
+        records = self._records(bound_names(targets), node.lineno)
+        return [node] + records if records else node
+
+    def _records(self, names, lineno):
+        return [self._record_call(name, ast.Name(name, ast.Load()), lineno)
+                for name in names if name in self.watched]
+
+    def _record_call(self, name, value, lineno):
+        call = ast.Call(ast.Name(RECORDER_NAME, ast.Load()),
+                        [ast.Constant(name), value, ast.Constant(lineno)], [])
+        return ast.Expr(call)
+
+    def _tick_call(self):
+        return ast.Expr(ast.Call(ast.Name(TICK_NAME, ast.Load()), [], []))
+
+class ListTransformer(ast.NodeTransformer):
+    """
+    Wraps every expression that builds a new list (list displays and comprehensions, slices,
+    and list() and sorted() calls) in a LIST_NAME(...) call, so the lists a program creates can
+    be tracked as well. The wrapper hands back anything that isn't a plain list unchanged.
+    """
+    def visit_List(self, node):
+        self.generic_visit(node)
+        return self._wrap(node) if isinstance(node.ctx, ast.Load) else node
+
+    def visit_ListComp(self, node):
+        self.generic_visit(node)
+        return self._wrap(node)
+
+    def visit_Subscript(self, node):
+        self.generic_visit(node)
+        if isinstance(node.ctx, ast.Load) and isinstance(node.slice, ast.Slice):
+            return self._wrap(node)
+        return node
+
+    def visit_Call(self, node):
+        self.generic_visit(node)
+        if isinstance(node.func, ast.Name) and node.func.id in LIST_BUILDERS:
+            return self._wrap(node)
+        return node
+
+    def _wrap(self, node):
+        return ast.copy_location(ast.Call(ast.Name(LIST_NAME, ast.Load()), [node], []), node)
+
+class CompareTransformer(ast.NodeTransformer):
+    """
+    Rewrites every single-operator ordering or equality comparison `a < b` into
+    COMPARE_NAME(COUNTERS_NAME.reads, a, b, "<"). The read count is taken before the operands
+    are evaluated, so the hook can tell whether they read a tracked array. Chained
+    comparisons, `in` and `is` are left alone.
+    """
+    def visit_Compare(self, node):
+        self.generic_visit(node)
+        if len(node.ops) != 1 or type(node.ops[0]) not in COMPARE_SYMBOLS:
+            return node
+        mark = ast.Attribute(ast.Name(COUNTERS_NAME, ast.Load()), "reads", ast.Load())
+        symbol = ast.Constant(COMPARE_SYMBOLS[type(node.ops[0])])
+        call = ast.Call(ast.Name(COMPARE_NAME, ast.Load()),
+                        [mark, node.left, node.comparators[0], symbol], [])
+        return ast.copy_location(call, node)
+
+class CallTransformer(ast.NodeTransformer):
+    """
+    Has every function definition report its calls to CALLS_NAME (see watcher.CallRecorder),
+    for the "ast" engine, which has no call hook: enter() first, leave(value) around every
+    returned value and at the end of the body, and unwind() when an exception leaves it.
+    Nothing wraps the function, so no frame is added. Lambdas, async functions and
+    generators are left alone.
+    """
+    def visit_FunctionDef(self, node):
+        self.generic_visit(node)
+        if any(isinstance(child, (ast.Yield, ast.YieldFrom)) for child in own_nodes(node.body)):
+            return node
+        body = node.body
+        docstring = []
+        if (body and isinstance(body[0], ast.Expr) and isinstance(body[0].value, ast.Constant)
+                and isinstance(body[0].value.value, str)):
+            docstring, body = body[:1], body[1:]
+        body = [ReturnTransformer().visit(stmt) for stmt in body]
+        body.append(ast.Expr(_calls_method("leave", [ast.Constant(None)])))
+        handler = ast.ExceptHandler(ast.Name("BaseException", ast.Load()), None,
+                                    [ast.Expr(_calls_method("unwind", [])), ast.Raise()])
+        statements = [ast.Expr(_calls_method("enter", [])), ast.Try(body, [handler], [], [])]
+        node.body = docstring + [ast.copy_location(stmt, node) for stmt in statements]
+        return node
+
+class ReturnTransformer(ast.NodeTransformer):
+    """Routes a function's returned values through CALLS_NAME.leave, not entering nested scopes."""
+    def visit_Return(self, node):
+        value = node.value if node.value is not None else ast.Constant(None)
+        node.value = ast.copy_location(_calls_method("leave", [value]), value)
+        return node
+
+    def visit_FunctionDef(self, node):
+        return node
+
+    visit_AsyncFunctionDef = visit_Lambda = visit_ClassDef = visit_FunctionDef
+
+def _calls_method(name, args):
+    return ast.Call(ast.Attribute(ast.Name(CALLS_NAME, ast.Load()), name, ast.Load()), args, [])
+
+def own_nodes(body):
+    """The nodes of a function body, not counting those of the functions and classes nested in it."""
+    stack = list(body)
+    while stack:
+        node = stack.pop()
+        yield node
+        if not isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.Lambda, ast.ClassDef)):
+            stack.extend(ast.iter_child_nodes(node))
+
+def bound_names(targets):
+    """Plain names bound by assignment targets, unpacking tuples, lists and starred targets."""
+    names = []
+    for target in targets:
+        if isinstance(target, ast.Name):
+            names.append(target.id)
+        elif isinstance(target, (ast.Tuple, ast.List)):
+            names.extend(bound_names(target.elts))
+        elif isinstance(target, ast.Starred):
+            names.extend(bound_names([target.value]))
+    return names
+
+def track_lists(tree):
+    """tree with every list it builds wrapped for tracking (see ListTransformer)."""
+    tree = ListTransformer().visit(tree)
+    return ast.fix_missing_locations(tree)
+
+def hook_compares(tree):
+    """tree with its comparisons routed through COMPARE_NAME (see CompareTransformer)."""
+    tree = CompareTransformer().visit(tree)
+    return ast.fix_missing_locations(tree)
+
+def substitute_input(tree, binding):
+    """
+    tree with the value of binding, the submitted array's assignment (see
+    analysis.array_binding), replaced by list(INPUT_NAME): a fresh copy of the input array
+    every time it runs, wrapped like any other list() call by track_lists.
+    """
+    call = ast.Call(ast.Name("list", ast.Load()), [ast.Name(INPUT_NAME, ast.Load())], [])
+    binding.value = ast.copy_location(call, binding.value)
+    return ast.fix_missing_locations(tree)
+
+def hook_calls(tree):
+    """tree with its functions reporting their calls to CALLS_NAME (see CallTransformer)."""
+    tree = CallTransformer().visit(tree)
+    return ast.fix_missing_locations(tree)
+
+def instrument(tree, watched, filename, ticks=False):
+    """Returns a code object for tree with variable recording (and budget ticks) compiled in."""
+    tree = InstrumentTransformer(watched, ticks).visit(tree)
+    ast.fix_missing_locations(tree)
+    return compile(tree, filename, "exec")
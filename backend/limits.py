@@ -0,0 +1,185 @@
+# limits.py
+# Step, event, time and memory budgets for a single run of user code.
+
+import ctypes
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+# Ticks between the (comparatively slow) wall-clock and memory checks
+CHECK_INTERVAL = 256
+
+class TraceLimits:
+    """Budgets for one run; None disables a limit. max_memory is in bytes of resident memory growth."""
+    def __init__(self, max_lines=None, max_events=None, max_seconds=None, max_memory=None):
+        self.max_lines = max_lines
+        self.max_events = max_events
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+
+class TraceBudgetExceeded(BaseException):
+    """
+    Raised into the user's code when a budget runs out. It derives from BaseException so an
+    `except Exception` in the submitted code cannot swallow it.
+    """
+    def __init__(self, reason):
+        super().__init__(f"{reason} budget exceeded")
+        self.reason = reason
+
+class TraceTimeout(TraceBudgetExceeded):
+    """Raised asynchronously by TraceBudget's watchdog, which can only pass an exception class."""
+    def __init__(self, reason="time"):
+        super().__init__(reason)
+
+class TraceBudget:
+    """
+    Tracks one run against its TraceLimits. The tracers call tick() once per traced line (the
+    ast engine once per loop iteration and function call) and TrackedList calls
+    check_events() before recording. Once exceeded, every later tick raises again.
+    """
+    def __init__(self, limits, manipulations):
+        self.limits = limits
+        self.manipulations = manipulations
+        self.lines = 0
+        self.exceeded = None
+        self._watchdog = None
+        self.deadline = None
+        if limits.max_seconds is not None:
+            self.deadline = time.monotonic() + limits.max_seconds
+        self.rss_limit = None
+        if limits.max_memory is not None:
+            rss = current_rss()
+            if rss is not None:
+                self.rss_limit = rss + limits.max_memory
+
+    def tick(self):
+        self.lines += 1
+        if self.exceeded is not None:
+            raise TraceBudgetExceeded(self.exceeded)
+        limits = self.limits
+        if limits.max_lines is not None and self.lines > limits.max_lines:
+            self.fail("lines")
+        if limits.max_events is not None and len(self.manipulations) >= limits.max_events:
+            self.fail("events")
+        if self.lines % CHECK_INTERVAL == 0:
+            if self.deadline is not None and time.monotonic() > self.deadline:
+                self.fail("time")
+            if self.rss_limit is not None and current_rss() > self.rss_limit:
+                self.fail("memory")
+
+    def check_events(self):
+        if self.exceeded is not None:
+            raise TraceBudgetExceeded(self.exceeded)
+        max_events = self.limits.max_events
+        if max_events is not None and len(self.manipulations) >= max_events:
+            self.fail("events")
+
+    def fail(self, reason):
+        self.exceeded = reason
+        raise TraceBudgetExceeded(reason)
+
+    def watchdog(self):
+        """
+        Context manager that interrupts the current thread once max_seconds have passed, even
+        inside code no tracer sees: a one-line `while True: pass`, or a long comprehension.
+        """
+        self._watchdog = _Watchdog(self)
+        return self._watchdog
+
+    @contextmanager
+    def suspended(self):
+        """Stops the time budget's clock while the run waits on its consumer rather than computing."""
+        started = time.monotonic()
+        if self._watchdog is not None:
+            self._watchdog.pause()
+        try:
+            yield
+        finally:
+            if self.deadline is not None:
+                self.deadline += time.monotonic() - started
+            if self._watchdog is not None:
+                self._watchdog.resume()
+
+class _Watchdog:
+    def __init__(self, budget):
+        self.budget = budget
+        self.cond = threading.Condition()
+        self.thread = None
+        self.deadline = None  # monotonic time to fire at, None while paused
+        self.remaining = None
+        self.done = False
+        self.fired = False
+        self.delivered = False
+
+    def __enter__(self):
+        seconds = self.budget.limits.max_seconds
+        if seconds is not None:
+            watchdog = self
+
+            class Timeout(TraceTimeout):
+                def __init__(self):
+                    watchdog.delivered = True
+                    super().__init__()
+
+            self.exception = Timeout
+            self.thread_id = threading.get_ident()
+            self.deadline = time.monotonic() + seconds
+            self.thread = threading.Thread(target=self._watch, daemon=True)
+            self.thread.start()
+        return self
+
+    def pause(self):
+        with self.cond:
+            if self.deadline is not None:
+                self.remaining = self.deadline - time.monotonic()
+                self.deadline = None
+
+    def resume(self):
+        with self.cond:
+            if self.remaining is not None:
+                self.deadline = time.monotonic() + self.remaining
+                self.remaining = None
+                self.cond.notify()
+
+    def __exit__(self, *exc_info):
+        if self.thread is None:
+            return False
+        with self.cond:
+            self.done = True
+            self.cond.notify()
+        if self.fired and not self.delivered:
+            # The run finished just as the timer fired. A pending async exception can't be
+            # safely cancelled, so let it land here instead of somewhere in the caller.
+            give_up = time.monotonic() + 0.1
+            try:
+                while not self.delivered and time.monotonic() < give_up:
+                    pass
+            except TraceTimeout:
+                pass
+        return False
+
+    def _watch(self):
+        with self.cond:
+            while not self.done:
+                if self.deadline is None:
+                    self.cond.wait()
+                    continue
+                remaining = self.deadline - time.monotonic()
+                if remaining > 0:
+                    self.cond.wait(remaining)
+                    continue
+                self.fired = True
+                self.budget.exceeded = "time"
+                ctypes.pythonapi.PyThreadState_SetAsyncExc(ctypes.c_ulong(self.thread_id),
+                                                           ctypes.py_object(self.exception))
+                return
+
+def current_rss():
+    """Resident set size of this process in bytes, or None where /proc is unavailable."""
+    try:
+        with open("/proc/self/statm") as f:
+            resident_pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return None
+    return resident_pages * os.sysconf("SC_PAGE_SIZE")
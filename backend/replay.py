@@ -0,0 +1,117 @@
+# replay.py
+# Rebuilds array states from a (possibly delta-encoded) manipulations list.
+
+# "array" id of the submitted array, the one these functions rebuild. Events of the other
+# arrays a program creates (see watcher.ArrayTracker) are skipped.
+MAIN_ARRAY = 0
+
+# Event types that aren't about any one array
+NON_ARRAY_EVENTS = frozenset({"variable", "compare", "call", "return"})
+
+def is_main_event(manipulation):
+    """Whether manipulation is an event of the submitted array (all array events of traces without ids are)."""
+    return (manipulation.get("type") not in NON_ARRAY_EVENTS
+            and manipulation.get("array", MAIN_ARRAY) == MAIN_ARRAY)
+
+def apply_manipulation(state, manipulation):
+    """
+    Applies a single array event to state in place. Events that carry a "state"
+    keyframe are applied by copying it; non-array events (like "variable") are ignored.
+    """
+    if "state" in manipulation:
+        state[:] = manipulation["state"]
+        return state
+    return apply_delta(state, manipulation)
+
+def apply_delta(state, manipulation):
+    """Applies an array event from its delta alone, ignoring any "state" it carries."""
+    kind = manipulation.get("type")
+    if kind == "append":
+        state.append(manipulation["value"])
+    elif kind == "pop":
+        state.pop(manipulation["index"])
+    elif kind == "replace":
+        state[manipulation["index"]] = manipulation["value"]
+    elif kind == "swap":
+        i, j = manipulation["indices"]
+        state[i], state[j] = state[j], state[i]
+    elif kind == "insert":
+        state.insert(manipulation["index"], manipulation["value"])
+    elif kind == "remove":
+        state.remove(manipulation["value"])
+    elif kind == "extend":
+        state.extend(manipulation["value"])
+    elif kind == "reverse":
+        state.reverse()
+    elif kind == "sort":
+        state[:] = [state[i] for i in manipulation["permutation"]]
+    return state
+
+def reconstruct_state(initial_arr, manipulations, step):
+    """
+    Returns the array as it was right after manipulations[step], starting from the nearest
+    keyframe at or before step instead of replaying the whole trace.
+    """
+    start = step
+    while start >= 0 and not ("state" in manipulations[start] and is_main_event(manipulations[start])):
+        start -= 1
+
+    if start >= 0:
+        state = list(manipulations[start]["state"])
+    else:
+        state = list(initial_arr)
+
+    for manipulation in manipulations[start + 1:step + 1]:
+        if is_main_event(manipulation):
+            apply_manipulation(state, manipulation)
+    return state
+
+def expand_states(initial_arr, manipulations):
+    """
+    Converts a delta trace back into the full-copy format, with a "state" on every event of
+    the submitted array, in a single forward pass.
+    """
+    state = list(initial_arr)
+    expanded = []
+    for manipulation in manipulations:
+        if not is_main_event(manipulation):
+            expanded.append(manipulation)
+            continue
+        apply_manipulation(state, manipulation)
+        expanded.append({**manipulation, "state": list(state)})
+    return expanded
+
+def build_index(initial_arr, manipulations, interval):
+    """
+    A seek index over a trace: every interval steps, a keyframe with the array and the
+    variables as they are right after that step, and for every line the steps it produced.
+    """
+    state = list(initial_arr)
+    variables = {}
+    keyframes = []
+    lines = {}
+    for step, manipulation in enumerate(manipulations):
+        if manipulation.get("type") == "variable":
+            variables[manipulation["name"]] = manipulation["value"]
+        elif is_main_event(manipulation):
+            apply_manipulation(state, manipulation)
+        if "line" in manipulation:
+            lines.setdefault(manipulation["line"], []).append(step)
+        if step % interval == 0:
+            keyframes.append({"step": step, "state": list(state), "variables": dict(variables)})
+    return {"interval": interval, "keyframes": keyframes, "lines": lines}
+
+def state_at(manipulations, index, step):
+    """
+    Returns (array, variables) right after manipulations[step], replaying fewer than
+    index["interval"] events from the nearest keyframe of index (see build_index).
+    """
+    keyframe = index["keyframes"][step // index["interval"]]
+    state = list(keyframe["state"])
+    variables = dict(keyframe["variables"])
+    for manipulation in manipulations[keyframe["step"] + 1:step + 1]:
+        if manipulation.get("type") == "variable":
+            variables[manipulation["name"]] = manipulation["value"]
+        elif is_main_event(manipulation):
+            apply_manipulation(state, manipulation)
+    return state, variables
@@ -0,0 +1,270 @@
+# sandbox.py
+# Pool of pre-started worker processes that run submissions outside the web process.
+# Each worker runs one job at a time under CPU and address-space rlimits; a worker that
+# hangs or dies is killed and replaced without affecting the API process.
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+try:
+    import resource
+except ImportError:  # not available on Windows; workers then run without rlimits
+    resource = None
+
+class SandboxError(Exception):
+    """A submission hung or crashed its worker process."""
+
+class PoolBusy(Exception):
+    """Every worker is busy and the wait queue is full."""
+
+# Sent in place of a MemoryError from the address-space limit, whose own message is empty
+MEMORY_ERROR_MESSAGE = "Execution ran out of memory: it exceeded its memory limit"
+
+def _worker_main(conn, cpu_seconds, max_memory):
+    from watcher import TraceSession, extract_initial_array, run_user_code, stream_user_code
+
+    if resource is not None and max_memory is not None:
+        # Relative to what the freshly started worker already maps
+        limit = _address_space() + max_memory
+        resource.setrlimit(resource.RLIMIT_AS, (limit, resource.getrlimit(resource.RLIMIT_AS)[1]))
+
+    while True:
+        try:
+            job = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if job is None:
+            return
+        mode, args, kwargs = job
+        if resource is not None and cpu_seconds is not None:
+            # RLIMIT_CPU counts the process's whole lifetime, so move the soft limit per job
+            usage = resource.getrusage(resource.RUSAGE_SELF)
+            used = int(usage.ru_utime + usage.ru_stime) + 1
+            hard = resource.getrlimit(resource.RLIMIT_CPU)[1]
+            soft = used + cpu_seconds
+            if hard != resource.RLIM_INFINITY:
+                soft = min(soft, hard)
+            resource.setrlimit(resource.RLIMIT_CPU, (soft, hard))
+        if mode == "session":
+            _serve_session(conn, TraceSession(*args, **kwargs))
+            return
+        try:
+            if mode == "stream":
+                for message in stream_user_code(*args, **kwargs):
+                    conn.send(message)
+            elif mode == "initial":
+                conn.send(("done", extract_initial_array(*args, **kwargs)))
+            else:
+                conn.send(("done", run_user_code(*args, **kwargs)))
+            continue
+        except Exception as e:
+            result = ("error", _job_error(e))
+        try:
+            conn.send(result)
+        except Exception:
+            # e.g. an exception carrying something unpicklable
+            conn.send(("error", RuntimeError(str(result[1]))))
+
+def _serve_session(conn, session):
+    # A session has the worker to itself until it is closed; the worker then exits
+    conn.send(("start", session.initial_arr))
+    while True:
+        try:
+            count = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            return
+        if count is None:
+            return
+        try:
+            conn.send(("events", *session.next(count)))
+        except Exception as e:
+            e = _job_error(e)
+            try:
+                conn.send(("error", e))
+            except Exception:
+                conn.send(("error", RuntimeError(str(e))))
+
+def _job_error(error):
+    """The exception to send back for one a job raised."""
+    if isinstance(error, MemoryError):
+        return MemoryError(MEMORY_ERROR_MESSAGE)
+    return error
+
+def _address_space():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[0]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+class _Worker:
+    def __init__(self, context, cpu_seconds, max_memory):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, cpu_seconds, max_memory),
+                                       daemon=True)
+        self.process.start()
+        child_conn.close()
+
+    def kill(self):
+        self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+class SandboxPool:
+    """
+    size workers (default: one per core) wait for jobs. run() hands a job to an idle worker
+    and blocks until it answers; at most max_pending further callers may wait for a worker,
+    anyone beyond that gets PoolBusy straight away.
+
+    timeout is the watchdog: a worker that has not finished by then is killed and respawned.
+    cpu_seconds and max_memory (bytes) become RLIMIT_CPU per job and RLIMIT_AS per worker.
+    """
+    def __init__(self, size=None, max_pending=None, timeout=15, cpu_seconds=10,
+                 max_memory=512 * 1024 * 1024):
+        self.size = size or os.cpu_count() or 1
+        self.timeout = timeout
+        self.cpu_seconds = cpu_seconds
+        self.max_memory = max_memory
+        if max_pending is None:
+            max_pending = 4 * self.size
+        self._slots = threading.BoundedSemaphore(self.size + max_pending)
+
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            # Forking from a clean server process is safe even though Flask runs threads
+            self._context = multiprocessing.get_context("forkserver")
+            self._context.set_forkserver_preload(["watcher"])
+        else:
+            self._context = multiprocessing.get_context("spawn")
+
+        self._idle = queue.Queue()
+        for _ in range(self.size):
+            self._idle.put(self._spawn())
+
+    def _spawn(self):
+        return _Worker(self._context, self.cpu_seconds, self.max_memory)
+
+    def run(self, *args, **kwargs):
+        """Calls watcher.run_user_code(*args, **kwargs) in a worker and returns its result."""
+        *_, (_, result) = self._job(("run", args, kwargs))
+        return result
+
+    def initial_array(self, *args, **kwargs):
+        """Calls watcher.extract_initial_array(*args, **kwargs) in a worker and returns its result."""
+        *_, (_, result) = self._job(("initial", args, kwargs))
+        return result
+
+    def stream(self, *args, **kwargs):
+        """
+        Generator over watcher.stream_user_code(*args, **kwargs) run in a worker, yielding its
+        messages as they arrive. Closing it early kills the worker.
+        """
+        yield from self._job(("stream", args, kwargs))
+
+    def session(self, *args, **kwargs):
+        """
+        Starts watcher.TraceSession(*args, **kwargs) in a worker of its own, outside the pool's
+        size, and returns a SandboxSession for it.
+        """
+        worker = self._spawn()
+        try:
+            worker.conn.send(("session", args, kwargs))
+        except OSError:
+            worker.kill()
+            raise SandboxError("Could not start a session worker") from None
+        return SandboxSession(worker, self.timeout)
+
+    def _job(self, job):
+        if not self._slots.acquire(blocking=False):
+            raise PoolBusy("Too many submissions in flight, try again shortly")
+        try:
+            try:
+                worker = self._idle.get(timeout=self.timeout)
+            except queue.Empty:
+                raise PoolBusy("No sandbox worker became free in time") from None
+
+            # Until the worker's final message is read, it can't take another job
+            finished = False
+            try:
+                deadline = time.monotonic() + self.timeout
+                while True:
+                    try:
+                        if job is not None:
+                            worker.conn.send(job)
+                            job = None
+                        if not worker.conn.poll(max(0, deadline - time.monotonic())):
+                            raise SandboxError(f"Execution took longer than {self.timeout} seconds")
+                        message = worker.conn.recv()
+                    except (EOFError, OSError):
+                        raise SandboxError("Execution was killed for exceeding its CPU or memory limit") from None
+                    finished = message[0] in ("done", "error")
+                    if message[0] == "error":
+                        raise message[1]
+                    yield message
+                    if finished:
+                        return
+            finally:
+                if finished:
+                    self._idle.put(worker)
+                else:
+                    self._replace(worker)
+        finally:
+            self._slots.release()
+
+    def _replace(self, worker):
+        worker.kill()
+        self._idle.put(self._spawn())
+
+    def close(self):
+        while True:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                worker.conn.send(None)
+            except OSError:
+                pass
+            worker.process.join(1)
+            if worker.process.is_alive():
+                worker.kill()
+
+class SandboxSession:
+    """
+    Client side of a TraceSession running in its own worker. Each next() has the pool's
+    timeout; close() kills the worker.
+    """
+    def __init__(self, worker, timeout):
+        self.worker = worker
+        self.timeout = timeout
+        _, self.initial_arr = self._receive()
+
+    def next(self, count):
+        """Same as TraceSession.next."""
+        try:
+            self.worker.conn.send(count)
+        except OSError:
+            self.close()
+            raise SandboxError("The session's worker is gone") from None
+        message = self._receive()
+        if message[0] == "error":
+            raise message[1]
+        return message[1:]
+
+    def close(self):
+        self.worker.kill()
+
+    def _receive(self):
+        try:
+            if not self.worker.conn.poll(self.timeout):
+                raise SandboxError(f"Execution took longer than {self.timeout} seconds")
+            return self.worker.conn.recv()
+        except SandboxError:
+            self.close()
+            raise
+        except (EOFError, OSError):
+            self.close()
+            raise SandboxError("Execution was killed for exceeding its CPU or memory limit") from None
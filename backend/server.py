@@ -1,32 +1,512 @@
 # server.py
 
-from flask import Flask, request, jsonify
+import gzip
+import hashlib
+import os
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from flask_cors import CORS
-from watcher import run_user_code  
+from binary import BINARY_MEDIA_TYPE, to_binary
+from columnar import COLUMNAR_MEDIA_TYPE, to_columns
+from encoding import dumps, json_fallback
+from replay import build_index, state_at
+from limits import TraceLimits
+from sandbox import PoolBusy, SandboxPool
+from sessions import SessionRegistry, TooManySessions, UnknownSession
+from sweep import (DEFAULT_MAX_SIZE, DEFAULT_SIZE_COUNT, SWEEP_ENGINE, SWEEP_KINDS, run_sweep,
+                   sweep_sizes)
+from trace_cache import TraceCache, program_key
+from watcher import (STREAM_CHUNK_SIZE, TraceSession, extract_initial_array, run_user_code,
+                     stream_user_code)
+
+# Array events between full "state" keyframes when the client asks for trace_mode="delta"
+DEFAULT_KEYFRAME_INTERVAL = 32
+
+# Per-submission budgets; an overrun returns the partial trace flagged as truncated
+TRACE_LIMITS = TraceLimits(
+    max_lines=int(os.environ.get("TRACE_MAX_LINES", 2_000_000)),
+    max_events=int(os.environ.get("TRACE_MAX_EVENTS", 200_000)),
+    max_seconds=float(os.environ.get("TRACE_MAX_SECONDS", 5)),
+    max_memory=int(os.environ.get("TRACE_MAX_MEMORY_MB", 256)) * 1024 * 1024,
+)
+
+# Worker processes that execute submissions (default: one per core). 0 runs them in this
+# process instead, for hosts that can't start subprocesses.
+SANDBOX_WORKERS = int(os.environ.get("SANDBOX_WORKERS", os.cpu_count() or 1))
+
+# Cache of finished traces keyed on the normalized program; TRACE_CACHE_ENTRIES=0 turns it
+# off and TRACE_CACHE_DIR keeps it across restarts
+TRACE_CACHE_ENTRIES = int(os.environ.get("TRACE_CACHE_ENTRIES", 256))
+trace_cache = None
+if TRACE_CACHE_ENTRIES > 0:
+    trace_cache = TraceCache(
+        max_entries=TRACE_CACHE_ENTRIES,
+        max_bytes=int(os.environ.get("TRACE_CACHE_MB", 64)) * 1024 * 1024,
+        directory=os.environ.get("TRACE_CACHE_DIR") or None,
+    )
+
+# Step-through sessions: how many may be open, and how long one may sit unused
+sessions = SessionRegistry(
+    max_sessions=int(os.environ.get("SESSION_MAX", 16)),
+    idle_seconds=float(os.environ.get("SESSION_IDLE_SECONDS", 120)),
+)
+
+# Response bodies smaller than this are sent uncompressed
+COMPRESS_MIN_BYTES = 1024
+
+# Trace formats /api/submit_code can answer in, by media type and by ?format= value
+TRACE_FORMATS = {"application/json": "json", COLUMNAR_MEDIA_TYPE: "columnar", BINARY_MEDIA_TYPE: "binary"}
+
+# Most events one /api/session/<id>/next call returns
+SESSION_MAX_COUNT = 10_000
+
+# Deepest calls recorded when a submission asks for call events and gives no max_call_depth
+DEFAULT_MAX_CALL_DEPTH = 32
+
+# Most programs one /api/race call may run
+RACE_MAX_PROGRAMS = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def execute(code_lines, program=None, **kwargs):
+    """
+    run_user_code, answered from the trace cache when possible. program is
+    trace_cache.program_key(code_lines, kwargs), if the caller already computed it.
+    """
+    if trace_cache is None:
+        return execute_uncached(code_lines, **kwargs)
+    return trace_cache.get_or_run(execute_uncached, code_lines, program, **kwargs)
+
+def execute_uncached(*args, **kwargs):
+    """run_user_code, in the sandbox pool unless SANDBOX_WORKERS is 0."""
+    if SANDBOX_WORKERS == 0:
+        return run_user_code(*args, **kwargs)
+    return get_pool().run(*args, **kwargs)
+
+def initial_array_of(code_lines):
+    """
+    extract_initial_array, in the sandbox pool unless SANDBOX_WORKERS is 0: folding the
+    array's expression builds it, so it runs under the workers' memory limit.
+    """
+    if SANDBOX_WORKERS == 0:
+        return extract_initial_array(code_lines)
+    return get_pool().initial_array(code_lines)
+
+def execute_stream(code_lines, **kwargs):
+    """
+    stream_user_code's messages, replayed from the trace cache or run like execute_uncached.
+    A run that completes is put in the cache, for streamed and whole-trace requests alike.
+    """
+    program = None
+    if trace_cache is not None:
+        program = program_key(code_lines, kwargs)
+        result = trace_cache.get(code_lines, program, **kwargs)
+        if result is not None:
+            return cached_messages(result)
+    if SANDBOX_WORKERS == 0:
+        messages = stream_user_code(code_lines, **kwargs)
+    else:
+        messages = get_pool().stream(code_lines, **kwargs)
+    if program is None or program[0] is None:
+        return messages
+    return caching_messages(messages, program)
+
+def caching_messages(messages, program):
+    """Passes stream messages through, putting the finished result in the trace cache."""
+    manipulations = []
+    try:
+        for message in messages:
+            if message[0] == "events":
+                manipulations.extend(message[2])
+            elif message[0] == "done":
+                initial_arr, final_arr, _, line_nums, meta = message[1]
+                trace_cache.put(program, (initial_arr, final_arr, manipulations, line_nums, meta))
+            yield message
+    finally:
+        messages.close()
+
+def cached_messages(result):
+    initial_arr, final_arr, manipulations, line_nums, meta = result
+    yield ("start", initial_arr)
+    for start in range(0, len(manipulations), STREAM_CHUNK_SIZE):
+        yield ("events", start, manipulations[start:start + STREAM_CHUNK_SIZE])
+    yield ("done", (initial_arr, final_arr, [], line_nums, meta))
+
+def start_session(code_lines, **kwargs):
+    """
+    A TraceSession, in a worker of its own unless SANDBOX_WORKERS is 0. In this process a
+    "monitoring" session runs under "settrace" instead, which records the same trace: a
+    paused session would otherwise hold sys.monitoring (see watcher._MONITORING_LOCK) and
+    stall every other monitoring run until it is closed.
+    """
+    if SANDBOX_WORKERS == 0:
+        if kwargs.get("engine") == "monitoring":
+            kwargs["engine"] = "settrace"
+        return TraceSession(code_lines, **kwargs)
+    return get_pool().session(code_lines, **kwargs)
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = SandboxPool(
+                    size=SANDBOX_WORKERS,
+                    timeout=TRACE_LIMITS.max_seconds + 10,
+                    cpu_seconds=int(TRACE_LIMITS.max_seconds) + 5,
+                    max_memory=int(os.environ.get("SANDBOX_MAX_MEMORY_MB", 1024)) * 1024 * 1024,
+                )
+    return _pool
+
+class TraceJSONProvider(DefaultJSONProvider):
+    """Traces are already JSON-safe (see encoding.py); encode them in one pass, unsorted."""
+    default = staticmethod(json_fallback)
+    sort_keys = False
 
 app = Flask(__name__)
+app.json = TraceJSONProvider(app)
 
 # Update CORS to allow requests from the deployed frontend
 CORS(app, origins=["http://localhost:5173", "https://imaginarray.vercel.app"], supports_credentials=True)
 
+def run_options(body):
+    """The run_user_code keyword arguments a submission asks for."""
+    keyframe_interval = None
+    if body.get("trace_mode") == "delta":
+        keyframe_interval = max(1, int(body.get("keyframe_interval", DEFAULT_KEYFRAME_INTERVAL)))
+    return {
+        "keyframe_interval": keyframe_interval,
+        "index_interval": keyframe_interval,
+        "engine": body.get("engine", "settrace"),
+        "sort_swaps": bool(body.get("sort_swaps", False)),
+        "count_ops": bool(body.get("count_ops", False)),
+        "record_reads": bool(body.get("record_reads", False)),
+        "profile": bool(body.get("profile", False)),
+        "calls": bool(body.get("calls", False)),
+        "max_call_depth": max(1, int(body.get("max_call_depth", DEFAULT_MAX_CALL_DEPTH))),
+        "limits": TRACE_LIMITS,
+    }
+
 @app.route("/api/submit_code", methods=["POST"])
 def submit_code():
+    """
+    Runs the code and returns its whole trace. The format is negotiated through Accept or
+    ?format= (see TRACE_FORMATS): "json" (the default), "columnar" (columnar.to_columns under
+    "trace" instead of "manipulations" and "line_nums") or "binary" (binary.to_binary).
+    Bodies are gzip- or deflate-compressed per Accept-Encoding.
+
+    Complete traces carry an ETag derived from the program hash, so a repeat request with
+    If-None-Match gets a 304 without running anything.
+    """
     code = request.json.get("code")  
+    options = run_options(request.json)
+    trace_format = request.args.get("format")
+    if trace_format not in TRACE_FORMATS.values():
+        trace_format = TRACE_FORMATS[request.accept_mimetypes.best_match(TRACE_FORMATS) or "application/json"]
+    content_encoding = negotiate_encoding()
+    # Parsed and hashed once, for both the ETag and the cache lookup
+    program = program_key(code, options)
+    etag = trace_etag(program, trace_format, content_encoding)
+    if etag is not None and etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        response.vary.update(("Accept", "Accept-Encoding"))
+        return response
+
     try:
-        initial_arr, final_arr, manipulations, line_nums = run_user_code(code)
-        return jsonify({
+        initial_arr, final_arr, manipulations, line_nums, meta = execute(code, program, **options)
+        body = {
             "message": "Analysis complete",
             "initial_arr": initial_arr,
-            "manipulations": manipulations,
             "final_arr": final_arr,
-            "line_nums": line_nums,
-        })
+            "keyframe_interval": options["keyframe_interval"],
+            "truncated": meta["truncated"],
+            "truncation_reason": meta["truncation_reason"],
+            "index": meta.get("index"),
+            "counters": meta.get("counters"),
+            "profile": meta.get("profile"),
+        }
+        if trace_format == "binary":
+            response = Response(to_binary(body, to_columns(initial_arr, manipulations)),
+                                mimetype=BINARY_MEDIA_TYPE)
+        elif trace_format == "columnar":
+            body["trace"] = to_columns(initial_arr, manipulations)
+            response = jsonify(body)
+            response.mimetype = COLUMNAR_MEDIA_TYPE
+        else:
+            body.update(manipulations=manipulations, line_nums=line_nums)
+            response = jsonify(body)
+        if etag is not None and not meta["truncated"]:
+            response.set_etag(etag)
+        compress(response, content_encoding)
+        response.vary.update(("Accept", "Accept-Encoding"))
+        return response
     except SyntaxError as e:
         print('error')
         return jsonify({"error": f"Syntax Error: {str(e)}"}), 400
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 400
 
+def negotiate_encoding():
+    """"gzip", "deflate" or None, whichever the client accepts (gzip preferred)."""
+    accepted = request.accept_encodings
+    for encoding in ("gzip", "deflate"):
+        if accepted[encoding]:
+            return encoding
+    return None
+
+def compress(response, content_encoding):
+    data = response.get_data()
+    if content_encoding is None or len(data) < COMPRESS_MIN_BYTES:
+        return
+    if content_encoding == "gzip":
+        data = gzip.compress(data, compresslevel=6)
+    else:
+        data = zlib.compress(data, 6)
+    response.set_data(data)
+    response.headers["Content-Encoding"] = content_encoding
+
+def trace_etag(program, trace_format, content_encoding):
+    """
+    An ETag for the response to a submission, or None if the code doesn't parse. It covers
+    program (see trace_cache.program_key): the program hash and the layout of its lines; and
+    the response format and encoding.
+    """
+    key, node_lines = program
+    if key is None:
+        return None
+    tag = f"{key}:{node_lines}:{trace_format}:{content_encoding}"
+    return hashlib.sha256(tag.encode()).hexdigest()[:32]
+
+@app.route("/api/submit_code_stream", methods=["POST"])
+def submit_code_stream():
+    """
+    Same input as /api/submit_code, answered as a stream of JSON records: one "start" with
+    initial_arr, "events" chunks of manipulations (and their line_nums) as the code runs, then
+    "done" with final_arr and the truncation flags, or "error". Newline-delimited JSON, or
+    Server-Sent Events when the client accepts text/event-stream.
+    """
+    code = request.json.get("code")
+    options = run_options(request.json)
+    messages = execute_stream(code, **options)
+    try:
+        # Fail before the response starts if no worker is free
+        first = next(messages)
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+
+    sse = request.accept_mimetypes.best == "text/event-stream"
+
+    def records():
+        message = first
+        try:
+            while True:
+                record = dumps(stream_record(message, options))
+                yield f"data: {record}\n\n" if sse else record + "\n"
+                if message[0] in ("done", "error"):
+                    return
+                try:
+                    message = next(messages)
+                except SyntaxError as e:
+                    message = ("error", f"Syntax Error: {str(e)}")
+                except Exception as e:
+                    message = ("error", str(e))
+        finally:
+            # A client that disconnects early frees its worker straight away
+            messages.close()
+
+    return Response(records(),
+                    mimetype="text/event-stream" if sse else "application/x-ndjson",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+def stream_record(message, options):
+    if message[0] == "start":
+        return {"type": "start", "initial_arr": message[1],
+                "keyframe_interval": options["keyframe_interval"]}
+    if message[0] == "events":
+        _, start, events = message
+        return {"type": "events", "start": start, "manipulations": events,
+                "line_nums": [m["line"] for m in events if "line" in m]}
+    if message[0] == "error":
+        return {"type": "error", "error": message[1]}
+    initial_arr, final_arr, _, _, meta = message[1]
+    return {"type": "done", "final_arr": final_arr, "truncated": meta["truncated"],
+            "truncation_reason": meta["truncation_reason"], "index": meta.get("index"),
+            "counters": meta.get("counters"), "profile": meta.get("profile")}
+
+@app.route("/api/state_at", methods=["POST"])
+def state_at_step():
+    """
+    The array and variables right after event `step` of a submission's trace. With the same
+    options as the original /api/submit_code call the trace comes from the cache, and its
+    keyframe index means only the last few events are replayed.
+    """
+    code = request.json.get("code")
+    options = run_options(request.json)
+    try:
+        initial_arr, _, manipulations, _, meta = execute(code, **options)
+    except SyntaxError as e:
+        return jsonify({"error": f"Syntax Error: {str(e)}"}), 400
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    step = int(request.json.get("step", 0))
+    if not 0 <= step < len(manipulations):
+        return jsonify({"error": f"step must be between 0 and {len(manipulations) - 1}"}), 400
+    index = meta.get("index") or build_index(initial_arr, manipulations, DEFAULT_KEYFRAME_INTERVAL)
+    state, variables = state_at(manipulations, index, step)
+    return jsonify({"step": step, "state": state, "variables": variables})
+
+@app.route("/api/session", methods=["POST"])
+def session_start():
+    """
+    Starts a step-through session for the same input as /api/submit_code. The code only runs
+    as far as /api/session/<id>/next has asked for; idle sessions are closed after a while.
+    """
+    code = request.json.get("code")
+    options = run_options(request.json)
+    try:
+        session_id, session = sessions.open(lambda: start_session(code, **options))
+    except (TooManySessions, PoolBusy) as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({
+        "session_id": session_id,
+        "initial_arr": session.initial_arr,
+        "keyframe_interval": options["keyframe_interval"],
+    })
+
+@app.route("/api/session/<session_id>/next", methods=["POST"])
+def session_next(session_id):
+    """The next `count` events; "done" is set (with final_arr and the truncation flags) on the last batch."""
+    count = min(max(1, int((request.json or {}).get("count", 200))), SESSION_MAX_COUNT)
+    try:
+        start, events, result = sessions.next(session_id, count)
+    except UnknownSession:
+        return jsonify({"error": "Unknown or expired session"}), 404
+    except SyntaxError as e:
+        return jsonify({"error": f"Syntax Error: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    response = {
+        "start": start,
+        "manipulations": events,
+        "line_nums": [m["line"] for m in events if "line" in m],
+        "done": result is not None,
+    }
+    if result is not None:
+        _, final_arr, _, _, meta = result
+        response.update(final_arr=final_arr, truncated=meta["truncated"],
+                        truncation_reason=meta["truncation_reason"], index=meta.get("index"),
+                        counters=meta.get("counters"), profile=meta.get("profile"))
+    return jsonify(response)
+
+@app.route("/api/session/<session_id>/close", methods=["POST"])
+def session_close(session_id):
+    return jsonify({"closed": sessions.close(session_id)})
+
+@app.route("/api/complexity", methods=["POST"])
+def complexity():
+    """
+    Empirical complexity of a submission: runs it on generated inputs for its array, of
+    `size_count` sizes up to `max_size` and the requested `kinds` (see sweep.SWEEP_KINDS),
+    spread over the sandbox workers, and returns the operation counts with growth curves
+    fitted to them (see sweep.run_sweep). Only the counters are collected, no trace.
+    """
+    body = request.json
+    code = body.get("code")
+    try:
+        sizes = sweep_sizes(body.get("max_size", DEFAULT_MAX_SIZE),
+                            body.get("size_count", DEFAULT_SIZE_COUNT))
+        result = run_sweep(code, execute_uncached, sizes,
+                           kinds=tuple(body.get("kinds", SWEEP_KINDS)),
+                           seed=int(body.get("seed", 0)),
+                           workers=SANDBOX_WORKERS or 1,
+                           engine=body.get("engine", SWEEP_ENGINE),
+                           limits=TRACE_LIMITS)
+    except SyntaxError as e:
+        return jsonify({"error": f"Syntax Error: {str(e)}"}), 400
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
+    except Exception as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(result)
+
+@app.route("/api/race", methods=["POST"])
+def race():
+    """
+    Runs several programs ({"name", "code"} each, under "programs") on the same initial array,
+    concurrently across the sandbox workers, and returns one lane per program: its trace, its
+    counters and "clock", the operation count at each of its events (see counters.ClockedLog).
+    Playing every lane against that shared clock keeps them in lockstep.
+
+    The array is the body's "initial_arr" if given, else the first program's own. Other run
+    options are those of /api/submit_code. A program that fails gets an "error" lane; the
+    others still run.
+    """
+    programs = request.json.get("programs") or []
+    if not 0 < len(programs) <= RACE_MAX_PROGRAMS:
+        return jsonify({"error": f"Send between 1 and {RACE_MAX_PROGRAMS} programs"}), 400
+    options = run_options(request.json)
+    initial_arr = request.json.get("initial_arr")
+    if initial_arr is None:
+        try:
+            initial_arr = initial_array_of(programs[0].get("code") or [])[0]
+        except PoolBusy as e:
+            return jsonify({"error": str(e)}), 503
+        except Exception as e:
+            return jsonify({"error": str(e)}), 400
+
+    def run_lane(program):
+        lane = {"name": program.get("name")}
+        try:
+            _, final_arr, manipulations, line_nums, meta = execute(
+                program.get("code"), input_arr=initial_arr, clock=True, **options)
+        except SyntaxError as e:
+            lane["error"] = f"Syntax Error: {str(e)}"
+            return lane
+        except PoolBusy:
+            raise
+        except Exception as e:
+            lane["error"] = str(e)
+            return lane
+        lane.update(final_arr=final_arr, manipulations=manipulations, line_nums=line_nums,
+                    clock=meta["clock"], counters=meta["counters"], truncated=meta["truncated"],
+                    truncation_reason=meta["truncation_reason"], index=meta.get("index"),
+                    profile=meta.get("profile"))
+        return lane
+
+    try:
+        with ThreadPoolExecutor(min(len(programs), SANDBOX_WORKERS or 1)) as executor:
+            lanes = list(executor.map(run_lane, programs))
+    except PoolBusy as e:
+        return jsonify({"error": str(e)}), 503
+    response = jsonify({
+        "initial_arr": initial_arr,
+        "keyframe_interval": options["keyframe_interval"],
+        "lanes": lanes,
+    })
+    compress(response, negotiate_encoding())
+    response.vary.add("Accept-Encoding")
+    return response
+
+@app.route("/api/cache_stats", methods=["GET"])
+def cache_stats():
+    if trace_cache is None:
+        return jsonify({"enabled": False})
+    return jsonify({"enabled": True, **trace_cache.stats()})
+
 # def clean_code(code):
 #     return [line for line in code if line.strip()]  
 # This is required for Vercel
@@ -0,0 +1,96 @@
+# sessions.py
+# Open step-through sessions (watcher.TraceSession or sandbox.SandboxSession) by id, closing
+# the ones nobody has advanced for a while.
+
+import threading
+import time
+import uuid
+
+class TooManySessions(Exception):
+    """Every session slot is taken."""
+
+class UnknownSession(KeyError):
+    """No open session has this id (it may have been evicted)."""
+
+class _Entry:
+    __slots__ = ("session", "lock", "last_used")
+
+    def __init__(self, session):
+        self.session = session
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+
+class SessionRegistry:
+    """
+    Holds at most max_sessions sessions. One not advanced for idle_seconds is closed by a
+    background sweep, which runs every idle_seconds / 4.
+    """
+    def __init__(self, max_sessions=16, idle_seconds=120):
+        self.max_sessions = max_sessions
+        self.idle_seconds = idle_seconds
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._sweeper = None
+
+    def open(self, start):
+        """Calls start() for a new session and returns (session_id, session)."""
+        self.sweep()
+        with self._lock:
+            if len(self._entries) >= self.max_sessions:
+                raise TooManySessions("Too many open sessions, try again shortly")
+            session_id = uuid.uuid4().hex
+            # Hold the slot while the session starts
+            self._entries[session_id] = None
+        try:
+            session = start()
+        except BaseException:
+            with self._lock:
+                del self._entries[session_id]
+            raise
+        with self._lock:
+            self._entries[session_id] = _Entry(session)
+            if self._sweeper is None:
+                self._sweeper = threading.Thread(target=self._sweep_forever, daemon=True)
+                self._sweeper.start()
+        return session_id, session
+
+    def next(self, session_id, count):
+        """session.next(count) for the session with this id; closes it once it has finished."""
+        with self._lock:
+            entry = self._entries.get(session_id)
+        if entry is None:
+            raise UnknownSession(session_id)
+        with entry.lock:
+            entry.last_used = time.monotonic()
+            try:
+                start, events, result = entry.session.next(count)
+            except Exception:
+                self.close(session_id)
+                raise
+            entry.last_used = time.monotonic()
+        if result is not None:
+            self.close(session_id)
+        return start, events, result
+
+    def close(self, session_id):
+        """Closes the session; returns False if it was not open."""
+        with self._lock:
+            entry = self._entries.pop(session_id, None)
+        if entry is None:
+            return False
+        entry.session.close()
+        return True
+
+    def sweep(self):
+        """Closes every session idle for longer than idle_seconds."""
+        cutoff = time.monotonic() - self.idle_seconds
+        with self._lock:
+            idle = [session_id for session_id, entry in self._entries.items()
+                    if entry is not None and entry.last_used < cutoff and not entry.lock.locked()]
+        for session_id in idle:
+            self.close(session_id)
+
+    def _sweep_forever(self):
+        while True:
+            time.sleep(self.idle_seconds / 4)
+            self.sweep()
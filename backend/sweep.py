@@ -0,0 +1,133 @@
+# sweep.py
+# Empirical complexity: runs a program on generated inputs of growing size, keeping only its
+# operation counters (see counters.OpCounters), and fits growth curves to the counts.
+
+import math
+import random
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+from watcher import extract_initial_array
+
+# Input shapes a sweep can generate, in response order
+SWEEP_KINDS = ("random", "sorted", "reversed", "few_unique")
+
+# Distinct values in a "few_unique" input
+FEW_UNIQUE_VALUES = 4
+
+# Smallest input size, and the defaults for the largest one and the number of sizes
+SWEEP_MIN_SIZE = 8
+DEFAULT_MAX_SIZE = 512
+DEFAULT_SIZE_COUNT = 10
+
+# Bounds on what a request may ask for
+SWEEP_MAX_SIZE = 10_000
+SWEEP_MAX_SIZE_COUNT = 20
+
+# Engine a sweep runs under unless asked otherwise: sys.monitoring counts lines at a
+# fraction of settrace's cost, and the "ast" engine can't count them at all
+SWEEP_ENGINE = "monitoring" if hasattr(sys, "monitoring") else "settrace"
+
+# Counters that get growth curves fitted
+SWEEP_COUNTERS = ("reads", "writes", "swaps", "comparisons", "lines")
+
+# Growth curves fitted to each counter, as count ~ a * f(n) + b
+GROWTH_MODELS = {
+    "n": lambda n: n,
+    "n log n": lambda n: n * math.log2(n),
+    "n^2": lambda n: n * n,
+}
+
+def sweep_sizes(max_size=DEFAULT_MAX_SIZE, count=DEFAULT_SIZE_COUNT):
+    """count distinct input sizes from SWEEP_MIN_SIZE to max_size, spaced geometrically."""
+    max_size = min(max(int(max_size), SWEEP_MIN_SIZE), SWEEP_MAX_SIZE)
+    count = min(max(int(count), 2), SWEEP_MAX_SIZE_COUNT)
+    ratio = max_size / SWEEP_MIN_SIZE
+    sizes = {round(SWEEP_MIN_SIZE * ratio ** (k / (count - 1))) for k in range(count)}
+    return sorted(sizes)
+
+def make_input(kind, n, rng):
+    """An input of n ints of the given kind (see SWEEP_KINDS), drawn from rng."""
+    if kind == "few_unique":
+        return [rng.randrange(FEW_UNIQUE_VALUES) for _ in range(n)]
+    values = [rng.randrange(10 * n) for _ in range(n)]
+    if kind == "sorted":
+        values.sort()
+    elif kind == "reversed":
+        values.sort(reverse=True)
+    elif kind != "random":
+        raise ValueError(f"Unknown input kind {kind!r}, expected one of {', '.join(SWEEP_KINDS)}")
+    return values
+
+def fit_growth(sizes, counts):
+    """
+    Least-squares fits of counts against each of GROWTH_MODELS. Returns {"best": the model
+    with the highest r2, "models": {model: {"a", "b", "r2"}}}; "best" is None when the counts
+    don't vary (nothing to tell the models apart by) or there are fewer than three points.
+    """
+    models = {}
+    for name, growth in GROWTH_MODELS.items():
+        xs = [growth(n) for n in sizes]
+        models[name] = _linear_fit(xs, counts)
+    best = None
+    if len(sizes) >= 3 and len(set(counts)) > 1:
+        best = max(models, key=lambda name: models[name]["r2"])
+    return {"best": best, "models": models}
+
+def _linear_fit(xs, ys):
+    """{"a", "b", "r2"} for ys ~ a * x + b."""
+    count = len(xs)
+    if count == 0:
+        return {"a": 0.0, "b": 0.0, "r2": 0.0}
+    mean_x, mean_y = sum(xs) / count, sum(ys) / count
+    sxx = sum((x - mean_x) ** 2 for x in xs)
+    sxy = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys))
+    a = sxy / sxx if sxx else 0.0
+    b = mean_y - a * mean_x
+    total = sum((y - mean_y) ** 2 for y in ys)
+    residual = sum((y - (a * x + b)) ** 2 for x, y in zip(xs, ys))
+    r2 = 1 - residual / total if total else 1.0
+    return {"a": a, "b": b, "r2": r2}
+
+def run_sweep(code_lines, run, sizes, kinds=SWEEP_KINDS, seed=0, workers=1, **kwargs):
+    """
+    Runs code_lines once per input kind and size through run, a run_user_code-compatible
+    callable (e.g. sandbox.SandboxPool.run), with up to workers runs in flight at a time. The
+    runs keep no trace (record_events=False); kwargs go to run as well.
+
+    Returns {"arr_name", "sizes", "kinds": {kind: {"counters": {name: [count per size]},
+    "truncated": [flag per size], "fits": {name: fit_growth(...)}}}}. A run cut short by its
+    budget is reported but left out of the fits, as its counts are partial. ValueError if the
+    code has no array assignment to substitute the inputs for.
+    """
+    arr_name = extract_initial_array(code_lines)[1]
+    if arr_name is None:
+        raise ValueError("The code has no array assignment to sweep over")
+    for kind in kinds:
+        if kind not in SWEEP_KINDS:
+            raise ValueError(f"Unknown input kind {kind!r}, expected one of {', '.join(SWEEP_KINDS)}")
+
+    rng = random.Random(seed)
+    jobs = [(kind, make_input(kind, n, rng)) for kind in kinds for n in sizes]
+
+    def run_job(job):
+        _, _, _, _, meta = run(code_lines, input_arr=job[1], record_events=False,
+                               diff_arrays=False, **kwargs)
+        return meta
+
+    with ThreadPoolExecutor(max(1, workers)) as executor:
+        metas = list(executor.map(run_job, jobs))
+
+    result = {"arr_name": arr_name, "sizes": sizes, "kinds": {}}
+    for k, kind in enumerate(kinds):
+        runs = metas[k * len(sizes):(k + 1) * len(sizes)]
+        counters = {name: [meta["counters"][name] for meta in runs] for name in SWEEP_COUNTERS}
+        truncated = [meta["truncated"] for meta in runs]
+        complete = [i for i, cut in enumerate(truncated) if not cut]
+        fits = {}
+        for name, counts in counters.items():
+            if counts[0] is None:
+                continue  # lines under the "ast" engine
+            fits[name] = fit_growth([sizes[i] for i in complete], [counts[i] for i in complete])
+        result["kinds"][kind] = {"counters": counters, "truncated": truncated, "fits": fits}
+    return result
@@ -0,0 +1,7 @@
+# conftest.py
+# The backend modules import each other by bare name, as the server runs from backend/.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,108 @@
+# test_analysis.py
+# Which assignment analysis.initial_array takes the submitted array from.
+
+import ast
+import tracemalloc
+
+import pytest
+
+from analysis import FOLD_MAX_ELEMENTS, bypasses_tracking, initial_array
+from replay import reconstruct_state
+from watcher import TraceSession, run_user_code, stream_user_code
+
+BUBBLE_WITH_TMP = """\
+def bubble(a):
+    tmp = []
+    n = len(a)
+    for i in range(n):
+        for j in range(n - i - 1):
+            if a[j] > a[j + 1]:
+                a[j], a[j + 1] = a[j + 1], a[j]
+arr = [int(c) for c in '52413']
+bubble(arr)"""
+
+@pytest.mark.parametrize("code, expected", [
+    ("arr = [3, 1, 2]", ([3, 1, 2], "arr")),
+    ("arr = list(range(5))[::-1]", ([4, 3, 2, 1, 0], "arr")),
+    ("arr = sorted([3, 1, 2], reverse=True)", ([3, 2, 1], "arr")),
+    ("arr = [0] * 4 + [1]", ([0, 0, 0, 0, 1], "arr")),
+    # A module-level binding wins over any function-local one, folded or not
+    (BUBBLE_WITH_TMP, (None, "arr")),
+    ("def f():\n    tmp = [1]\narr = list(data())", (None, "arr")),
+    ("def f():\n    tmp = []\narr = [x for x in src]", (None, "arr")),
+    # Bindings that fold to something other than a list are never the array
+    ("n = 5\narr = rng.sample(pool, n)", (None, "arr")),
+    # Nor are ones that can't build a list at all
+    ("x = 5\ny = x + 1\nprint(y)", (None, None)),
+    ("n = 5\nk = f(n)\nname = 'a' + str(k)", (None, None)),
+    ("if True:\n    arr = [2, 1]", ([2, 1], "arr")),
+    # Function bodies are searched only when the module binds nothing
+    ("def f():\n    tmp = [1, 2]", ([1, 2], "tmp")),
+    ("x = 1", (None, None)),
+    ("arr = [0] * 10**9", (None, "arr")),
+])
+def test_initial_array(code, expected):
+    assert initial_array(ast.parse(code)) == expected
+
+def test_folding_stops_once_the_elements_built_pass_the_limit():
+    # Each element is under the limit; together they are 200 times over it
+    tree = ast.parse("arr = [" + ", ".join(["[0] * 99999"] * 200) + "]")
+    tracemalloc.start()
+    try:
+        assert initial_array(tree) == (None, "arr")
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert peak < 4 * 8 * FOLD_MAX_ELEMENTS
+
+@pytest.mark.parametrize("code", [
+    BUBBLE_WITH_TMP,
+    "arr = list(range(5))[::-1]\narr.sort()",
+    "arr = sorted([3, 1, 2], reverse=True)\narr.sort()",
+])
+@pytest.mark.parametrize("engine", ["settrace", "ast"])
+def test_detected_array_is_traced(code, engine):
+    _, final_arr, manipulations, _, _ = run_user_code(code.split("\n"), engine=engine)
+    assert final_arr == sorted(final_arr) and final_arr
+    assert any(m["type"] in ("swap", "sort") for m in manipulations)
+
+@pytest.mark.parametrize("code", [
+    "x = 5\ny = x + 1\nprint(y)",
+    # Bound to a method call, which returns a str
+    "s = 'cab'\narr = s.upper()",
+])
+def test_code_without_a_list(code):
+    initial_arr, final_arr, _, _, _ = run_user_code(code.split("\n"))
+    assert initial_arr == final_arr == []
+
+@pytest.mark.parametrize("keyframe_interval", [None, 2])
+@pytest.mark.parametrize("engine", ["settrace", "ast"])
+def test_array_built_at_runtime(engine, keyframe_interval):
+    code = ["n = 5", "arr = [i * 2 for i in range(n)]", "arr[0], arr[4] = arr[4], arr[0]"]
+    initial_arr, final_arr, manipulations, _, _ = run_user_code(
+        code, engine=engine, keyframe_interval=keyframe_interval)
+    assert initial_arr == [0, 2, 4, 6, 8]
+    assert final_arr == reconstruct_state(initial_arr, manipulations, len(manipulations) - 1)
+    messages = list(stream_user_code(code, chunk_size=1, engine=engine))
+    assert messages[0] == ("start", [0, 2, 4, 6, 8])
+    assert TraceSession(code, engine=engine).initial_arr == [0, 2, 4, 6, 8]
+
+@pytest.mark.parametrize("code, expected", [
+    ("arr = [3, 1]\narr.sort()\narr[0:1] = []", False),
+    ("arr = list(range(3))", False),
+    ("import heapq\nheapq.heapify(arr)", True),
+    ("from bisect import insort", True),
+    ("list.append(arr, 1)", True),
+    ("arr.__setitem__(0, 1)", True),
+    ("getattr(arr, 'append')(1)", True),
+])
+def test_bypasses_tracking(code, expected):
+    assert bypasses_tracking(ast.parse(code)) is expected
+
+@pytest.mark.parametrize("code", [
+    "import heapq\narr = [3, 1, 2]\nheapq.heapify(arr)",
+    "arr = [3, 1, 2]\nlist.__setitem__(arr, 0, 9)",
+])
+def test_bypassing_code_is_diffed_by_default(code):
+    _, final_arr, manipulations, _, _ = run_user_code(code.split("\n"))
+    assert manipulations and manipulations[-1]["state"] == final_arr
@@ -0,0 +1,67 @@
+# test_calls.py
+# Call and return events (run_user_code(calls=True)) under every engine.
+
+import sys
+
+import pytest
+
+from watcher import ENGINES, run_user_code
+
+ENGINES_HERE = [engine for engine in ENGINES
+                if engine != "monitoring" or hasattr(sys, "monitoring")]
+
+DEEP = """\
+arr = [0]
+def f(n):
+    return 0 if n == 0 else f(n - 1) + 1
+arr.append(f(700))"""
+
+MIXED = """\
+arr = [1]
+def g(x):
+    if x:
+        raise ValueError(x)
+    return 7
+def h(x):
+    try:
+        return g(x)
+    except ValueError:
+        return -1
+def gen(n):
+    yield n
+def kw(a, *rest, b=2, **extra):
+    return a
+arr.append(h(1))
+arr.append(h(0))
+arr.append(sum(gen(4)))
+arr.append((lambda z: z)(5))
+arr.append(kw(1, 9, b=3, c=4))"""
+
+def call_events(code, engine, **kwargs):
+    _, final_arr, manipulations, _, _ = run_user_code(code.split("\n"), engine=engine,
+                                                      calls=True, **kwargs)
+    return final_arr, [m.to_dict() for m in manipulations if m["type"] in ("call", "return")]
+
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+def test_recording_adds_no_frames(engine):
+    final_arr, events = call_events(DEEP, engine)
+    assert final_arr == [0, 700]
+    assert max(m["depth"] for m in events) == 701
+
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+def test_engines_agree(engine):
+    assert call_events(MIXED, engine) == call_events(MIXED, "settrace")
+
+def test_events():
+    _, events = call_events(MIXED, "settrace")
+    assert [(m["type"], m["name"], m["depth"]) for m in events] == [
+        ("call", "h", 1), ("call", "g", 2), ("return", "h", 1),  # g raised
+        ("call", "h", 1), ("call", "g", 2), ("return", "g", 2), ("return", "h", 1),
+        ("call", "kw", 1), ("return", "kw", 1),
+    ]
+    assert events[-2]["args"] == {"a": 1, "b": 3, "rest": [9], "c": 4}
+
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+def test_max_depth(engine):
+    _, events = call_events(DEEP, engine, max_call_depth=3)
+    assert len(events) == 6 and max(m["depth"] for m in events) == 3
@@ -0,0 +1,221 @@
+# test_replay.py
+# Delta traces replay to exactly the states of the full-copy trace, and the edit scripts and
+# permutations TrackedList records rebuild the lists they were taken from.
+
+import random
+import sys
+
+import pytest
+
+from arraydiff import edit_script, permutation_swaps, sort_permutation
+from replay import apply_delta, expand_states, is_main_event, reconstruct_state
+from watcher import BUBBLE_SORT_SAMPLE, ENGINES, run_user_code
+
+ENGINES_HERE = [engine for engine in ENGINES
+                if engine != "monitoring" or hasattr(sys, "monitoring")]
+
+QUICKSORT = """\
+def quick(arr, lo, hi):
+    if lo < hi:
+        pivot = arr[hi]
+        i = lo - 1
+        for j in range(lo, hi):
+            if arr[j] <= pivot:
+                i += 1
+                arr[i], arr[j] = arr[j], arr[i]
+        arr[i + 1], arr[hi] = arr[hi], arr[i + 1]
+        quick(arr, lo, i)
+        quick(arr, i + 2, hi)
+arr = [5, 3, 8, 1, 9, 2, 7, 3]
+quick(arr, 0, len(arr) - 1)"""
+
+HEAPQ = """\
+import heapq
+arr = [9, 4, 7, 1, 8, 2, 6]
+heapq.heapify(arr)
+heapq.heappush(arr, 0)
+smallest = heapq.heappop(arr)
+heapq.heapreplace(arr, 5)"""
+
+SLICES = """\
+arr = [1, 2, 3, 4, 5, 6]
+arr[1:3] = [9, 9, 9]
+arr[::2] = [0, 0, 0, 0]
+del arr[2]
+del arr[-2:]
+arr += [7, 8]
+arr *= 2
+arr[2:] = []
+arr.clear()
+arr.extend([3, 1, 2])"""
+
+SORTS = """\
+arr = [3, -1, 4, -1, 5, -9, 2, 6]
+arr.sort()
+arr.sort(key=abs)
+arr.sort(reverse=True)
+arr.reverse()
+arr.insert(2, 10)
+arr.remove(10)
+arr.pop(0)
+arr.append(-3)
+arr.sort(key=lambda v: v % 3)"""
+
+PROGRAMS = {
+    "bubble": BUBBLE_SORT_SAMPLE,
+    "quicksort": QUICKSORT.split("\n"),
+    "heapq": HEAPQ.split("\n"),
+    "slices": SLICES.split("\n"),
+    "sorts": SORTS.split("\n"),
+}
+
+# Event types of the submitted array that ArrayVisualizer.tsx animates, from their deltas
+VISUALIZED_EVENTS = {"append", "pop", "insert", "extend", "replace", "swap", "remove",
+                     "reverse", "sort"}
+
+def main_states(manipulations):
+    """(step, state) of every event of the submitted array that carries a state."""
+    return [(step, m["state"]) for step, m in enumerate(manipulations)
+            if is_main_event(m) and "state" in m]
+
+@pytest.mark.parametrize("name", PROGRAMS)
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+@pytest.mark.parametrize("interval", [1, 4, 32])
+def test_delta_trace_replays_full_states(name, engine, interval):
+    code = PROGRAMS[name]
+    initial_arr, final_arr, full, _, _ = run_user_code(code, engine=engine)
+    delta_initial, _, delta, _, _ = run_user_code(code, engine=engine, keyframe_interval=interval)
+    assert delta_initial == initial_arr
+    strip = lambda events: [{k: v for k, v in m.to_dict().items() if k != "state"} for m in events]
+    assert strip(delta) == strip(full)
+
+    expected = main_states(full)
+    for step, state in expected:
+        assert reconstruct_state(delta_initial, delta, step) == state
+    assert main_states(expand_states(delta_initial, delta)) == expected
+    if engine != "ast" or name != "heapq":
+        # The "ast" engine has no line hook to catch heapq's writes with, so it records none
+        assert expected[-1][1] == final_arr
+
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+def test_sort_swaps_replay_to_the_sorted_states(engine):
+    code = PROGRAMS["sorts"]
+    _, final_arr, full, _, _ = run_user_code(code, engine=engine)
+    initial_arr, _, swaps, _, _ = run_user_code(code, engine=engine, sort_swaps=True,
+                                                keyframe_interval=8)
+    assert not any(m["type"] == "sort" for m in swaps)
+    assert reconstruct_state(initial_arr, swaps, len(swaps) - 1) == final_arr
+    sorted_lines = {m["line"]: m["state"] for m in full if m["type"] == "sort"}
+    for step, m in enumerate(swaps):
+        last_of_line = step + 1 == len(swaps) or swaps[step + 1]["line"] != m["line"]
+        if m["line"] in sorted_lines and last_of_line:
+            assert reconstruct_state(initial_arr, swaps, step) == sorted_lines[m["line"]]
+
+@pytest.mark.parametrize("statement, expected", [
+    ("del arr[1]", [1, 3, 4, 5]),
+    ("del arr[1:3]", [1, 4, 5]),
+    ("arr[1:3] = [7, 8, 9]", [1, 7, 8, 9, 4, 5]),
+    ("arr[2:2] = [0]", [1, 2, 0, 3, 4, 5]),
+    ("arr[::2] = [0, 0, 0]", [0, 2, 0, 4, 0]),
+    ("arr += [6, 7]", [1, 2, 3, 4, 5, 6, 7]),
+    ("arr *= 2", [1, 2, 3, 4, 5] * 2),
+    ("arr.clear()", []),
+    ("arr.insert(-1, 0)", [1, 2, 3, 4, 0, 5]),
+    ("arr.insert(99, 0)", [1, 2, 3, 4, 5, 0]),
+    ("arr.pop(1)", [1, 3, 4, 5]),
+    ("arr.pop(-2)", [1, 2, 3, 5]),
+    ("arr.extend([6])", [1, 2, 3, 4, 5, 6]),
+    ("import heapq\nheapq.heappush(arr, 0)", [0, 2, 1, 4, 5, 3]),
+])
+@pytest.mark.parametrize("engine", ENGINES_HERE)
+def test_bulk_edits_replay_from_their_deltas(statement, expected, engine):
+    if engine == "ast" and "heapq" in statement:
+        pytest.skip("The ast engine has no line hook to catch heapq's writes with")
+    code = ["arr = [1, 2, 3, 4, 5]"] + statement.split("\n")
+    initial_arr, final_arr, manipulations, _, _ = run_user_code(code, engine=engine)
+    assert final_arr == expected
+    state = list(initial_arr)
+    for m in manipulations:
+        if is_main_event(m):
+            assert m["type"] in VISUALIZED_EVENTS
+            apply_delta(state, m)
+    assert state == expected
+
+def test_sort_events_name_their_key_function():
+    # A lambda's repr has its address, which differs between runs that aren't one after another
+    sorts = [m.to_dict() for m in run_user_code(PROGRAMS["sorts"])[2] if m["type"] == "sort"]
+    assert sorts[-1]["kwargs"] == {"key": "<function <lambda>>"}
+    assert sorts[1]["kwargs"] == {"key": "<function abs>"}
+
+def apply_edits(values, edits):
+    values = list(values)
+    for edit in edits:
+        kind, index = edit[0], edit[1]
+        if kind == "replace":
+            values[index] = edit[2]
+        elif kind == "swap":
+            values[index], values[edit[2]] = values[edit[2]], values[index]
+        elif kind == "insert":
+            values.insert(index, edit[2])
+        else:
+            del values[index]
+    return values
+
+def mutate(rng, values):
+    """values after a few random list operations, like the ones heapq and slices make."""
+    values = list(values)
+    for _ in range(rng.randrange(4)):
+        op = rng.randrange(5)
+        if op == 0 and values:
+            i, j = rng.randrange(len(values)), rng.randrange(len(values))
+            values[i], values[j] = values[j], values[i]
+        elif op == 1 and values:
+            values[rng.randrange(len(values))] = rng.randrange(5)
+        elif op == 2:
+            values.insert(rng.randrange(len(values) + 1), rng.randrange(5))
+        elif op == 3 and values:
+            del values[rng.randrange(len(values))]
+        else:
+            start = rng.randrange(len(values) + 1)
+            values[start:rng.randrange(start, len(values) + 1)] = [rng.randrange(5)] * rng.randrange(3)
+    return values
+
+def test_edit_script_round_trips():
+    rng = random.Random(0)
+    for _ in range(5000):
+        old = [rng.randrange(5) for _ in range(rng.randrange(10))]
+        new = mutate(rng, old) if rng.random() < 0.8 else [rng.randrange(5) for _ in range(rng.randrange(10))]
+        assert apply_edits(old, edit_script(old, new)) == new
+
+def test_edit_script_keeps_shifts_short():
+    old = list(range(100))
+    assert edit_script(old, old) == []
+    assert edit_script(old, [-1] + old) == [("insert", 0, -1)]
+    assert edit_script(old, old[1:]) == [("delete", 0)]
+    swapped = old[:]
+    swapped[3], swapped[70] = swapped[70], swapped[3]
+    assert edit_script(old, swapped) == [("swap", 3, 70)]
+
+def test_permutations():
+    rng = random.Random(1)
+    for _ in range(2000):
+        values = [rng.randrange(6) for _ in range(rng.randrange(12))]
+        key = rng.choice([None, lambda v: -v, lambda v: v % 2])
+        reverse = rng.random() < 0.5
+        permutation = sort_permutation(values, key=key, reverse=reverse)
+        assert [values[i] for i in permutation] == sorted(values, key=key, reverse=reverse)
+
+        swapped = list(values)
+        swaps = list(permutation_swaps(permutation))
+        for i, j in swaps:
+            swapped[i], swapped[j] = swapped[j], swapped[i]
+        assert swapped == [values[i] for i in permutation]
+        cycles, seen = 0, set()
+        for start in range(len(permutation)):
+            if start not in seen:
+                cycles += 1
+                k = start
+                while k not in seen:
+                    seen.add(k)
+                    k = permutation[k]
+        assert len(swaps) == len(permutation) - cycles
@@ -0,0 +1,220 @@
+# trace_cache.py
+# Content-addressed LRU cache of run_user_code results, optionally persisted to disk.
+#
+# The key is a hash of the normalized AST (so whitespace, comments and blank lines don't
+# matter) plus ENGINE_VERSION and the run options. Because edits like an added comment line
+# shift line numbers without changing the AST, a hit has its "line" fields remapped onto the
+# new source.
+
+import ast
+import copy
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+from collections import OrderedDict
+
+from watcher import ENGINE_VERSION, normalize_indentation
+
+# run_user_code options that don't change a complete trace; truncated traces aren't cached
+UNKEYED_OPTIONS = {"limits"}
+
+def program_key(code_lines, options):
+    """
+    Returns (key, node_lines) for the program, or (None, None) if it doesn't parse.
+    node_lines is the line number of every AST node in walk order, used for remapping.
+    """
+    source = "\n".join(normalize_indentation(code_lines))
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        return None, None
+    keyed = sorted((k, repr(v)) for k, v in options.items() if k not in UNKEYED_OPTIONS)
+    digest = hashlib.sha256()
+    digest.update(f"{ENGINE_VERSION}\0{keyed!r}\0".encode())
+    digest.update(ast.dump(tree).encode())
+    node_lines = [node.lineno for node in ast.walk(tree) if hasattr(node, "lineno")]
+    return digest.hexdigest(), node_lines
+
+def remap_lines(result, old_lines, new_lines):
+    """Rewrites the line numbers in a cached result for a program laid out as new_lines."""
+    if old_lines == new_lines:
+        return result
+    mapping = {}
+    for old, new in zip(old_lines, new_lines):
+        if mapping.setdefault(old, new) != new:
+            return None  # a line was split or joined; the old numbers can't be mapped
+    initial_arr, final_arr, manipulations, line_nums, meta = result
+    remapped = []
+    for m in manipulations:
+        m = copy.copy(m)
+        m.line = mapping.get(m.line, m.line)
+        remapped.append(m)
+    manipulations = remapped
+    line_nums = [mapping.get(line, line) for line in line_nums]
+    if "index" in meta:
+        lines = {}
+        for line, steps in meta["index"]["lines"].items():
+            lines.setdefault(mapping.get(line, line), []).extend(steps)
+        index = {**meta["index"], "lines": {line: sorted(steps) for line, steps in lines.items()}}
+        meta = {**meta, "index": index}
+    if meta.get("profile"):
+        meta = {**meta, "profile": remap_profile(meta["profile"], mapping)}
+    return initial_arr, final_arr, manipulations, line_nums, meta
+
+def remap_profile(profile, mapping):
+    """A lineprofile.LineProfile dict with its per-line totals moved to the mapped lines."""
+    size = max([len(profile["hits"]) - 1, *mapping.values()]) + 1
+    remapped = {name: [0] * size for name in profile}
+    for name, totals in profile.items():
+        for line, total in enumerate(totals):
+            if total:
+                remapped[name][mapping.get(line, line)] += total
+    return remapped
+
+class _Entry:
+    __slots__ = ("result", "node_lines", "size")
+
+    def __init__(self, result, node_lines, size):
+        self.result = result
+        self.node_lines = node_lines
+        self.size = size
+
+class TraceCache:
+    """
+    LRU over whole results, bounded by max_entries and by max_bytes of pickled size. With a
+    directory, entries are also written there and survive restarts (the directory is trusted:
+    entries are loaded with pickle).
+
+    Programs are assumed deterministic, so one that uses `random` replays its first trace.
+    """
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024, directory=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = {}  # loaded results; with a directory some live only on disk
+        self._sizes = OrderedDict()  # every cached key in LRU order
+        self._bytes = 0
+        self._lock = threading.Lock()
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self._load_index()
+
+    def get_or_run(self, run, code_lines, program=None, **options):
+        """
+        Returns run(code_lines, **options), from the cache when the same program ran before.
+        program is program_key(code_lines, options), for a caller that already computed it.
+        """
+        key, node_lines = program if program is not None else program_key(code_lines, options)
+        if key is None:
+            return run(code_lines, **options)
+        result = self._lookup(key, node_lines)
+        if result is None:
+            result = run(code_lines, **options)
+            self.put((key, node_lines), result)
+        return result
+
+    def get(self, code_lines, program=None, **options):
+        """
+        The cached result for running code_lines with options, or None (counted as a miss).
+        program is program_key(code_lines, options), for a caller that already computed it.
+        """
+        key, node_lines = program if program is not None else program_key(code_lines, options)
+        if key is None:
+            return None
+        return self._lookup(key, node_lines)
+
+    def put(self, program, result):
+        """Caches result for program (see program_key), unless it was truncated."""
+        key, node_lines = program
+        if key is not None and not result[4]["truncated"]:
+            self._put(key, _Entry(result, node_lines, 0))
+
+    def _lookup(self, key, node_lines):
+        entry = self._get(key)
+        if entry is not None:
+            result = remap_lines(entry.result, entry.node_lines, node_lines)
+            if result is not None:
+                with self._lock:
+                    self.hits += 1
+                return result
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "entries": len(self._sizes),
+                "bytes": self._bytes,
+            }
+
+    def _get(self, key):
+        with self._lock:
+            if key not in self._sizes:
+                return None
+            self._sizes.move_to_end(key)
+            entry = self._entries.get(key)
+        if entry is None and self.directory is not None:
+            try:
+                with open(self._path(key), "rb") as f:
+                    entry = pickle.load(f)
+            except (OSError, pickle.UnpicklingError, EOFError):
+                return None
+            with self._lock:
+                if key in self._sizes:
+                    self._entries[key] = entry
+        return entry
+
+    def _put(self, key, entry):
+        blob = pickle.dumps(entry, protocol=pickle.HIGHEST_PROTOCOL)
+        entry.size = len(blob)
+        if entry.size > self.max_bytes:
+            return
+        if self.directory is not None:
+            fd, tmp = tempfile.mkstemp(dir=self.directory)
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmp, self._path(key))
+        with self._lock:
+            if key in self._sizes:
+                self._bytes -= self._sizes[key]
+            self._sizes[key] = entry.size
+            self._sizes.move_to_end(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            self._evict()
+
+    def _evict(self):
+        while len(self._sizes) > self.max_entries or self._bytes > self.max_bytes:
+            key, size = self._sizes.popitem(last=False)
+            self._entries.pop(key, None)
+            self._bytes -= size
+            self.evictions += 1
+            if self.directory is not None:
+                try:
+                    os.remove(self._path(key))
+                except OSError:
+                    pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def _load_index(self):
+        files = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".pickle"):
+                path = os.path.join(self.directory, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, name[:-len(".pickle")], stat.st_size))
+        for _, key, size in sorted(files):
+            self._sizes[key] = size
+            self._bytes += size
+        self._evict()
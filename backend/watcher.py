@@ -1,132 +1,529 @@
 import sys
 import ast
-import io
+import copy
 import types
-import json
-from contextlib import redirect_stdout
+import functools
+import inspect
+import queue
+import threading
+import time
+import weakref
+from contextlib import nullcontext
 
-SAFE_BUILTINS = {
+from analysis import array_binding, bypasses_tracking, initial_array, watched_names
+from arraydiff import edit_script, permutation_swaps, sort_permutation
+from encoding import SCALAR_TYPES, json_safe, stable_repr
+from counters import ClockedLog, OpCounters, WriteTally
+from events import (Append, Call, Compare, Extend, Insert, NewArray, Pop, Read, Remove, Replace,
+                    Return, Reverse, Sort, Swap, Variable)
+from instrument import (CALLS_NAME, COMPARE_NAME, COMPARE_OPERATORS, COUNTERS_NAME, INPUT_NAME,
+                        LIST_NAME, RECORDER_NAME, TICK_NAME, VariableRecorder, hook_calls,
+                        hook_compares, instrument, substitute_input, track_lists)
+from limits import TraceBudget, TraceBudgetExceeded
+from lineprofile import LineProfile
+from replay import MAIN_ARRAY, build_index
+
+class DiscardOutput:
+    """A write-only file that drops everything written to it."""
+    def write(self, text):
+        return len(text)
+
+    def flush(self):
+        pass
+
+# The builtins every run's exec globals start from, built once and copied per run. The
+# user's print output is discarded; binding print instead of redirecting sys.stdout keeps
+# other threads' output intact while a streamed or session run is paused.
+SAFE_BUILTINS = types.MappingProxyType({
     "range": range,
     "len": len,
     "int": int,
     "float": float,
     "str": str,
     "bool": bool,
-    "list": list
-}
+    "list": list,
+    "print": functools.partial(print, file=DiscardOutput()),
+})
+
+# Array events that can be re-applied from their delta alone (see replay.py). Anything
+# else always carries a full "state" keyframe.
+REPLAYABLE_EVENTS = {"append", "pop", "replace", "swap", "insert", "remove", "extend", "reverse",
+                     "sort", "read"}
+
+# Bump whenever a change alters the trace run_user_code produces for the same program, so
+# cached traces (see trace_cache.py) from older code are not served
+ENGINE_VERSION = 12
+
+# co_filename of the submitted code, as shown in its tracebacks
+USER_FILENAME = "<user_code>"
+
+# Events per chunk handed to the sink of a streamed run (see EventLog)
+STREAM_CHUNK_SIZE = 256
 
 class LocalVarTracer:
-    def __init__(self, manipulations):
+    """
+    sys.settrace tracer. user_codes holds the id() of every code object compiled from the
+    user's source (see CompiledProgram); frames of any other code are not traced at all.
+    With counters (see counters.OpCounters), user line events are counted too, with a
+    profile (see lineprofile.LineProfile) timed per line, and with a CallRecorder, calls and
+    returns of the user's functions recorded.
+    """
+    def __init__(self, manipulations, watched, user_codes, budget=None, differ=None,
+                 counters=None, profile=None, calls=None):
         self.manipulations = manipulations
-        self.last_locals = {}
+        self.watched = watched
+        self.user_codes = user_codes
+        self.budget = budget
+        self.differ = differ
+        self.counters = counters
+        self.profile = profile
+        self.calls = calls
+        self.last_values = {}
+        self.code_names = {}
+        # (frame, f_lasti) of the last exception event, to tell a "return" that unwinds
+        self.raised = None
 
     def __call__(self, frame, event, arg):
         if event == "line":
-            if frame.f_code.co_name == "<module>":
+            if self.counters is not None:
+                self.counters.lines += 1
+            if self.profile is not None:
+                self.profile.hit(frame.f_lineno)
+            if self.budget is not None:
+                self.budget.tick()
+            if self.differ is not None:
+                self.differ.sync(frame.f_lineno)
+            if frame.f_code.co_name == "<module>" or not self.watched:
                 return self
             lineno = frame.f_lineno
-            filename = frame.f_code.co_filename
-            if "watcher.py" in filename or "server.py" in filename:
-                return self
-            
-            allowed_vars = {"i", "j", "k", "x", "y", "min_idx","max_idx", "arr", "pi", 
-                            "pivot", "a", "b", "c","n", "swapped", "ARRAY", "array", "arr_name",
-                            "pivot_idx", "left", "right", "temp", "target", "n", "m", "l", "r",
-                            "mid", "val", "idx", "key",
-                            # Common result variables
-                            "result", "res", "output", "ans",
-                            
-                            # Window-related variables (for sliding window algorithms)
-                            "window", "window_size", "window_start", "window_end",
-                            
-                            # Min/Max related
-                            "min_val", "max_val", "minimum", "maximum",
-                            
-                            # Sum/Product related
-                            "sum", "total", "product",
-                            
-                            # Sorting related
-                            "sorted_arr", "sorted_array", "sorted",
-                            
-                            # Pointer related
-                            "slow", "fast", "pointer",
-                            # Additional common array variables
-                            "nums", "numbers", "list", "items", "data",
-                            
-                            # Additional index/position variables
-                            "pos", "position", "index", "idx", "start", "end", "mid", "middle",
-                            
-                            # Additional counter variables
-                            "count", "size", "length", "len",
-                            
-                            # Additional temporary variables
-                            "tmp", "val", "value", "curr", "current", "prev", "next"
-                            }
-            locals_dict = frame.f_locals
-
-            for var_name, var_value in locals_dict.items():
-                if var_name not in allowed_vars or var_name in {"self", "new_target"}:
-                    continue 
-                if isinstance(var_value, types.FunctionType):
-                    continue
-
-                old_val = self.last_locals.get(var_name, None)
-                if var_value != old_val:
-                    self.manipulations.append({
-                        "type": "variable",
-                        "name": var_name,
-                        "value": var_value,
-                        "line": lineno
-                    })
-
-            removed_vars = set(self.last_locals.keys()) - set(locals_dict.keys())
+            self.record_locals(frame, lineno)
+        elif event == "call":
+            if id(frame.f_code) not in self.user_codes:
+                return None  # no line events at all inside library (and watcher.py) frames
+            if self.calls is not None and id(frame.f_code) in self.calls.codes:
+                self.calls.enter(frame)
+        elif self.calls is not None and id(frame.f_code) in self.calls.codes:
+            self.on_call_event(frame, event, arg)
+
+        return self
+
+    def on_call_event(self, frame, event, arg):
+        """
+        An "exception" or "return" event of a recorded function. A frame an exception leaves
+        gets "exception" and then "return" (with arg None) without running another instruction.
+        """
+        if event == "exception":
+            self.raised = (frame, frame.f_lasti)
+        elif event == "return":
+            raised = self.raised
+            if raised is not None and raised[0] is frame and raised[1] == frame.f_lasti:
+                self.raised = None
+                self.calls.unwind()
+            else:
+                self.calls.leave(arg)
+
+    def record_locals(self, frame, lineno):
+        """
+        Emits a "variable" event for every watched local that changed since the last line, and
+        a None event for every one that is no longer in scope. The submitted array is skipped
+        since TrackedList already records it, so this never walks it.
+        """
+        code = frame.f_code
+        names = self.code_names.get(code)
+        if names is None:
+            names = self.code_names[code] = self._watched_in(code)
+
+        locals_dict = frame.f_locals
+        last_values = self.last_values
+        values = {}
+        for var_name in names:
+            var_value = locals_dict.get(var_name, _UNBOUND)
+            if var_value is _UNBOUND or type(var_value) is types.FunctionType:
+                continue
+            if isinstance(var_value, TrackedList) and var_value._array_id == MAIN_ARRAY:
+                continue
+            if type(var_value) not in SCALAR_TYPES:
+                # Compare snapshots, so in-place changes to a local list show up too
+                var_value = json_safe(var_value)
+            values[var_name] = var_value
+
+            old_val = last_values.get(var_name)
+            if var_value is not old_val and var_value != old_val:
+                self.manipulations.append(Variable(lineno, var_name, var_value))
+
+        if not last_values.keys() <= values.keys():
+            removed_vars = [var_name for var_name in last_values if var_name not in values]
             for var_name in removed_vars:
-                if (var_name in allowed_vars) and (var_name not in {"self", "new_target"}):
-                    self.manipulations.append({
-                        "type": "variable",
-                        "name": var_name,
-                        "value": None,
-                        "line": lineno
-                    })
+                self.manipulations.append(Variable(lineno, var_name, None))
+
+        self.last_values = values
+
+    def _watched_in(self, code):
+        local_names = code.co_varnames + code.co_cellvars + code.co_freevars
+        return tuple(name for name in local_names if name in self.watched)
+
+# Placeholder for a local that has not been assigned yet
+_UNBOUND = object()
+
+
+class MonitoringTracer(LocalVarTracer):
+    """
+    The same variable tracking as LocalVarTracer, driven by sys.monitoring (PEP 669, Python 3.12+).
 
-            self.last_locals = dict(locals_dict)
+    LINE events are enabled only on the function code objects compiled from the user's source,
+    so the module body, watcher.py and library frames never call back into Python at all.
+    JUMP events mirror settrace's extra "line" event on a backward jump within one line (a
+    comprehension's loop); every other jump location disables itself the first time it fires.
+    With a budget, a differ, counters or a profile the module body is subscribed as well, only
+    for those. With a CallRecorder, PY_START and PY_RETURN are enabled on the functions it
+    records, and PY_UNWIND (which can only be enabled globally) closes the calls that raise.
+    """
+    TOOL_ID = 2  # sys.monitoring.DEBUGGER_ID, spelled out so this module imports on < 3.12
+
+    def __init__(self, manipulations, watched, code, budget=None, differ=None, counters=None,
+                 profile=None, calls=None):
+        code_objects = list(iter_code_objects(code))
+        super().__init__(manipulations, watched, frozenset(map(id, code_objects)), budget, differ,
+                         counters, profile, calls)
+        self.module_code = code
+        module_hooks = (budget is not None or differ is not None or counters is not None
+                        or profile is not None)
+        self.code_objects = [c for c in code_objects if c is not code or module_hooks]
+        self.offset_lines = {c: offset_line_table(c) for c in self.code_objects}
+
+    def __enter__(self):
+        monitoring = sys.monitoring
+        _MONITORING_LOCK.acquire()
+        try:
+            monitoring.use_tool_id(self.TOOL_ID, "imaginarray")
+            monitoring.register_callback(self.TOOL_ID, monitoring.events.LINE, self.on_line)
+            monitoring.register_callback(self.TOOL_ID, monitoring.events.JUMP, self.on_jump)
+            monitoring.restart_events()
+            events = monitoring.events.LINE | monitoring.events.JUMP
+            call_events = events
+            if self.calls is not None:
+                monitoring.register_callback(self.TOOL_ID, monitoring.events.PY_START,
+                                             self.on_start)
+                monitoring.register_callback(self.TOOL_ID, monitoring.events.PY_RETURN,
+                                             self.on_return)
+                monitoring.register_callback(self.TOOL_ID, monitoring.events.PY_UNWIND,
+                                             self.on_unwind)
+                monitoring.set_events(self.TOOL_ID, monitoring.events.PY_UNWIND)
+                call_events |= monitoring.events.PY_START | monitoring.events.PY_RETURN
+            for code in self.code_objects:
+                if self.calls is not None and id(code) in self.calls.codes:
+                    monitoring.set_local_events(self.TOOL_ID, code, call_events)
+                else:
+                    monitoring.set_local_events(self.TOOL_ID, code, events)
+        except BaseException:
+            _MONITORING_LOCK.release()
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        monitoring = sys.monitoring
+        try:
+            for code in self.code_objects:
+                monitoring.set_local_events(self.TOOL_ID, code, monitoring.events.NO_EVENTS)
+            monitoring.set_events(self.TOOL_ID, monitoring.events.NO_EVENTS)
+            for event in (monitoring.events.LINE, monitoring.events.JUMP,
+                          monitoring.events.PY_START, monitoring.events.PY_RETURN,
+                          monitoring.events.PY_UNWIND):
+                monitoring.register_callback(self.TOOL_ID, event, None)
+            monitoring.free_tool_id(self.TOOL_ID)
+        finally:
+            _MONITORING_LOCK.release()
+        return False
+
+    def on_line(self, code, lineno):
+        if self.counters is not None:
+            self.counters.lines += 1
+        if self.profile is not None:
+            self.profile.hit(lineno)
+        if self.budget is not None:
+            self.budget.tick()
+        if self.differ is not None:
+            self.differ.sync(lineno)
+        if code is self.module_code or not self.watched:
+            return
+        self.record_locals(sys._getframe(1), lineno)
+
+    def on_jump(self, code, src, dest):
+        if dest > src:
+            return sys.monitoring.DISABLE
+        lines = self.offset_lines[code]
+        to_line = lines[dest // 2]
+        if to_line is None or to_line != lines[src // 2]:
+            # A jump to another line already raises LINE at its target
+            return sys.monitoring.DISABLE
+        if self.counters is not None:
+            self.counters.lines += 1
+        if self.profile is not None:
+            self.profile.hit(to_line)
+        if self.budget is not None:
+            self.budget.tick()
+        if self.differ is not None:
+            self.differ.sync(to_line)
+        if code is self.module_code or not self.watched:
+            return
+        self.record_locals(sys._getframe(1), to_line)
+
+    def on_start(self, code, offset):
+        self.calls.enter(sys._getframe(1))
+
+    def on_return(self, code, offset, value):
+        self.calls.leave(value)
+
+    def on_unwind(self, code, offset, exception):
+        if id(code) in self.calls.codes:
+            self.calls.unwind()
+
+# sys.monitoring tool ids and callbacks are process-wide, so only one run can hold them
+_MONITORING_LOCK = threading.Lock()
+
+def offset_line_table(code):
+    """Line number of every instruction in code, indexed by bytecode offset // 2."""
+    table = [None] * (len(code.co_code) // 2)
+    for start, end, line in code.co_lines():
+        table[start // 2:end // 2] = [line] * ((end - start) // 2)
+    return table
+
+def iter_code_objects(code):
+    """Yields code and every function, lambda and comprehension code object nested in it."""
+    yield code
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            yield from iter_code_objects(const)
+
+
+class ArrayTracker:
+    """
+    What every TrackedList of a run shares: where events go, the trace options, and the
+    array ids handed out. A list the program creates costs only its wrapping until its first
+    recorded mutation, which is when it gets an id and a "new_array" event (see declare).
+
+    With counters (see counters.OpCounters) lists are CountingLists, which count their index
+    reads, or with record_reads RecordingLists, which also record each one as an event (and
+    compare records each counted comparison).
+    """
+    def __init__(self, manipulations, keyframe_interval=None, budget=None, differ=None,
+                 sort_swaps=False, counters=None, record_reads=False):
+        self.manipulations = manipulations
+        self.keyframe_interval = keyframe_interval
+        self.budget = budget
+        self.differ = differ
+        self.sort_swaps = sort_swaps
+        self.counters = counters
+        self.record_reads = record_reads
+        self.next_id = MAIN_ARRAY + 1
+        # The submitted array's contents when the trace starts (see adopt_main), and who to
+        # tell once they are known
+        self.initial = None
+        self.on_initial = None
+        if record_reads:
+            self.list_class, self.table_class = RecordingList, RecordingTable
+        elif counters is not None:
+            self.list_class, self.table_class = CountingList, CountingTable
+        else:
+            self.list_class, self.table_class = TrackedList, TrackedTable
 
-        return self 
-        
+    def wrap(self, value):
+        """
+        value as a TrackedList if it is a plain list, else unchanged. Bound to LIST_NAME in the
+        instrumented code (see instrument.ListTransformer). Lists of tracked lists become
+        TrackedTables.
+        """
+        if type(value) is not list:
+            return value
+        if value and isinstance(value[0], TrackedList):
+            return self.table_class(value, self)
+        return self.list_class(value, self)
+
+    def compare(self, reads_before, left, right, symbol):
+        """
+        Bound to COMPARE_NAME (see instrument.CompareTransformer): left <symbol> right, counted
+        as a comparison if evaluating the operands read a tracked array since reads_before.
+        """
+        result = COMPARE_OPERATORS[symbol](left, right)
+        counters = self.counters
+        if counters.reads != reads_before:
+            counters.comparisons += 1
+            if self.record_reads:
+                if self.budget is not None:
+                    self.budget.check_events()
+                self.manipulations.append(Compare(sys._getframe(1).f_lineno, symbol,
+                                                  json_safe(result)))
+        return result
+
+    def adopt_main(self, array):
+        """
+        Makes array the submitted array, id MAIN_ARRAY, whose contents the trace starts from.
+        The contents of the first one adopted become initial.
+        """
+        if self.initial is None:
+            self.initial = json_safe(list(array))
+            if self.on_initial is not None:
+                self.on_initial(self.initial)
+        array._array_id = MAIN_ARRAY
+        array._since_keyframe = self.keyframe_interval
+        self._watch(array)
+
+    def declare(self, array, line):
+        """Gives array the next id and records its "new_array" event, declaring its table first."""
+        event = NewArray(line)
+        if array._parent is not None:
+            table, index = array._parent
+            if table._array_id is None:
+                self.declare(table, line)
+            event.parent = table._array_id
+            event.index = index
+        array._array_id = self.next_id
+        self.next_id += 1
+        array._since_keyframe = self.keyframe_interval
+        array._append_event(event, array)
+        self._watch(array)
+
+    def _watch(self, array):
+        if self.differ is not None:
+            array._shadow = list(array)
+            self.differ.track(array)
 
 class TrackedList(list):
-    def __init__(self, *args, manipulations=None):
-        super().__init__(*args)
-        self._manipulations = manipulations if manipulations is not None else []
+    """
+    A list that records every mutation into its tracker's manipulations list, tagged with
+    its "array" id.
+
+    With keyframe_interval=None every event carries a full "state" copy. Otherwise events
+    only carry their delta and a "state" keyframe is attached every keyframe_interval events
+    of the array (and on its first event, so rebinding the array stays replayable).
+
+    Slice assignment, del, clear, += and *= are recorded as the edit script between the list
+    before and after (see arraydiff.py). sort and reverse record the permutation they apply,
+    or with sort_swaps the fewest swaps that do the same. With a differ (see ArrayDiffer) a
+    list with an id also keeps a shadow copy of what the trace says it holds, so mutations
+    made behind its back (heapq, list.__setitem__, ...) are caught the same way at the next
+    line.
+    """
+    __slots__ = ("_tracker", "_array_id", "_parent", "_since_keyframe", "_last_setitem_call",
+                 "_shadow", "__weakref__")
+
+    def __init__(self, values=(), tracker=None):
+        super().__init__(values)
+        self._tracker = tracker if tracker is not None else ArrayTracker([])
+        self._array_id = None
+        self._parent = None
         self._last_setitem_call = None
+        self._shadow = None
 
-    def _record_manipulation(self, manipulation_type, **kwargs):
-        # Get the caller's frame (2 levels up)
-        frame = sys._getframe(2)
-        line_no = frame.f_lineno
-        kwargs.update({
-            "type": manipulation_type,
-            "line": line_no,
-            "state": list(self)
-        })
-        self._manipulations.append(kwargs)
+    def _record_manipulation(self, event):
+        self._append_event(event, self)
+        if self._shadow is not None:
+            self._shadow[:] = self
+
+    def _append_event(self, event, values):
+        """Records event, with values (the array as of that event) as its keyframe if one is due."""
+        tracker = self._tracker
+        if tracker.budget is not None:
+            tracker.budget.check_events()
+        event.array = self._array_id
+        if self._needs_keyframe(event.type):
+            event.state = self._snapshot(values)
+        tracker.manipulations.append(event)
+
+    def _record_edits(self, before, line):
+        """Records the edit script from before to the list's contents, editing before along the way."""
+        # A plain copy to diff against, so a CountingList doesn't count the diff's reads
+        for edit in edit_script(before, list(self)):
+            kind, index = edit[0], edit[1]
+            if kind == "replace":
+                before[index] = edit[2]
+                event = Replace(line, index, json_safe(edit[2]))
+            elif kind == "swap":
+                other = edit[2]
+                before[index], before[other] = before[other], before[index]
+                event = Swap(line, index, other)
+            elif kind == "insert":
+                before.insert(index, edit[2])
+                event = Insert(line, index, json_safe(edit[2]))
+            else:
+                event = Pop(line, index, json_safe(before.pop(index)))
+            self._append_event(event, before)
+        self._last_setitem_call = None
+        if self._shadow is not None:
+            self._shadow[:] = self
+
+    def _record_permutation(self, event, permutation):
+        """Applies permutation and records event, or the equivalent swaps with sort_swaps."""
+        before = list(self)
+        list.__setitem__(self, slice(None), [before[i] for i in permutation])
+        if not self._tracker.sort_swaps:
+            self._record_manipulation(event)
+            return
+        for i, j in permutation_swaps(permutation):
+            before[i], before[j] = before[j], before[i]
+            self._append_event(Swap(event.line, i, j), before)
+        self._last_setitem_call = None
+        if self._shadow is not None:
+            self._shadow[:] = self
+
+    def _catch_up(self, line):
+        """Called before every mutation: declares a new array, and records unseen changes."""
+        if self._array_id is None:
+            self._tracker.declare(self, line)
+        # An override's own event must come after any unrecorded change that preceded it.
+        # Comparing with the shadow (length first, then each element by identity before ==)
+        # runs at C speed and skips the diff whenever the list was left alone.
+        shadow = self._shadow
+        if shadow is not None and shadow != self:
+            self._record_edits(shadow, self._tracker.differ.line)
+
+    def _before_bulk(self, line):
+        self._catch_up(line)
+        return list(self)
+
+    def _snapshot(self, values=None):
+        if values is None:
+            values = self
+        if SCALAR_TYPES.issuperset(map(type, values)):
+            return list(values)
+        return json_safe(list(values))
+
+    def _needs_keyframe(self, manipulation_type):
+        keyframe_interval = self._tracker.keyframe_interval
+        if keyframe_interval is None:
+            return True
+        if (manipulation_type not in REPLAYABLE_EVENTS
+                or self._since_keyframe >= keyframe_interval):
+            self._since_keyframe = 1
+            return True
+        self._since_keyframe += 1
+        return False
 
     def append(self, value):
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
         super().append(value)
-        self._record_manipulation("append", value=value)
+        self._record_manipulation(Append(line, json_safe(value)))
 
     def pop(self, index=None):
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
         if index is None:
             index = len(self) - 1
         popped = super().pop(index)
-        self._record_manipulation("pop", index=index, popped=popped)
+        self._record_manipulation(Pop(line, index, json_safe(popped)))
         return popped
 
     def __setitem__(self, index, value):
-        old_value = self[index] if 0 <= index < len(self) else None
+        line_no = sys._getframe(1).f_lineno
+        if isinstance(index, slice):
+            before = self._before_bulk(line_no)
+            super().__setitem__(index, value)
+            self._record_edits(before, line_no)
+            return
 
-        frame = sys._getframe(1)
-        line_no = frame.f_lineno
+        self._catch_up(line_no)
+        old_value = list.__getitem__(self, index) if 0 <= index < len(self) else None
 
         if self._last_setitem_call:
             last_line, last_index, last_old_value, last_new_value = self._last_setitem_call
@@ -137,38 +534,261 @@ class TrackedList(list):
                     and value == last_old_value):
                     super().__setitem__(index, value)
 
-                    if self._manipulations and self._manipulations[-1]["type"] == "replace":
-                        self._manipulations.pop()
+                    manipulations = self._tracker.manipulations
+                    if (manipulations and type(manipulations[-1]) is Replace
+                            and manipulations[-1].array == self._array_id):
+                        dropped = manipulations.pop()
+                        if hasattr(dropped, "state"):
+                            self._since_keyframe = self._tracker.keyframe_interval
 
-                    self._record_manipulation("swap", line=line_no, indices=[last_index, index])
+                    self._record_manipulation(Swap(line_no, last_index, index))
                     self._last_setitem_call = None
                     return
 
         super().__setitem__(index, value)
-        self._record_manipulation("replace", line=line_no, index=index, value=value)
+        self._record_manipulation(Replace(line_no, index, json_safe(value)))
         self._last_setitem_call = (line_no, index, old_value, value)
 
+    def __delitem__(self, index):
+        line = sys._getframe(1).f_lineno
+        before = self._before_bulk(line)
+        super().__delitem__(index)
+        self._record_edits(before, line)
+
+    def clear(self):
+        line = sys._getframe(1).f_lineno
+        before = self._before_bulk(line)
+        super().clear()
+        self._record_edits(before, line)
+
+    def __iadd__(self, other):
+        line = sys._getframe(1).f_lineno
+        before = self._before_bulk(line)
+        super().__iadd__(other)
+        self._record_edits(before, line)
+        return self
+
+    def __imul__(self, count):
+        line = sys._getframe(1).f_lineno
+        before = self._before_bulk(line)
+        super().__imul__(count)
+        self._record_edits(before, line)
+        return self
+
     def insert(self, index, value):
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
         super().insert(index, value)
-        self._record_manipulation("insert", index=index, value=value)
+        self._record_manipulation(Insert(line, index, json_safe(value)))
 
     def remove(self, value):
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
         super().remove(value)
-        self._record_manipulation("remove", value=value)
+        self._record_manipulation(Remove(line, json_safe(value)))
 
     def extend(self, iterable):
-        super().extend(iterable)
-        self._record_manipulation("extend", value=list(iterable))
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
+        values = list(iterable)
+        super().extend(values)
+        self._record_manipulation(Extend(line, json_safe(values)))
 
     def reverse(self):
-        super().reverse()
-        self._record_manipulation("reverse")
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
+        permutation = list(range(len(self) - 1, -1, -1))
+        self._record_permutation(Reverse(line, permutation), permutation)
 
     def sort(self, *args, **kwargs):
-        super().sort(*args, **kwargs)
-        flattened_args = [repr(a) for a in args]
-        flattened_kwargs = {k: repr(v) for k, v in kwargs.items()}
-        self._record_manipulation("sort", args=flattened_args, kwargs=flattened_kwargs)
+        line = sys._getframe(1).f_lineno
+        self._catch_up(line)
+        permutation = sort_permutation(self, *args, **kwargs)
+        flattened_args = [stable_repr(a) for a in args]
+        flattened_kwargs = {k: stable_repr(v) for k, v in kwargs.items()}
+        self._record_permutation(Sort(line, flattened_args, flattened_kwargs, permutation), permutation)
+
+    # New lists derived from a tracked one are tracked (lazily) too
+    def __add__(self, other):
+        return self._tracker.wrap(list.__add__(self, other))
+
+    def __mul__(self, count):
+        return self._tracker.wrap(list.__mul__(self, count))
+
+    __rmul__ = __mul__
+
+    def copy(self):
+        return self._tracker.wrap(list(self))
+
+class TrackedTable(TrackedList):
+    """
+    A TrackedList of tracked rows (a 2D table, or deeper). Rows are tracked lazily: reading a
+    row that has no id yet only notes where it was read, so that if it is ever mutated its
+    "new_array" event names this table and the row's index as its parent.
+    """
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        if type(index) is int and isinstance(value, TrackedList) and value._array_id is None:
+            value._parent = (self, index if index >= 0 else index + len(self))
+        return value
+
+class CountingList(TrackedList):
+    """A TrackedList that counts its index reads into its tracker's counters."""
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        self._tracker.counters.reads += 1
+        return list.__getitem__(self, index)
+
+class CountingTable(TrackedTable):
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        self._tracker.counters.reads += 1
+        return TrackedTable.__getitem__(self, index)
+
+class RecordingList(TrackedList):
+    """A TrackedList that counts its index reads and records the int-index ones as "read" events."""
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        value = list.__getitem__(self, index)
+        self._record_read(index)
+        return value
+
+    def _record_read(self, index):
+        self._tracker.counters.reads += 1
+        if type(index) is int:
+            line = sys._getframe(2).f_lineno
+            self._catch_up(line)
+            self._record_manipulation(Read(line, index if index >= 0 else index + len(self)))
+
+class RecordingTable(RecordingList, TrackedTable):
+    __slots__ = ()
+
+    def __getitem__(self, index):
+        value = TrackedTable.__getitem__(self, index)
+        self._record_read(index)
+        return value
+
+class CallRecorder:
+    """
+    Records a "call" event with its depth and arguments when a function the user's code
+    defines starts, and a "return" event with its value when it returns, both on the caller's
+    line; a call that raises gets no "return". The settrace and monitoring tracers drive it
+    from their own call and return hooks, and the "ast" engine from calls compiled into each
+    function (see instrument.CallTransformer), so it adds no frames and recursion keeps its
+    full depth. Calls deeper than max_depth record nothing. Arrays with an id are shown as
+    "<array id>" instead of being copied.
+
+    codes holds the id() of the code objects whose calls are recorded: those of plain
+    functions, not of lambdas, comprehensions, class bodies or generators.
+    """
+    def __init__(self, manipulations, code, budget=None, max_depth=None):
+        self.manipulations = manipulations
+        self.codes = frozenset(id(c) for c in iter_code_objects(code) if is_function_code(c))
+        self.budget = budget
+        self.max_depth = max_depth if max_depth is not None else sys.maxsize
+        # (caller line, name) of every call still running, innermost last
+        self.open = []
+        self.params = {}
+
+    def enter(self, frame=None):
+        """Records the call of frame's function (by default the caller's, for compiled-in calls)."""
+        if frame is None:
+            frame = sys._getframe(1)
+        code = frame.f_code
+        caller = frame.f_back
+        line = caller.f_lineno if caller is not None else frame.f_lineno
+        self.open.append((line, code.co_name))
+        depth = len(self.open)
+        if depth > self.max_depth:
+            return
+        params = self.params.get(code)
+        if params is None:
+            params = self.params[code] = _parameters(code)
+        names, varargs, varkw = params
+        locals_dict = frame.f_locals
+        arguments = {name: _call_value(locals_dict[name]) for name in names if name in locals_dict}
+        if varargs is not None:
+            arguments[varargs] = [_call_value(value) for value in locals_dict[varargs]]
+        if varkw is not None:
+            for name, value in locals_dict[varkw].items():
+                arguments[name] = _call_value(value)
+        self._record(Call(line, code.co_name, depth, arguments))
+
+    def leave(self, value):
+        """Records the return of the innermost open call with value, and returns value."""
+        depth = len(self.open)
+        line, name = self.open[-1]
+        if depth <= self.max_depth:
+            self._record(Return(line, name, depth, _call_value(value)))
+        # Popped only once recorded: if the budget runs out, the call unwinds instead
+        self.open.pop()
+        return value
+
+    def unwind(self):
+        """Closes the innermost open call, which raised, without recording anything."""
+        self.open.pop()
+
+    def _record(self, event):
+        if self.budget is not None:
+            self.budget.check_events()
+        self.manipulations.append(event)
+
+def is_function_code(code):
+    """Whether code is a def's: not a module or class body, lambda, comprehension or generator."""
+    return (code.co_flags & inspect.CO_NEWLOCALS and not code.co_name.startswith("<")
+            and not code.co_flags & (inspect.CO_GENERATOR | inspect.CO_COROUTINE
+                                     | inspect.CO_ASYNC_GENERATOR))
+
+def _parameters(code):
+    """(names, varargs, varkw) of code's parameters, the last two None when it has none."""
+    count = code.co_argcount + code.co_kwonlyargcount
+    names = code.co_varnames[:count]
+    varargs = varkw = None
+    if code.co_flags & inspect.CO_VARARGS:
+        varargs = code.co_varnames[count]
+        count += 1
+    if code.co_flags & inspect.CO_VARKEYWORDS:
+        varkw = code.co_varnames[count]
+    return names, varargs, varkw
+
+def _call_value(value):
+    if isinstance(value, TrackedList) and value._array_id is not None:
+        return f"<array {value._array_id}>"
+    return json_safe(value)
+
+def is_main_array(value):
+    return isinstance(value, TrackedList) and value._array_id == MAIN_ARRAY
+
+class ArrayDiffer:
+    """
+    Snapshot-diff fallback for array mutations that bypass TrackedList's methods. The tracers
+    call sync(lineno) at every line; each tracked list with an id that no longer matches its
+    shadow gets the edit script recorded, attributed to the line that ran before this one.
+    """
+    def __init__(self):
+        self.arrays = []
+        self.line = None
+
+    def track(self, array):
+        self.arrays.append(weakref.ref(array))
+
+    def sync(self, lineno=None):
+        stale = False
+        for ref in self.arrays:
+            array = ref()
+            if array is None:
+                stale = True
+            elif array._shadow != array:
+                array._record_edits(array._shadow, self.line)
+        if stale:
+            self.arrays = [ref for ref in self.arrays if ref() is not None]
+        if lineno is not None:
+            self.line = lineno
 
 class TrackedVariable:
     def __init__(self, name, value):
@@ -216,124 +836,491 @@ def normalize_indentation(code_lines):
     return new_lines
 
 def extract_initial_array(code_lines):
-    initial_arr = None
-    arr_name = None
-    for line in code_lines:
-        line = line.strip()
-        if not line or line.startswith("#"):
-            continue
-        if "=" in line and "[" in line and "]" in line:
-            try:
-                left, right = line.split("=", 1)
-                left = left.strip()
-                # We avoid subscript assignments (like arr[i])
-                if "[" not in left and "]" not in left:
-                    candidate = eval(right, SAFE_BUILTINS)
-                    if isinstance(candidate, list):
-                        initial_arr = candidate
-                        arr_name = left
-            except Exception:
-                continue
-    if initial_arr is None:
-        initial_arr = []
-    return initial_arr, arr_name
-
-def scrub_for_json(obj):
-    if isinstance(obj, dict):
-        return {k: scrub_for_json(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [scrub_for_json(x) for x in obj]
-    elif isinstance(obj, redirect_stdout.__class__):
-        return "<redirect_stdout>"
-    elif callable(obj):
-        return f"<function {obj.__name__}>" if hasattr(obj, "__name__") else str(obj)
-    else:
-        try:
-            json.dumps(obj)
-            return obj
-        except Exception:
-            return str(obj)
+    """
+    Returns (initial_arr, arr_name) for the submitted code (see analysis.initial_array), with
+    an empty array and no name for code that has none or doesn't parse.
+    """
+    try:
+        tree = ast.parse("\n".join(normalize_indentation(code_lines)), USER_FILENAME)
+    except SyntaxError:
+        return [], None
+    initial_arr, arr_name = initial_array(tree)
+    return (initial_arr if initial_arr is not None else []), arr_name
+
+class EventLog(list):
+    """
+    The manipulations list of a streamed run. Every chunk_size events, the ones not yet sent
+    are passed to sink(start, events), start being the index of the first one. The newest event is held back since TrackedList may still fold it into a swap.
+
+    A chunk can be sent twice if the run is interrupted inside sink; consumers drop repeats by
+    start (see stream_user_code). Time spent in sink doesn't count against the budget, nor
+    towards the line profile.
+
+    With on_start, chunks are held back until begin(initial_arr) has passed the submitted
+    array to on_start, which for an array built at runtime is only once the code binds it.
+    """
+    def __init__(self, sink, chunk_size=STREAM_CHUNK_SIZE, on_start=None):
+        super().__init__()
+        self.sink = sink
+        self.chunk_size = chunk_size
+        self.on_start = on_start
+        self.started = on_start is None
+        self.budget = None
+        self.profile = None
+        self.sent = 0
+
+    def begin(self, initial_arr):
+        if not self.started:
+            self.started = True
+            self.on_start(initial_arr)
+
+    def append(self, event):
+        super().append(event)
+        if len(self) - self.sent > self.chunk_size and self.started:
+            self.flush(len(self) - 1)
+
+    def flush(self, end=None):
+        if end is None:
+            end = len(self)
+        if end > self.sent:
+            started = time.perf_counter_ns()
+            if self.budget is not None:
+                with self.budget.suspended():
+                    self.sink(self.sent, self[self.sent:end])
+            else:
+                self.sink(self.sent, self[self.sent:end])
+            if self.profile is not None:
+                self.profile.skip(time.perf_counter_ns() - started)
+            self.sent = end
 
 class TrackingDict(dict):
     """
-    Intercepts assignments. If the key equals the target array name, the value is wrapped as a TrackedList.
-    Otherwise, we track variable updates using TrackedVariable objects.
+    The exec globals. A list bound to the target array name becomes the tracked submitted
+    array (id MAIN_ARRAY).
     """
-    def __init__(self, manipulations, arr_name, *args, **kwargs):
+    def __init__(self, tracker, arr_name, *args, **kwargs):
+        # dict's own constructor doesn't go through __setitem__
         super().__init__(*args, **kwargs)
-        self.manipulations = manipulations
+        self.tracker = tracker
         self.arr_name = arr_name
 
     def __setitem__(self, key, value):
-        if key in {"new_target", "self"}:
-            super().__setitem__(key, value)
-            return
-        
-        if key == self.arr_name and isinstance(value, list) and not isinstance(value, TrackedList):
-            value = TrackedList(value, manipulations=self.manipulations)
-            super().__setitem__(key, value)
-            return
-        
-        if key == self.arr_name:
-            super().__setitem__(key, value)
-            return
+        if key == self.arr_name and key not in {"new_target", "self"}:
+            if type(value) is list:
+                value = self.tracker.wrap(value)
+            if isinstance(value, TrackedList) and value._array_id is None:
+                self.tracker.adopt_main(value)
         super().__setitem__(key, value)
 
-def run_user_code(code_lines):
-    manipulations = []
-    
-    initial_arr, arr_name = extract_initial_array(code_lines)
-    exec_env = TrackingDict(manipulations, arr_name, **SAFE_BUILTINS)
+class CompiledProgram:
+    """
+    What compile_user_code makes of a source: the code object to exec, the local names the
+    tracers should report (see analysis.watched_names), the submitted array and its name (see
+    analysis.initial_array), whether it can mutate lists behind TrackedList's back (see
+    analysis.bypasses_tracking), and user_codes, the id() of code and of every code object
+    nested in it. initial_arr is None when the array is only built at runtime. Shared between
+    runs, so initial_arr must be copied before use (see fresh_initial_arr).
+    """
+    __slots__ = ("code", "watched", "initial_arr", "arr_name", "bypasses", "user_codes")
+
+    def __init__(self, code, watched, initial_arr, arr_name, bypasses):
+        self.code = code
+        self.watched = watched
+        self.initial_arr = initial_arr
+        self.arr_name = arr_name
+        self.bypasses = bypasses
+        self.user_codes = frozenset(map(id, iter_code_objects(code)))
+
+    def fresh_initial_arr(self):
+        if self.initial_arr is None:
+            return []
+        return [v if type(v) in SCALAR_TYPES else copy.deepcopy(v) for v in self.initial_arr]
 
-    if arr_name is not None:
-        arr = TrackedList(initial_arr, manipulations=manipulations)
-        exec_env[arr_name] = arr
+@functools.lru_cache(maxsize=128)
+def compile_user_code(source, engine, ticks=False, all_arrays=False, compares=False,
+                      variables=True, input_binding=False, calls=False):
+    """
+    Returns the CompiledProgram for source (the submitted lines joined with newlines, before
+    normalize_indentation) and engine, parsing it only once. Cached on the source string, so
+    resubmitting a program skips straight to exec. ticks compiles budget ticks into the "ast"
+    engine's code; all_arrays wraps every new list in LIST_NAME; compares routes comparisons
+    through COMPARE_NAME; variables=False watches no names at all; input_binding has the
+    submitted array's assignment build it from INPUT_NAME instead (see substitute_input);
+    calls has the "ast" engine's functions report their calls to CALLS_NAME (the other engines
+    record calls from their tracer).
+    """
+    full_code = "\n".join(normalize_indentation(source.split("\n")))
+    tree = ast.parse(full_code, USER_FILENAME)
+    initial_arr, arr_name = initial_array(tree)
+    watched = watched_names(tree, arr_name) if variables else frozenset()
+    bypasses = bypasses_tracking(tree)
+    if input_binding and arr_name is not None:
+        tree = substitute_input(tree, array_binding(tree)[0])
+    if all_arrays:
+        tree = track_lists(tree)
+    if compares:
+        tree = hook_compares(tree)
+    if calls and engine == "ast":
+        tree = hook_calls(tree)
+    if engine == "ast":
+        code = instrument(tree, watched, USER_FILENAME, ticks)
     else:
-        exec_env["arr"] = initial_arr
+        code = compile(tree, USER_FILENAME, "exec")
+    return CompiledProgram(code, watched, initial_arr, arr_name, bypasses)
+
+# Tracing engines run_user_code can drive: sys.settrace everywhere, sys.monitoring (3.12+),
+# or "ast", which compiles recording calls into the code instead of tracing lines
+ENGINES = ("settrace", "monitoring", "ast")
+
+def run_user_code(code_lines, keyframe_interval=None, engine="settrace", limits=None,
+                  sink=None, chunk_size=STREAM_CHUNK_SIZE, index_interval=None, diff_arrays=None,
+                  sort_swaps=False, all_arrays=True, count_ops=False, record_reads=False,
+                  record_events=True, input_arr=None, clock=False, profile=False, calls=False,
+                  max_call_depth=None, on_start=None):
+    """
+    Runs the user's code and returns (initial_arr, final_arr, manipulations, line_nums, meta).
+
+    keyframe_interval=None keeps the full-copy trace. Passing an int switches to the delta
+    trace, where only every keyframe_interval-th array event carries a "state" snapshot;
+    use replay.reconstruct_state to rebuild the array at any step.
 
-    normalized = normalize_indentation(code_lines)
-    full_code = "\n".join(normalized)
+    engine picks how variable changes are collected (see ENGINES). "settrace" and "monitoring"
+    produce the same manipulations; "ast" reports each variable on the line that assigned it
+    and does not report variables going out of scope. Array events are the same for all three.
 
-    tracer = LocalVarTracer(manipulations)
-    sys.settrace(tracer)
+    limits is an optional limits.TraceLimits. When a budget runs out the run stops where it is
+    and the trace so far is returned with meta["truncated"] set and the budget's name in
+    meta["truncation_reason"] ("lines", "events", "time" or "memory").
+
+    The returned initial_arr is the submitted array's contents when tracing starts: the
+    value its assignment folds to (see analysis.initial_array), or for one built at runtime
+    (`arr = [i * 2 for i in range(5)]`) the list the code binds, as it is then.
+
+    With a sink, events are passed to sink(start, events) in chunks while the code runs (see
+    EventLog) and the returned manipulations list is empty. on_start(initial_arr) is called
+    before the first chunk, once initial_arr is known.
+
+    index_interval adds meta["index"], a replay.build_index seek index with a keyframe every
+    index_interval steps.
+
+    all_arrays tracks every list the program builds (displays, comprehensions, slices, list()
+    and sorted()), not just the submitted one. Each array event carries the "array" id it
+    happened to: MAIN_ARRAY for the submitted array, or an id introduced by a "new_array"
+    event right before that list's first mutation. Lists that are never mutated get no id
+    and no events.
+
+    diff_arrays has the "settrace" and "monitoring" engines check the arrays with an id at
+    every line and record changes made without going through TrackedList (heapq and other C
+    code) as edit scripts (see ArrayDiffer). Each check compares whole arrays, so the default
+    (None) only turns it on for code that can make such changes at all (see
+    analysis.bypasses_tracking). The "ast" engine has no line hook, so it doesn't.
+
+    sort and reverse events carry the "permutation" they applied; sort_swaps records the
+    fewest "swap" events that apply it instead.
+
+    count_ops adds meta["counters"] (see counters.OpCounters): index reads of tracked arrays,
+    the elements written, swaps, comparisons whose operands read a tracked array, and lines
+    executed. Writes and swaps are tallied from the trace at the end; the rest cost one
+    increment each. record_reads (which implies count_ops) also records every read as a
+    "read" event and every counted comparison as a "compare" event, for visualizing them.
+
+    record_events=False (which implies count_ops) keeps no trace, only meta["counters"]: no
+    variables are watched, writes and swaps are tallied as events arrive (see WriteTally),
+    and manipulations and line_nums come back empty. Pass diff_arrays=False too, so arrays
+    are never re-compared at every line.
+
+    input_arr runs the code on that list instead of the one its submitted array's assignment
+    builds (see analysis.array_binding); it is the returned initial_arr. ValueError if the
+    code has no such assignment.
+
+    clock (which implies count_ops) adds meta["clock"], the operation count at each event (see
+    counters.ClockedLog), for playing several traces against one time axis. Not with a sink.
+
+    profile adds meta["profile"], hit counts and nanoseconds per line (see
+    lineprofile.LineProfile), or None under the "ast" engine, which has no line hook.
+
+    calls records a "call" and a "return" event around every call of a function the code
+    defines (see CallRecorder), the same under every engine, down to max_call_depth. No
+    frames are added, so recursion can go as deep as without it.
+    """
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine {engine!r}, expected one of {', '.join(ENGINES)}")
+    if engine == "monitoring" and not hasattr(sys, "monitoring"):
+        raise ValueError("The monitoring engine requires Python 3.12 or newer")
+
+    count_ops = count_ops or record_reads or clock or not record_events
+    counters = OpCounters(count_lines=engine != "ast") if count_ops else None
+    if not record_events:
+        manipulations = WriteTally(counters)
+        # No keyframes but each array's first, which nothing reads either
+        keyframe_interval = sys.maxsize
+    elif sink is not None:
+        manipulations = EventLog(sink, chunk_size, on_start)
+    elif clock:
+        manipulations = ClockedLog(counters)
+    else:
+        manipulations = []
+    budget = TraceBudget(limits, manipulations) if limits is not None else None
+    if sink is not None and record_events:
+        manipulations.budget = budget
+    meta = {"truncated": False, "truncation_reason": None}
+    
+    line_profile = LineProfile(len(code_lines)) if profile and engine != "ast" else None
+    if line_profile is not None and sink is not None and record_events:
+        manipulations.profile = line_profile
+
+    source = "\n".join(code_lines)
 
     try:
-        output_buffer = io.StringIO()
-        with redirect_stdout(output_buffer):
-            exec(full_code, exec_env)
+        program = compile_user_code(source, engine, budget is not None, all_arrays, count_ops,
+                                    record_events, input_arr is not None, calls)
+        code, watched, arr_name = program.code, program.watched, program.arr_name
+        if diff_arrays is None:
+            diff_arrays = program.bypasses
+        differ = ArrayDiffer() if diff_arrays and engine != "ast" else None
+        tracker = ArrayTracker(manipulations, keyframe_interval, budget, differ, sort_swaps,
+                               counters, record_reads)
+        if input_arr is None:
+            initial_arr = program.fresh_initial_arr()
+        elif arr_name is None:
+            raise ValueError("The code has no array assignment to substitute the input for")
+        else:
+            initial_arr = list(input_arr)
+        exec_env = TrackingDict(tracker, arr_name, SAFE_BUILTINS)
+        if input_arr is not None:
+            dict.__setitem__(exec_env, INPUT_NAME, initial_arr)
+        if all_arrays:
+            dict.__setitem__(exec_env, LIST_NAME, tracker.wrap)
+        if count_ops:
+            dict.update(exec_env, {COMPARE_NAME: tracker.compare, COUNTERS_NAME: counters})
+        call_recorder = None
+        if calls:
+            call_recorder = CallRecorder(manipulations, code, budget, max_call_depth)
+            dict.__setitem__(exec_env, CALLS_NAME, call_recorder)
+        if arr_name is not None:
+            exec_env[arr_name] = tracker.list_class(initial_arr, tracker)
+        else:
+            exec_env["arr"] = initial_arr
+        if program.initial_arr is not None or input_arr is not None or arr_name is None:
+            tracker.initial = initial_arr
+        else:
+            # Not the array yet: that is the list the code binds (see ArrayTracker.adopt_main)
+            tracker.initial = None
+        if sink is not None and record_events:
+            tracker.on_initial = manipulations.begin
+            if tracker.initial is not None:
+                manipulations.begin(tracker.initial)
+
+        with budget.watchdog() if budget else nullcontext():
+            if engine == "ast":
+                exec_env[RECORDER_NAME] = VariableRecorder(manipulations, skip=is_main_array)
+                if budget is not None:
+                    exec_env[TICK_NAME] = budget.tick
+                exec(code, exec_env)
+            elif engine == "monitoring":
+                with MonitoringTracer(manipulations, watched, code, budget, differ, counters,
+                                      line_profile, call_recorder):
+                    exec(code, exec_env)
+            else:
+                sys.settrace(LocalVarTracer(manipulations, watched, program.user_codes, budget,
+                                            differ, counters, line_profile, call_recorder))
+                exec(code, exec_env)
+            if differ is not None:
+                # Changes made by the last line have no following line event
+                differ.sync()
+    except TraceBudgetExceeded as e:
+        meta["truncated"] = True
+        meta["truncation_reason"] = e.reason
     except Exception as e:
-        print(f"Error executing code:\n{full_code}\n{e}")
+        print(f"Error executing code:\n{source}\n{e}")
         raise
     finally:
         sys.settrace(None)
+        if line_profile is not None:
+            line_profile.stop()
 
-    line_nums = [m["line"] for m in manipulations if "line" in m]
-    final_arr = list(exec_env[arr_name]) if arr_name in exec_env else initial_arr
-    
-    manipulations = scrub_for_json(manipulations)
+    line_nums = [m.line for m in manipulations]
+    if counters is not None:
+        meta["counters"] = counters.to_dict(manipulations)
+    if isinstance(manipulations, ClockedLog):
+        meta["clock"] = manipulations.ticks
+    if profile:
+        meta["profile"] = line_profile.to_dict() if line_profile is not None else None
+    if tracker.initial is not None:
+        initial_arr = tracker.initial
+    final_arr = exec_env.get(arr_name, initial_arr)
+    # The binding array_binding picked can still turn out to hold something else
+    final_arr = json_safe(list(final_arr)) if isinstance(final_arr, list) else initial_arr
+    if index_interval is not None:
+        meta["index"] = build_index(initial_arr, manipulations, index_interval)
+
+    if not record_events:
+        manipulations = line_nums = []
+    elif sink is not None:
+        manipulations.begin(initial_arr)
+        manipulations.flush()
+        manipulations = []
+
+    return initial_arr, final_arr, manipulations, line_nums, meta
+
+def stream_user_code(code_lines, chunk_size=STREAM_CHUNK_SIZE, **kwargs):
+    """
+    Generator over a run of run_user_code(code_lines, **kwargs) as it happens. Yields
+    ("start", initial_arr), then ("events", start, events) for consecutive chunks, and finally
+    ("done", result) with run_user_code's result (its manipulations empty). Errors from the
+    run are raised from the generator.
+    """
+    messages = queue.SimpleQueue()
+
+    def sink(start, events):
+        messages.put(("events", start, events))
+
+    def on_start(initial_arr):
+        messages.put(("start", initial_arr))
+
+    def run():
+        try:
+            messages.put(("done", run_user_code(code_lines, sink=sink, chunk_size=chunk_size,
+                                                on_start=on_start, **kwargs)))
+        except Exception as e:
+            messages.put(("error", e))
+
+    # User code runs on its own thread so chunks can be yielded while it is still going
+    thread = threading.Thread(target=run, daemon=True)
+    thread.start()
+    received = 0
+    while True:
+        message = messages.get()
+        if message[0] == "error":
+            thread.join()
+            raise message[1]
+        if message[0] == "done":
+            thread.join()
+            yield message
+            return
+        if message[0] == "start":
+            yield message
+            continue
+        _, start, events = message
+        events = events[received - start:] if received > start else events
+        if events:
+            yield ("events", received, events)
+            received += len(events)
+
+
+# Events a paused session computes ahead of what was asked for
+SESSION_CHUNK_SIZE = 64
+
+class SessionClosed(TraceBudgetExceeded):
+    """Raised into a session's suspended run when the session is closed."""
+    def __init__(self):
+        super().__init__("closed")
+
+class TraceSession:
+    """
+    A run of run_user_code(code_lines, **kwargs) that only advances as events are asked for.
+    The code runs on its own thread, which blocks (with its time budget paused) once it is
+    chunk_size events ahead of the consumer, so compute and memory follow what is viewed.
+    """
+    def __init__(self, code_lines, chunk_size=SESSION_CHUNK_SIZE, **kwargs):
+        self.initial_arr = None
+        self.taken = 0
+        self._cond = threading.Condition()
+        self._buffer = []
+        self._wanted = 0
+        self._closed = False
+        self._finished = False
+        self._result = None
+        self._error = None
+        self._thread = threading.Thread(target=self._run, args=(code_lines, chunk_size, kwargs),
+                                        daemon=True)
+        self._thread.start()
+        # Waits for the run to bind the submitted array, which it may only build at runtime
+        with self._cond:
+            while self.initial_arr is None and not self._finished:
+                self._cond.wait()
+        if self.initial_arr is None:
+            self.initial_arr = []
+
+    def next(self, count):
+        """
+        Returns (start, events, result): the next count events (fewer only at the end of the
+        run), the index of the first, and run_user_code's result once every event is taken.
+        """
+        with self._cond:
+            if len(self._buffer) < count and not self._finished:
+                self._wanted = count
+                self._cond.notify_all()
+                while len(self._buffer) < count and not self._finished:
+                    self._cond.wait()
+                self._wanted = 0
+            events = self._buffer[:count]
+            del self._buffer[:count]
+            start = self.taken
+            self.taken += len(events)
+            if self._buffer or not self._finished:
+                return start, events, None
+            if self._error is not None:
+                raise self._error
+            return start, events, self._result
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _start(self, initial_arr):
+        with self._cond:
+            self.initial_arr = initial_arr
+            self._cond.notify_all()
+
+    def _sink(self, start, events):
+        with self._cond:
+            self._buffer.extend(events)
+            self._cond.notify_all()
+            while not self._closed and len(self._buffer) >= self._wanted:
+                self._cond.wait()
+            if self._closed:
+                raise SessionClosed()
+
+    def _run(self, code_lines, chunk_size, kwargs):
+        result = error = None
+        try:
+            result = run_user_code(code_lines, sink=self._sink, chunk_size=chunk_size,
+                                   on_start=self._start, **kwargs)
+        except SessionClosed:
+            pass
+        except Exception as e:
+            error = e
+        with self._cond:
+            self._finished = True
+            self._result = result
+            self._error = error
+            self._cond.notify_all()
 
-    return initial_arr, final_arr, manipulations, line_nums
 
+# Bubble sort with nested loops; also the workload for bench_engines.py.
+BUBBLE_SORT_SAMPLE = [
+    "def bubble_sort(arr):",
+    "    n = len(arr)",
+    "    for i in range(n):",
+    "        swapped = False",
+    "        for j in range(0, n-i-1):",
+    "            if arr[j] > arr[j+1]:",
+    "                arr[j], arr[j+1] = arr[j+1], arr[j]",
+    "                swapped = True",
+    "        if not swapped:",
+    "            break",
+    "",
+    "arr = [64, 34, 25, 12, 22, 11, 90]",
+    "bubble_sort(arr)",
+    "print(arr)"
+]
 
 if __name__ == "__main__":
     # Test code using bubble sort with nested loops.
-    user_code = [
-        "def bubble_sort(arr):",
-        "    n = len(arr)",
-        "    for i in range(n):",
-        "        swapped = False",
-        "        for j in range(0, n-i-1):",
-        "            if arr[j] > arr[j+1]:",
-        "                arr[j], arr[j+1] = arr[j+1], arr[j]",
-        "                swapped = True",
-        "        if not swapped:",
-        "            break",
-        "",
-        "arr = [64, 34, 25, 12, 22, 11, 90]",
-        "bubble_sort(arr)",
-        "print(arr)"
-    ]
-    init_arr, final, manips, line_nums = run_user_code(user_code)
+    user_code = BUBBLE_SORT_SAMPLE
+    init_arr, final, manips, line_nums, meta = run_user_code(user_code)
     print("Initial Array from code:", init_arr)
     print("Final Array:", final)
     print("Tracked Variables:", getattr(final, "tracked_vars", {}))
@@ -2,7 +2,7 @@ import { FC, useState } from "react";
 import ArrayVisualizer from "./components/ArrayVisualizer";
 import { Manipulation } from "./utils/manipulateTypes";
 import CodeWindow from './components/CodeWindow';
-import axios from 'axios';
+import { LineProfile, streamTrace, StreamRecord } from './utils/traceStream';
 import './styles/App.css';
 import Dropdown from './components/Dropdown';
 
@@ -11,34 +11,45 @@ const App: FC = () => {
   const [manipulations, setManipulations] = useState<Manipulation<unknown>[]>([]);
   const [lineNums, setLineNums] = useState<number[]>([]);
   const [initialized, setInitialized] = useState(false);
+  const [complete, setComplete] = useState(false);
   const [highlightedLine, setHighlightedLine] = useState<number | null>(null);
   const [code, setCode] = useState<string>('');
   const [isProcessing, setIsProcessing] = useState<boolean>(false);
+  const [profile, setProfile] = useState<LineProfile | null>(null);
 
   const parseCode = async (code: string) => {
     setInitialized(false);
     setInitialArray(initialArray);
     try {
       const lines = code.split("\n");
-      const response = await axios.post('/api/submit_code', {
-        code: lines,
+      await streamTrace({ code: lines, profile: true, calls: true }, (record: StreamRecord) => {
+        if (record.type === 'start') {
+          setInitialArray((record.initial_arr as number[]) || []);
+          setManipulations([]);
+          setLineNums([]);
+          setComplete(false);
+          setInitialized(true);
+          setHighlightedLine(null);
+          setProfile(null);
+        } else if (record.type === 'events') {
+          setManipulations((prev) => prev.concat(record.manipulations as Manipulation<unknown>[]));
+          setLineNums((prev) => prev.concat(record.line_nums));
+        } else if (record.type === 'done') {
+          setComplete(true);
+          setProfile(record.profile ?? null);
+          if (record.truncated) {
+            alert(`Execution stopped early (${record.truncation_reason} limit reached). Showing the steps recorded so far.`);
+          }
+        } else {
+          setInitialized(false);
+          alert(`Execution Error: ${record.error}`);
+        }
       });
-
-      setInitialArray(response.data.initial_arr || []);
-      setManipulations(response.data.manipulations || []);
-      setLineNums(response.data.line_nums || []);
-      console.log("RESPONSE:", response.data);
-      setInitialized(true);
-      setHighlightedLine(null);
     } catch (error: unknown) {
-      if (axios.isAxiosError(error)) {
-        if (error.response?.data?.error) {
-          alert(`Execution Error: ${error.response.data.error}`);
-        }
-        console.error("Axios error:\n", error);
-      } else {
-        console.error("Unknown error:\n", error);
+      if (error instanceof Error) {
+        alert(`Execution Error: ${error.message}`);
       }
+      console.error("Stream error:\n", error);
     }
   }
     
@@ -54,7 +65,7 @@ const App: FC = () => {
       </div>
       <div className="split-screen-container">
         <div className="left">
-          <CodeWindow parseCode={parseCode} highlightedLine={highlightedLine} code={code} isProcessing={isProcessing} setIsProcessing={setIsProcessing}/>
+          <CodeWindow parseCode={parseCode} highlightedLine={highlightedLine} code={code} isProcessing={isProcessing} setIsProcessing={setIsProcessing} profile={profile}/>
         </div>
 
         <div className="right">
@@ -67,6 +78,7 @@ const App: FC = () => {
               initialArray={initialArray} 
               manipulations={manipulations} 
               lineNums={lineNums}
+              complete={complete}
               setHighlightedLine={setHighlightedLine}
               isProcessing={isProcessing}
               setIsProcessing={setIsProcessing} 
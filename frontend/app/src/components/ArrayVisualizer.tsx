@@ -1,4 +1,4 @@
-import { useState, useRef } from 'react';
+import { useState, useRef, useMemo } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { Manipulation } from '../utils/manipulateTypes';
 import { arrayItemVariants } from '../animations/arrayItemVariants';
@@ -7,6 +7,8 @@ import '../styles/ArrayVisualizer.css';
 import '../styles/App.css';
 import { v4 as uuidv4 } from 'uuid';
 import Variables from './Variables';
+import CallStack from './CallStack';
+import { buildCallTree, collapseRepeats } from '../utils/callTree';
 
 interface Item<T> {
   id: string;
@@ -17,6 +19,7 @@ interface ArrayVisualizerProps<T> {
   initialArray: T[];
   manipulations: Manipulation<T>[];
   lineNums: number[];
+  complete: boolean;
   setHighlightedLine: (line: number | null) => void;
   isProcessing: boolean;
   setIsProcessing: (isProcessing: boolean) => void;
@@ -26,6 +29,7 @@ const ArrayVisualizer = <T,>({
   initialArray,
   manipulations,
   lineNums,
+  complete,
   setHighlightedLine,
   isProcessing,
   setIsProcessing,
@@ -42,8 +46,22 @@ const ArrayVisualizer = <T,>({
   const [swappedIDs, setSwappedIDs] = useState<[string, string] | null>(null);
   const [replacedID, setReplacedID] = useState<string | null>(null);
   const [removedID, setRemovedID] = useState<string | null>(null);
+  const [comparedIDs, setComparedIDs] = useState<string[]>([]);
+  // Items read since the last compare event, which highlights them
+  const readIDsRef = useRef<string[]>([]);
   const [hasRun, setHasRun] = useState(false);
   const [variables, setVariables] = useState<{ [key: string]: unknown }>({});
+  const [callStack, setCallStack] = useState<{ name: string; args: Record<string, unknown> }[]>([]);
+  const [callStep, setCallStep] = useState(-1);
+  // Built once the whole trace is in, as collapsing needs every subtree finished
+  const callTree = useMemo(
+    () => (complete ? collapseRepeats(buildCallTree(manipulations)) : []),
+    [manipulations, complete],
+  );
+
+  // The trace keeps growing while it streams in; processNext always reads the latest
+  const traceRef = useRef({ manipulations, lineNums, complete });
+  traceRef.current = { manipulations, lineNums, complete };
 
   const dynamicSize = Math.max(20, 80 - displayItems.length * 5);
 
@@ -61,6 +79,7 @@ const ArrayVisualizer = <T,>({
     let delay = 400;
 
     const processNext = () => {
+      const { manipulations, lineNums, complete } = traceRef.current;
       if (currentIndex < manipulations.length) {
         const instruction = manipulations[currentIndex];
         const lineNum = lineNums[currentIndex];
@@ -68,7 +87,16 @@ const ArrayVisualizer = <T,>({
 
         setHighlightedLine(lineNum);
 
-        if (instruction.type === 'append') {
+        if (
+          instruction.type !== 'variable' &&
+          instruction.type !== 'compare' &&
+          instruction.type !== 'call' &&
+          instruction.type !== 'return' &&
+          (instruction.array ?? 0) !== 0
+        ) {
+          // Another list the program created; only the submitted array is animated
+          delay = 0;
+        } else if (instruction.type === 'append') {
           const newItem: Item<T> = {
             id: uuidv4(),
             value: instruction.value,
@@ -76,14 +104,29 @@ const ArrayVisualizer = <T,>({
           const newItems = [...currentItemsRef.current, newItem];
           updateItems(newItems);
         } else if (instruction.type === 'pop') {
-          const newItems = [...currentItemsRef.current];
-          newItems.pop();
-          updateItems(newItems);
+          // Slice assignment, del and += come as pops and inserts anywhere in the array
+          const items = currentItemsRef.current;
+          const index = instruction.index < 0 ? items.length + instruction.index : instruction.index;
+          updateItems(items.filter((_, i) => i !== index));
+        } else if (instruction.type === 'insert') {
+          const items = currentItemsRef.current;
+          const from = instruction.index < 0 ? items.length + instruction.index : instruction.index;
+          const index = Math.max(0, Math.min(from, items.length));
+          const newItem: Item<T> = { id: uuidv4(), value: instruction.value };
+          updateItems([...items.slice(0, index), newItem, ...items.slice(index)]);
+        } else if (instruction.type === 'extend') {
+          const newItems = instruction.value.map((value) => ({ id: uuidv4(), value }));
+          updateItems([...currentItemsRef.current, ...newItems]);
         } else if (instruction.type === 'reverse') {
           const newItems = [...currentItemsRef.current].reverse();
           updateItems(newItems);
           setReverseTrigger((prev) => !prev);
           delay = 1000;
+        } else if (instruction.type === 'sort') {
+          // Items keep their ids, so every element animates to where the sort put it
+          const newItems = instruction.permutation.map((i) => currentItemsRef.current[i]);
+          updateItems(newItems);
+          delay = 1000;
         } else if (instruction.type === 'swap') {
           const [i, j] = instruction.indices;
           if (
@@ -152,6 +195,27 @@ const ArrayVisualizer = <T,>({
               setRemovedID(null);
             }, 700);
           }
+        } else if (instruction.type === 'read') {
+          const item = currentItemsRef.current[instruction.index];
+          if (item) readIDsRef.current.push(item.id);
+          delay = 0;
+        } else if (instruction.type === 'compare') {
+          setComparedIDs(readIDsRef.current);
+          readIDsRef.current = [];
+          delay = 600;
+          setTimeout(() => {
+            setComparedIDs([]);
+          }, 500);
+        } else if (instruction.type === 'call') {
+          const { name, args, depth } = instruction;
+          setCallStack((prev) => [...prev.slice(0, depth - 1), { name, args }]);
+          setCallStep(currentIndex);
+          delay = 250;
+        } else if (instruction.type === 'return') {
+          const { depth } = instruction;
+          setCallStack((prev) => prev.slice(0, depth - 1));
+          setCallStep(currentIndex);
+          delay = 0;
         } else if (instruction.type === 'variable') {
           const { name, value } = instruction;
           setVariables((prev) => ({ ...prev, [name]: value }));
@@ -160,6 +224,9 @@ const ArrayVisualizer = <T,>({
         }
         currentIndex += 1;
         setTimeout(processNext, delay);
+      } else if (!complete) {
+        // Caught up with the stream; wait for the next chunk
+        setTimeout(processNext, 100);
       } else {
         processingRef.current = false;
         setIsProcessing(false);
@@ -189,10 +256,13 @@ const ArrayVisualizer = <T,>({
               const isSwapped = swappedIDs !== null && (swappedIDs[0] === item.id || swappedIDs[1] === item.id);
               const isReplaced = replacedID === item.id;
               const isRemoved = removedID === item.id;
+              const isCompared = comparedIDs.includes(item.id);
               const animateProp = isRemoved
                 ? { opacity: 1, y: 0, scale: [1, 0.8, 0] }
                 : isSwapped || isReplaced
                 ? { opacity: 1, y: 0, scale: [1, 1.2, 1] }
+                : isCompared
+                ? { opacity: 1, y: [0, -12, 0], scale: 1 }
                 : 'animate';
               return (
                 <motion.div
@@ -217,6 +287,7 @@ const ArrayVisualizer = <T,>({
         </motion.div>
 
         <Variables variables={variables} />
+        {callStep >= 0 && <CallStack frames={callStack} tree={callTree} step={callStep} />}
       </div>
 
       <div className="visualize-button-container">
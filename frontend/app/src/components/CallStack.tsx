@@ -0,0 +1,72 @@
+import React from "react";
+import { CallNode } from "../utils/callTree";
+import "../styles/CallStack.css";
+
+interface CallStackProps {
+  frames: { name: string; args: Record<string, unknown> }[];
+  // The finished run's recursion tree with repeated subtrees collapsed (see collapseRepeats)
+  tree: CallNode[];
+  // Step of the last event played; calls that start after it aren't shown yet
+  step: number;
+}
+
+const formatCall = (node: { name: string; args: Record<string, unknown> }) =>
+  `${node.name}(${Object.entries(node.args)
+    .map(([name, value]) => `${name}=${JSON.stringify(value)}`)
+    .join(", ")})`;
+
+const CallTreeNode: React.FC<{ node: CallNode; step: number }> = ({ node, step }) => {
+  const returned = node.end !== null && node.end <= step;
+  const children = node.children.filter((child) => child.start <= step);
+  return (
+    <li>
+      <span className={returned ? "call-tree-call" : "call-tree-call call-tree-open"}>
+        {formatCall(node)}
+        {returned && ` → ${JSON.stringify(node.value)}`}
+      </span>
+      {node.repeatOf !== undefined && (
+        <span className="call-tree-repeat"> same as step {node.repeatOf}</span>
+      )}
+      {children.length > 0 && (
+        <ul>
+          {children.map((child) => (
+            <CallTreeNode key={child.start} node={child} step={step} />
+          ))}
+        </ul>
+      )}
+    </li>
+  );
+};
+
+// The calls in progress at the current step, innermost at the top, and the recursion tree so far
+const CallStack: React.FC<CallStackProps> = ({ frames, tree, step }) => {
+  const roots = tree.filter((node) => node.start <= step);
+  return (
+    <div className="call-stack-container">
+      <h3>Call Stack</h3>
+      <div className="call-stack-frames">
+        {[...frames].reverse().map((frame, i) => (
+          <div key={frames.length - i} className="call-stack-frame">
+            <span className="call-stack-name">{frame.name}</span>(
+            {Object.entries(frame.args)
+              .map(([name, value]) => `${name}=${JSON.stringify(value)}`)
+              .join(", ")}
+            )
+          </div>
+        ))}
+      </div>
+      {roots.length > 0 && (
+        <>
+          <h3>Recursion Tree</h3>
+          <ul className="call-tree">
+            {roots.map((node) => (
+              <CallTreeNode key={node.start} node={node} step={step} />
+            ))}
+          </ul>
+        </>
+      )}
+    </div>
+  );
+};
+
+export default CallStack;
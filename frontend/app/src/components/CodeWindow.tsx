@@ -5,6 +5,10 @@ import "codemirror/mode/python/python";
 import "codemirror/theme/oceanic-next.css";
 import "../styles/CodeWindow.css";
 import { useRef, useEffect } from "react";
+import { LineProfile } from "../utils/traceStream";
+
+// Shades of the line heatmap; a line's shade is its share of the slowest line's time
+const HEAT_LEVELS = 5;
 
 interface CodeWindowProps {
   parseCode: (code: string) => void;
@@ -12,11 +16,13 @@ interface CodeWindowProps {
   code: string;
   isProcessing: boolean;
   setIsProcessing: (isProcessing: boolean) => void;
+  profile?: LineProfile | null;
 }
 
-export default function CodeWindow({ parseCode, highlightedLine, code, isProcessing, setIsProcessing }: CodeWindowProps) {
+export default function CodeWindow({ parseCode, highlightedLine, code, isProcessing, setIsProcessing, profile }: CodeWindowProps) {
   const editorRef = useRef<Editor | null>(null);
   const prevHighlightRef = useRef<number | null>(null);
+  const heatLinesRef = useRef<[number, string][]>([]);
 
   const options = {
     lineNumbers: true,
@@ -54,6 +60,27 @@ export default function CodeWindow({ parseCode, highlightedLine, code, isProcess
     }
   }, [isProcessing]);
 
+  useEffect(() => {
+    const editor = editorRef.current;
+    if (!editor) return;
+    for (const [line, className] of heatLinesRef.current) {
+      editor.removeLineClass(line, "wrap", className);
+    }
+    heatLinesRef.current = [];
+    if (!profile) return;
+
+    const slowest = Math.max(0, ...profile.time_ns.slice(1));
+    if (slowest === 0) return;
+    const lineCount = editor.lineCount();
+    profile.time_ns.forEach((ns, lineNumber) => {
+      if (lineNumber === 0 || lineNumber > lineCount || ns === 0) return;
+      const level = Math.ceil((ns / slowest) * HEAT_LEVELS);
+      const className = `heat-line-${level}`;
+      editor.addLineClass(lineNumber - 1, "wrap", className);
+      heatLinesRef.current.push([lineNumber - 1, className]);
+    });
+  }, [profile]);
+
   useEffect(() => {
     if (editorRef.current) {
       editorRef.current.setValue(code);
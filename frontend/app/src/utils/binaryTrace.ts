@@ -0,0 +1,60 @@
+// binaryTrace.ts
+// Decodes the binary trace format (backend/binary.py), which /api/submit_code returns with
+// ?format=binary, into the response fields and a columnar trace for fromColumns.
+
+import { ColumnarTrace } from './columnar';
+
+export const BINARY_MEDIA_TYPE = 'application/vnd.imaginarray.trace';
+
+const COLUMNS = ['shape', 'line', 'array', 'index', 'index2', 'value', 'name', 'state_steps'] as const;
+
+export const decodeBinaryTrace = (
+  buffer: ArrayBuffer,
+): { fields: Record<string, unknown>; trace: ColumnarTrace } => {
+  const bytes = new Uint8Array(buffer);
+  const magic = String.fromCharCode(...bytes.subarray(0, 4));
+  if (magic !== 'IMTR' || bytes[4] !== 2) throw new Error('Not a version 2 binary trace');
+
+  let pos = 5;
+  const varint = (): number => {
+    let n = 0;
+    let scale = 1;
+    for (;;) {
+      const byte = bytes[pos++];
+      n += (byte & 0x7f) * scale;
+      if (byte < 0x80) return n;
+      scale *= 128;
+    }
+  };
+
+  const headerLength = varint();
+  const header = JSON.parse(new TextDecoder().decode(bytes.subarray(pos, pos + headerLength)));
+  pos += headerLength;
+
+  const columns: Record<string, number[]> = {};
+  for (const name of COLUMNS) {
+    const count = varint();
+    const numbers = new Array<number>(count);
+    for (let i = 0; i < count; i++) numbers[i] = varint();
+    columns[name] = numbers;
+  }
+  const unzigzag = (n: number) => (n % 2 === 0 ? n / 2 : -(n + 1) / 2);
+  let step = 0;
+
+  const { shapes, values, states, extra, ...fields } = header;
+  const trace: ColumnarTrace = {
+    shapes,
+    values,
+    states,
+    extra,
+    shape: columns.shape,
+    line: columns.line.map((l) => (l === 0 ? null : l - 1)),
+    array: columns.array,
+    index: columns.index.map(unzigzag),
+    index2: columns.index2.map(unzigzag),
+    value: columns.value,
+    name: columns.name,
+    state_steps: columns.state_steps.map((gap) => (step += gap)),
+  };
+  return { fields, trace };
+};
@@ -0,0 +1,82 @@
+// callTree.ts
+// Builds the recursion tree from a trace's "call" and "return" events (recorded with
+// calls: true), and collapses subtrees that repeat an earlier one, such as the same
+// fib(n) computed again or the same range sorted twice.
+
+type CallEvent = {
+  type: string;
+  name?: string;
+  depth?: number;
+  args?: Record<string, unknown>;
+  value?: unknown;
+};
+
+export type CallNode = {
+  name: string;
+  args: Record<string, unknown>;
+  depth: number;
+  // Steps of the call and return events; end is null for a call that raised or is still running
+  start: number;
+  end: number | null;
+  value?: unknown;
+  children: CallNode[];
+  // Set on a collapsed subtree: the start step of the identical subtree it repeats
+  repeatOf?: number;
+};
+
+export const buildCallTree = (manipulations: CallEvent[]): CallNode[] => {
+  const roots: CallNode[] = [];
+  const stack: CallNode[] = [];
+  manipulations.forEach((m, step) => {
+    if (m.type === 'call') {
+      const depth = m.depth!;
+      // Calls left open by an exception end where a shallower or equal call starts
+      stack.length = Math.min(stack.length, depth - 1);
+      const node: CallNode = { name: m.name!, args: m.args ?? {}, depth, start: step, end: null, children: [] };
+      (stack.length ? stack[stack.length - 1].children : roots).push(node);
+      stack.push(node);
+    } else if (m.type === 'return') {
+      const node = stack[m.depth! - 1];
+      if (node) {
+        node.end = step;
+        node.value = m.value;
+      }
+      stack.length = Math.min(stack.length, m.depth! - 1);
+    }
+  });
+  return roots;
+};
+
+// The tree with every subtree equal to an earlier one (same calls, arguments and return
+// values all the way down) replaced by a childless node pointing at its first occurrence
+export const collapseRepeats = (roots: CallNode[]): CallNode[] => {
+  // Subtree signatures are interned to ids, so a parent's signature stays short
+  const ids = new Map<string, number>();
+  const signatures = new Map<CallNode, number>();
+  const firstStart = new Map<number, number>();
+
+  const signature = (node: CallNode): number => {
+    const childIds = node.children.map(signature);
+    const key = `${node.name}|${JSON.stringify(node.args)}|${JSON.stringify(node.value)}|${childIds.join(',')}`;
+    let id = ids.get(key);
+    if (id === undefined) {
+      id = ids.size;
+      ids.set(key, id);
+    }
+    signatures.set(node, id);
+    return id;
+  };
+  roots.forEach(signature);
+
+  const collapse = (node: CallNode): CallNode => {
+    const id = signatures.get(node)!;
+    const first = firstStart.get(id);
+    if (first !== undefined && first !== node.start) {
+      return { ...node, children: [], repeatOf: first };
+    }
+    firstStart.set(id, node.start);
+    return { ...node, children: node.children.map(collapse) };
+  };
+
+  return roots.map(collapse);
+};
@@ -0,0 +1,52 @@
+// columnar.ts
+// Decodes the columnar trace format (backend/columnar.py), which /api/submit_code returns
+// under "trace" when asked with ?format=columnar.
+
+export const COLUMNAR_MEDIA_TYPE = 'application/vnd.imaginarray.columnar+json';
+
+export type ColumnarTrace = {
+  shapes: [string, string[]][];
+  values: unknown[];
+  shape: number[];
+  line: (number | null)[];
+  array: number[];
+  index: number[];
+  index2: number[];
+  value: number[];
+  name: number[];
+  state_steps: number[];
+  states: unknown[][];
+  extra: Record<string, Record<string, unknown>>;
+};
+
+export const fromColumns = (
+  trace: ColumnarTrace,
+): { manipulations: Record<string, unknown>[]; lineNums: number[] } => {
+  const { values } = trace;
+  const states = new Map<number, unknown[]>();
+  trace.state_steps.forEach((step, i) => states.set(step, trace.states[i]));
+
+  // Field columns only hold entries for the events whose shape has the field
+  let array = 0;
+  let index = 0;
+  let index2 = 0;
+  let value = 0;
+  let name = 0;
+  const manipulations = trace.shape.map((code, step) => {
+    const [type, fields] = trace.shapes[code];
+    const m: Record<string, unknown> = { type };
+    const line = trace.line[step];
+    if (line !== null) m.line = line;
+    for (const field of fields) {
+      if (field === 'array') m.array = trace.array[array++];
+      else if (field === 'index') m.index = trace.index[index++];
+      else if (field === 'indices') m.indices = [trace.index[index++], trace.index2[index2++]];
+      else if (field === 'name') m.name = values[trace.name[name++]];
+      else m[field] = values[trace.value[value++]];
+    }
+    const state = states.get(step);
+    if (state) m.state = state;
+    return Object.assign(m, trace.extra[step]);
+  });
+  return { manipulations, lineNums: trace.line.filter((l): l is number => l !== null) };
+};
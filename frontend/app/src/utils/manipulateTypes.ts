@@ -10,12 +10,34 @@ export interface SwapManipulation {
     indices: [number, number];
 }
 
-export interface PopManipulation {
+// index is where the value was popped from, negative counting from the end as in Python
+export interface PopManipulation<T> {
     type: 'pop';
+    index: number;
+    popped: T;
+}
+
+// Python's list.insert: index is clamped to the array, negative counting from the end
+export interface InsertManipulation<T> {
+    type: 'insert';
+    index: number;
+    value: T;
+}
+
+export interface ExtendManipulation<T> {
+    type: 'extend';
+    value: T[];
 }
 
 export interface ReverseManipulation {
     type: 'reverse';
+    permutation: number[];
+}
+
+// The array after the sort is permutation.map((i) => old[i])
+export interface SortManipulation {
+    type: 'sort';
+    permutation: number[];
 }
 
 export interface ReplaceManipulation<T> {
@@ -38,6 +60,41 @@ export interface DeleteManipulation {
     index: number;
 }
 
+// Declares another list the program created (array id > 0), with its contents
+export interface NewArrayManipulation<T> {
+    type: 'new_array';
+    state: T[];
+    parent?: number;
+    index?: number;
+}
+
+// Recorded with record_reads: an index read, and a comparison of the elements read before it
+export interface ReadManipulation {
+    type: 'read';
+    index: number;
+}
+
+export interface CompareManipulation {
+    type: 'compare';
+    op: string;
+    result: unknown;
+}
+
+// Recorded with calls: a call of a function the program defines, and its return
+export interface CallManipulation {
+    type: 'call';
+    name: string;
+    depth: number;
+    args: Record<string, unknown>;
+}
+
+export interface ReturnManipulation<T> {
+    type: 'return';
+    name: string;
+    depth: number;
+    value: T;
+}
+
 export interface VariableManipulation<T> {
     type: 'variable';
     name: string;
@@ -45,13 +102,23 @@ export interface VariableManipulation<T> {
 }
 
 
-export type Manipulation<T> = 
+// array is the id of the list an event happened to (0, or missing, for the submitted array)
+export type Manipulation<T> = (
     | AppendManipulation<T>
-    | PopManipulation
+    | PopManipulation<T>
+    | InsertManipulation<T>
+    | ExtendManipulation<T>
     | ReverseManipulation
+    | SortManipulation
     | SwapManipulation
     | ReplaceManipulation<T>
     | ClearManipulation
     | RemoveManipulation<T>
     | DeleteManipulation
-    | VariableManipulation<T>;
\ No newline at end of file
+    | NewArrayManipulation<T>
+    | ReadManipulation
+    | CompareManipulation
+    | CallManipulation
+    | ReturnManipulation<T>
+    | VariableManipulation<T>
+) & { array?: number };
\ No newline at end of file
@@ -0,0 +1,79 @@
+// race.ts
+// Fetches /api/race and plays its lanes in lockstep: every lane's events carry the operation
+// count they happened at ("clock"), so one shared clock value says how far each lane has got.
+
+import { reconstructState } from './replay';
+
+export type RaceCounters = {
+  reads: number;
+  writes: number;
+  swaps: number;
+  comparisons: number;
+  lines: number | null;
+};
+
+export type RaceLane =
+  | {
+      name: string;
+      final_arr: unknown[];
+      manipulations: { type: string; line: number }[];
+      line_nums: number[];
+      clock: number[];
+      counters: RaceCounters;
+      truncated: boolean;
+      truncation_reason: string | null;
+    }
+  | { name: string; error: string };
+
+export type RaceResult = {
+  initial_arr: unknown[];
+  keyframe_interval: number | null;
+  lanes: RaceLane[];
+};
+
+export const fetchRace = async (body: {
+  programs: { name: string; code: string[] }[];
+  initial_arr?: unknown[];
+  [option: string]: unknown;
+}): Promise<RaceResult> => {
+  const response = await fetch('/api/race', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  const data = await response.json();
+  if (!response.ok) throw new Error(data.error || `Request failed with status ${response.status}`);
+  return data;
+};
+
+// Operation count at which a lane is done: everything it read, compared and wrote
+export const laneFinish = (lane: RaceLane): number =>
+  'error' in lane ? 0 : lane.counters.reads + lane.counters.comparisons + lane.counters.writes;
+
+// Index of the lane's last event at or before clock, or -1 if it hasn't had one yet
+export const stepAt = (lane: RaceLane, clock: number): number => {
+  if ('error' in lane) return -1;
+  let lo = 0;
+  let hi = lane.clock.length;
+  while (lo < hi) {
+    const mid = (lo + hi) >> 1;
+    if (lane.clock[mid] <= clock) lo = mid + 1;
+    else hi = mid;
+  }
+  return lo - 1;
+};
+
+// Every lane's array at clock, for drawing one lockstep frame
+export const raceFrame = (race: RaceResult, clock: number): unknown[][] =>
+  race.lanes.map((lane) => {
+    const step = stepAt(lane, clock);
+    if ('error' in lane || step < 0) return [...race.initial_arr];
+    return reconstructState(race.initial_arr, lane.manipulations, step);
+  });
+
+// frameCount evenly spaced clock values from the start to the slowest lane's finish
+export const raceClocks = (race: RaceResult, frameCount: number): number[] => {
+  const end = Math.max(0, ...race.lanes.map(laneFinish));
+  if (frameCount < 2) return [end];
+  return Array.from({ length: frameCount }, (_, k) => Math.round((end * k) / (frameCount - 1)));
+};
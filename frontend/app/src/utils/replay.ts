@@ -0,0 +1,109 @@
+// replay.ts
+// Client-side mirror of backend/replay.py: rebuilds the array at any step of a
+// (possibly delta-encoded) trace.
+
+// "array" id of the submitted array; events of the other arrays a program creates are skipped
+const MAIN_ARRAY = 0;
+
+type TraceEvent = {
+  type: string;
+  array?: number;
+  name?: string;
+  state?: unknown[];
+  index?: number;
+  indices?: [number, number];
+  value?: unknown;
+  permutation?: number[];
+};
+
+// Event types that aren't about any one array (backend/replay.py NON_ARRAY_EVENTS)
+const NON_ARRAY_EVENTS = new Set(['variable', 'compare', 'call', 'return']);
+
+const isMainEvent = (m: TraceEvent): boolean =>
+  !NON_ARRAY_EVENTS.has(m.type) && (m.array ?? MAIN_ARRAY) === MAIN_ARRAY;
+
+export const applyManipulation = (state: unknown[], m: TraceEvent): unknown[] => {
+  if (m.state) {
+    state.splice(0, state.length, ...m.state);
+    return state;
+  }
+  const at = (i: number) => (i < 0 ? state.length + i : i);
+  switch (m.type) {
+    case 'append':
+      state.push(m.value);
+      break;
+    case 'pop':
+      state.splice(at(m.index!), 1);
+      break;
+    case 'replace':
+      state[at(m.index!)] = m.value;
+      break;
+    case 'swap': {
+      const [i, j] = m.indices!.map(at);
+      [state[i], state[j]] = [state[j], state[i]];
+      break;
+    }
+    case 'insert':
+      state.splice(at(m.index!), 0, m.value);
+      break;
+    case 'remove': {
+      const idx = state.findIndex((v) => JSON.stringify(v) === JSON.stringify(m.value));
+      if (idx !== -1) state.splice(idx, 1);
+      break;
+    }
+    case 'extend':
+      state.push(...(m.value as unknown[]));
+      break;
+    case 'reverse':
+      state.reverse();
+      break;
+    case 'sort': {
+      const before = [...state];
+      m.permutation!.forEach((from, to) => {
+        state[to] = before[from];
+      });
+      break;
+    }
+  }
+  return state;
+};
+
+export const reconstructState = (
+  initialArray: unknown[],
+  manipulations: TraceEvent[],
+  step: number,
+): unknown[] => {
+  let start = step;
+  while (start >= 0 && !(manipulations[start].state && isMainEvent(manipulations[start]))) start -= 1;
+
+  const state = start >= 0 ? [...manipulations[start].state!] : [...initialArray];
+  for (let s = start + 1; s <= step; s++) {
+    if (isMainEvent(manipulations[s])) applyManipulation(state, manipulations[s]);
+  }
+  return state;
+};
+
+// Seek index the backend attaches to delta traces (backend/replay.py build_index)
+export type TraceIndex = {
+  interval: number;
+  keyframes: { step: number; state: unknown[]; variables: Record<string, unknown> }[];
+  lines: Record<string, number[]>;
+};
+
+// Array and variables right after manipulations[step], replaying fewer than
+// index.interval events from the nearest keyframe
+export const seekState = (
+  manipulations: TraceEvent[],
+  index: TraceIndex,
+  step: number,
+): { state: unknown[]; variables: Record<string, unknown> } => {
+  const keyframe = index.keyframes[Math.floor(step / index.interval)];
+  const state = [...keyframe.state];
+  const variables = { ...keyframe.variables };
+  for (let s = keyframe.step + 1; s <= step; s++) {
+    const m = manipulations[s];
+    if (m.type === 'variable') variables[m.name!] = m.value;
+    else if (isMainEvent(m)) applyManipulation(state, m);
+  }
+  return { state, variables };
+};
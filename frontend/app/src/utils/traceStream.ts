@@ -0,0 +1,48 @@
+// traceStream.ts
+// Reads /api/submit_code_stream's newline-delimited JSON records as they arrive, so the
+// visualizer can start before the whole trace has been produced.
+
+// Hits and nanoseconds per line, indexed by line number (backend/lineprofile.py)
+export type LineProfile = { hits: number[]; time_ns: number[] };
+
+export type StreamRecord =
+  | { type: 'start'; initial_arr: unknown[]; keyframe_interval: number | null }
+  | { type: 'events'; start: number; manipulations: unknown[]; line_nums: number[] }
+  | {
+      type: 'done';
+      final_arr: unknown[];
+      truncated: boolean;
+      truncation_reason: string | null;
+      profile?: LineProfile | null;
+    }
+  | { type: 'error'; error: string };
+
+export const streamTrace = async (
+  body: object,
+  onRecord: (record: StreamRecord) => void,
+): Promise<void> => {
+  const response = await fetch('/api/submit_code_stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json' },
+    body: JSON.stringify(body),
+  });
+  if (!response.ok || !response.body) {
+    const data = await response.json().catch(() => ({}));
+    throw new Error(data.error || `Request failed with status ${response.status}`);
+  }
+
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffered = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    buffered += decoder.decode(value, { stream: !done });
+    const lines = buffered.split('\n');
+    buffered = lines.pop() ?? '';
+    for (const line of lines) {
+      if (line.trim()) onRecord(JSON.parse(line));
+    }
+    if (done) break;
+  }
+  if (buffered.trim()) onRecord(JSON.parse(buffered));
+};